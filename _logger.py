@@ -1,12 +1,148 @@
 from typing import Any, Dict, Optional, List
+import atexit
+import copy
+import json
 import logging
 from logging import Logger
+from logging.handlers import QueueHandler, QueueListener
+import os
+from queue import SimpleQueue
 import sys
+import threading
+
+PALETTE = {
+    "Bright_Yellow": "\x1b[93;1m",
+    "Yellow": "\x1b[33;1m",
+    "Yellow_in_Blue": "\x1b[1;33;4;44m",
+    "Green": "\x1b[32;1m",
+    "Light_Green": "\x1b[92;1m",
+    "Red": "\x1b[31;1m",
+    "Light_Red": "\x1b[31;1m",
+    "Cyan": "\x1b[36;1m",
+    "Blue": "\x1b[34;1m",
+    "Light_Purple": "\x1b[95;1m",
+    "Brown": "\x1b[33;0m",
+}
+# --log-color: None is auto ( stderr is terminal and NO_COLOR is not set )
+_color: Optional[bool] = None
+_pipeline: Dict[str, Any] = {}
+_pipeline_lock = threading.Lock()
+
+
+def set_color(mode: str):
+    """
+    Color of messages: auto, always or never
+    """
+    global _color
+    _color = {'always': True, 'never': False}.get(mode)
+
+
+def color_enabled() -> bool:
+    if _color is not None:
+        return _color
+    return not os.environ.get('NO_COLOR') and sys.stderr.isatty()
+
+
+def paint(text: str, color: str) -> str:
+    """
+    Text wrapped in color of palette for output outside of logging, only when color is enabled
+    """
+    return f"{PALETTE[color]}{text}\x1b[0m" if color_enabled() else text
+
+
+class Lazy:
+    """
+    Argument of log message computed only when record is logged, e.g. bodies for debug logs
+    """
+    __slots__ = ('func', 'args', 'kwargs')
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+
+def lazy_json(data) -> Lazy:
+    return Lazy(json.dumps, data, indent=4)
+
+
+def lazy_lines(items) -> Lazy:
+    return Lazy(lambda: '\n- '.join(map(str, items)))
+
+
+class ColorFormatter(logging.Formatter):
+    """
+    Message of DeployLogger.colored is wrapped in color when record is formatted, only when color is enabled
+    """
+    def __init__(self, fmt: str, datefmt: Optional[str] = None, color: Optional[bool] = None):
+        super().__init__(fmt, datefmt)
+        self.color = color
+
+    def formatMessage(self, record):
+        palette = PALETTE.get(getattr(record, 'color', None))
+        if palette and (color_enabled() if self.color is None else self.color):
+            record = copy.copy(record)
+            record.message = f"{palette}{record.message}\x1b[0m"
+        return super().formatMessage(record)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Only message arguments are rendered in calling thread ( objects may change after call ),
+    time, level, color and traceback are formatted by listener thread
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def start_logging(fmt: str, datefmt: str, stream, replace_format: bool = False):
+    """
+    Root logger puts records to queue and listener thread writes them to stream, threads never
+    block on log I/O. Does nothing when logging is configured already ( like logging.basicConfig ),
+    running pipeline takes format with replace_format
+    """
+    with _pipeline_lock:
+        root = logging.getLogger()
+        if _pipeline and replace_format:
+            _pipeline['stream_handler'].setFormatter(ColorFormatter(fmt, datefmt))
+        if _pipeline or root.handlers:
+            return
+        stream_handler = logging.StreamHandler(stream)
+        stream_handler.setFormatter(ColorFormatter(fmt, datefmt))
+        queue = SimpleQueue()
+        queue_handler = DeferredQueueHandler(queue)
+        listener = QueueListener(queue, stream_handler, respect_handler_level=True)
+        root.addHandler(queue_handler)
+        listener.start()
+        _pipeline.update(stream_handler=stream_handler, queue_handler=queue_handler, listener=listener)
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """
+    Writes queued records, records logged later ( atexit handlers ) are written synchronously
+    """
+    with _pipeline_lock:
+        if not _pipeline:
+            return
+        root = logging.getLogger()
+        root.addHandler(_pipeline['stream_handler'])
+        root.removeHandler(_pipeline['queue_handler'])
+        _pipeline['listener'].stop()
+        _pipeline.clear()
 
 
 class DeployLogger:
-    def __init__(self, loglvl: str = "INFO", name: str = "deploy"):
-        self.format = "%(asctime)s %(levelname)s: %(message)s"
+    def __init__(self, loglvl: str = "INFO", name: str = "deploy", fmt: Optional[str] = None):
+        self.format = fmt or "%(asctime)s %(levelname)s: %(message)s"
+        # Explicit format of logger replaces format of running pipeline ( matrix, daemon )
+        self.replace_format = fmt is not None
         self.datefmt = "%H:%M:%S"
         self.streem = sys.stderr
         self.name = name
@@ -14,7 +150,7 @@ class DeployLogger:
         self.logger = self.getLogger()
 
     def getLogger(self):
-        logging.basicConfig(format=self.format, datefmt=self.datefmt, stream=self.streem)
+        start_logging(self.format, self.datefmt, self.streem, replace_format=self.replace_format)
         logger: Logger = logging.getLogger(self.name)
         logger.setLevel(self.loglvl)
         logging.getLogger("chardet.charsetprober").disabled = True
@@ -23,25 +159,13 @@ class DeployLogger:
 
     def colored(
             self, message: str, color: Optional[str] = None,
-            event_type: Optional[str] = None):
-        palette = {
-            "Bright_Yellow": "\x1b[93;1m",
-            "Yellow": "\x1b[33;1m",
-            "Yellow_in_Blue": "\x1b[1;33;4;44m",
-            "Green": "\x1b[32;1m",
-            "Light_Green": "\x1b[92;1m",
-            "Red": "\x1b[31;1m",
-            "Light_Red": "\x1b[31;1m",
-            "Cyan": "\x1b[36;1m",
-            "Light_Purple": "\x1b[95;1m",
-            "Brown": "\x1b[33;0m",
-        }.get(color)
-        log_message = f"{palette}{message}\x1b[0m"
-        if event_type == 'error':
-            log_message = f"{palette}{message}\x1b[0m"
-            self.logger.error(log_message)
-            return
-        self.logger.info(log_message)
+            event_type: Optional[str] = None, *args):
+        """
+        Message with optional %-style arguments, formatted only when level of logger is enabled
+        """
+        level = logging.ERROR if event_type == 'error' else logging.INFO
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, message, *args, extra={'color': color})
 
     # Black	30	40
     # Red	31	41
@@ -0,0 +1,254 @@
+#!python3
+"""
+End-to-end benchmark of overview, deploy, delete_previous and delete against local fake Compute API
+
+- python3 -m benchmarks.deploy --inventory 1000 --operation-latency 0.2 --repeat 3
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+import yaml
+from google.auth.credentials import AnonymousCredentials
+from _logger import DeployLogger
+from metadata import DeploymentMetadata
+from providers.gcp import GCP, GcpSession
+from release import Release
+from tracing import tracer, API, OPERATION
+import operations
+from benchmarks.fake_compute import FakeCompute
+
+PROJECT = 'bench-project'
+REGION = 'bench-region1'
+SERVICE = 'bench-app'
+
+
+class StaticIngresses:
+    """
+    Current versions of service instead of GKE ingresses
+    """
+    def __init__(self, *versions: str):
+        self.current_versions = {x.replace('.', '-').lower() for x in versions}
+        self.current_version = next(iter(self.current_versions)) if len(self.current_versions) == 1 else ''
+
+    def require_current_versions(self):
+        if not self.current_versions:
+            exit(3)
+
+
+class HealthEndpoint(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        payload = b'{"status": "ok"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def health_endpoints(count: int) -> List[ThreadingHTTPServer]:
+    """
+    Local health check endpoints of service instances ( forwarding rule addresses are 127.0.0.1 )
+    """
+    servers = []
+    for _ in range(count):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), HealthEndpoint)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def bench_metadata(ports: List[int]) -> Dict:
+    zone = f"https://www.googleapis.com/compute/v1/projects/{PROJECT}/zones/{REGION}-a"
+    return {
+        'gcp_project': {
+            'name': PROJECT, 'region': REGION, 'zones': [f"{REGION}-a"],
+            'service_account': f"deploy@{PROJECT}.iam.gserviceaccount.com",
+            'network': f"projects/{PROJECT}/global/networks/bench-vpc",
+            'subnetwork': f"projects/{PROJECT}/regions/{REGION}/subnetworks/bench-subnet",
+        },
+        'service_name': SERVICE,
+        'healthcheck_endpoint': '/healthcheck',
+        'service_instances': [
+            {'name': f"service{index:02d}", 'port': {'http': port}, 'healthcheck': ''}
+            for index, port in enumerate(ports)
+        ],
+        'gce_instance': {
+            'base_gcp_instance': 'bench-instance',
+            'base_instance_name': 'bench-vm',
+            'machine_type': 'e2-custom-2-8192',
+            'source_boot_disk': f"projects/{PROJECT}/zones/{REGION}-a/disks/bench-boot",
+            'source_data_disk': f"projects/{PROJECT}/zones/{REGION}-a/disks/bench-data",
+            'tags': ['bench'],
+        },
+        'gce_instance_group': {
+            'size': 2,
+            'targetSize': 2,
+            'autoHealing': {'initialDelaySec': 120, 'healthCheck': ''},
+            'distributionPolicy': {'targetShape': 'EVEN', 'zones': [{'zone': zone}]},
+            'scaling': {'mode': 'ON', 'maxNumReplicas': 3, 'minNumReplicas': 2, 'coolDownPeriodSec': 60,
+                        'cpuUtilizationTarget': 0.8, 'customMetricUtilizations': []},
+        },
+        'health_check': {'managed': True, 'type': 'TCP', 'checkIntervalSec': 5, 'timeoutSec': 5,
+                         'healthyThreshold': 2, 'unhealthyThreshold': 3},
+        'load_balancer': {'loadBalancingScheme': 'INTERNAL', 'protocol': 'TCP', 'sessionAffinity': 'NONE',
+                          'timeoutSec': 30, 'balancingMode': 'CONNECTION', 'drainingTimeoutSec': 0,
+                          'maxConnectionsPerInstance': 1000},
+        'gke_cluster': {'name': 'bench-cluster', 'namespace': 'bench'},
+    }
+
+
+class DeployBenchmark:
+    def __init__(self, args, logger):
+        self.args = args
+        self.logger = logger
+        self.fake = FakeCompute(
+            operation_latency=args.operation_latency,
+            stabilization_latency=args.stabilization_latency,
+            http_error_rate=args.http_error_rate,
+            operation_error_rate=args.operation_error_rate,
+            seed=args.seed)
+        self.servers = health_endpoints(args.instances)
+        metadata_file = os.path.join(os.getcwd(), 'bench_metadata.yaml')
+        with open(metadata_file, 'w') as file:
+            file.write(yaml.safe_dump(bench_metadata([x.server_address[1] for x in self.servers])))
+        self.metadata = DeploymentMetadata(metadata_file=metadata_file, logger=logger)
+        self.session = None
+
+    def gcp(self) -> GCP:
+        return GCP(metadata=self.metadata, gcp_token=None, logger=self.logger, service=SERVICE,
+                   operation_pull_interval=self.args.poll_interval, session=self.session)
+
+    def measure(self, scenario: str, function: Callable) -> Dict:
+        spans = len(tracer.finished_spans())
+        requests = sum(self.fake.requests.values())
+        start_time = time.perf_counter()
+        status = 'DONE'
+        try:
+            function()
+        except (Exception, SystemExit) as exc:
+            code = getattr(getattr(exc, 'resp', None), 'status', None)
+            status = f"FAILED {code}" if code else f"FAILED {type(exc).__name__}"
+        wall = time.perf_counter() - start_time
+        calls = [x for x in tracer.finished_spans()[spans:] if x.category == API]
+        return {
+            'scenario': scenario,
+            'status': status,
+            'wall': round(wall, 3),
+            'api_calls': len(calls),
+            'http_requests': sum(self.fake.requests.values()) - requests,
+            'operations': len([x for x in tracer.finished_spans()[spans:] if x.category == OPERATION]),
+            'methods': dict(Counter(x.name for x in calls).most_common()),
+        }
+
+    def delete(self, version: str):
+        gcp = self.gcp()
+        gcp.overview()
+        Release(service=SERVICE, version=version, metadata=self.metadata, logger=self.logger, gcp=gcp).delete()
+
+    def run(self) -> List[Dict]:
+        self.fake.start()
+        self.fake.populate(PROJECT, REGION, self.args.inventory)
+        self.session = GcpSession(None, self.logger, credentials=AnonymousCredentials(),
+                                  api_endpoint=self.fake.endpoint)
+        try:
+            # Previous releases of service deployed without latency and errors, versions are not
+            # substrings of resource names of each other ( release resources match by version )
+            knobs = ('operation_latency', 'stabilization_latency', 'http_error_rate', 'operation_error_rate')
+            configured = {x: getattr(self.fake, x) for x in knobs}
+            for knob in knobs:
+                setattr(self.fake, knob, 0)
+            for index in range(self.args.previous):
+                operations.deploy(SERVICE, f"0.{index + 1}.0", self.metadata, self.logger, self.gcp(),
+                                  StaticIngresses(), preflight=False)
+            for knob, value in configured.items():
+                setattr(self.fake, knob, value)
+            current = f"0.{self.args.previous}.0" if self.args.previous else ''
+            return [
+                self.measure('overview', lambda: self.gcp().overview()),
+                self.measure('deploy', lambda: operations.deploy(
+                    SERVICE, '1.0.0', self.metadata, self.logger, self.gcp(), StaticIngresses(current))),
+                self.measure('delete_previous', lambda: operations.delete_previous(
+                    SERVICE, self.metadata, self.logger, self.gcp(), StaticIngresses('1.0.0'))),
+                self.measure('delete', lambda: self.delete('1.0.0')),
+            ]
+        finally:
+            self.fake.stop()
+            for server in self.servers:
+                server.shutdown()
+
+
+def report(runs: List[List[Dict]], logger) -> List[Dict]:
+    """
+    Median of repeated runs per scenario
+    """
+    results = []
+    for scenario in [x['scenario'] for x in runs[0]]:
+        samples = [x for run in runs for x in run if x['scenario'] == scenario]
+        results.append({
+            'scenario': scenario,
+            'status': ', '.join(sorted({x['status'] for x in samples})),
+            'wall': round(statistics.median(x['wall'] for x in samples), 3),
+            'wall_min': min(x['wall'] for x in samples),
+            'wall_max': max(x['wall'] for x in samples),
+            'api_calls': int(statistics.median(x['api_calls'] for x in samples)),
+            'http_requests': int(statistics.median(x['http_requests'] for x in samples)),
+            'operations': int(statistics.median(x['operations'] for x in samples)),
+            'methods': samples[-1]['methods'],
+        })
+    logger.colored("{:<18} {:>9} {:>9} {:>9} {:>10} {:>10} {:>11}  {}".format(
+        'scenario', 'wall', 'min', 'max', 'api calls', 'requests', 'operations', 'status'), 'Light_Purple')
+    for x in results:
+        logger.colored("{:<18} {:>8.3f}s {:>8.3f}s {:>8.3f}s {:>10} {:>10} {:>11}  {}".format(
+            x['scenario'], x['wall'], x['wall_min'], x['wall_max'], x['api_calls'], x['http_requests'],
+            x['operations'], x['status']), 'Green' if x['status'] == 'DONE' else 'Red')
+    for x in results:
+        logger.logger.info("%s calls per method: %s", x['scenario'], json.dumps(x['methods'], indent=4))
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        prog='python3 -m benchmarks.deploy',
+        description='Benchmark of overview, deploy, delete_previous and delete against local fake Compute API')
+    arg_parser.add_argument('--inventory', type=int, default=100,
+                            help='services of other teams in project ( 2 releases, 11 resources each )')
+    arg_parser.add_argument('--previous', type=int, default=2, help='previous releases of service')
+    arg_parser.add_argument('--instances', type=int, default=3, help='service instances of release')
+    arg_parser.add_argument('--operation-latency', type=float, default=0.0, help='seconds operation is RUNNING')
+    arg_parser.add_argument('--stabilization-latency', type=float, default=0.0,
+                            help='seconds instance group is not stable')
+    arg_parser.add_argument('--http-error-rate', type=float, default=0.0, help='share of requests answered 503')
+    arg_parser.add_argument('--operation-error-rate', type=float, default=0.0,
+                            help='share of operations finished with error')
+    arg_parser.add_argument('--poll-interval', type=float, default=0.05,
+                            help='seconds between operation status requests')
+    arg_parser.add_argument('--repeat', type=int, default=1, help='runs of benchmark, median is reported')
+    arg_parser.add_argument('--seed', type=int, default=0, help='seed of injected errors')
+    arg_parser.add_argument('--output', type=str, help='json file with results')
+    arg_parser.add_argument('--log-lvl', default='WARN', type=str, choices=['INFO', 'WARN', 'DEBUG'])
+    args = arg_parser.parse_args()
+
+    logger = DeployLogger(loglvl=args.log_lvl, name='benchmark')
+    summary_logger = DeployLogger(loglvl='INFO', name='benchmark.summary')
+    output = os.path.abspath(args.output) if args.output else None
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        # Deploy history database is written to working directory
+        os.chdir(workdir)
+        for _ in range(args.repeat):
+            runs.append(DeployBenchmark(args, logger).run())
+    results = report(runs, summary_logger)
+    if output:
+        with open(output, 'w') as file:
+            file.write(json.dumps({'parameters': vars(args), 'results': results}, indent=4))
+    exit(0 if all(x['status'] == 'DONE' for x in results) else 3)
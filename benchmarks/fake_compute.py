@@ -0,0 +1,272 @@
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+# Collections of Compute API used by deploy ( global or regional )
+COLLECTIONS = [
+    'images', 'instanceTemplates', 'healthChecks', 'instanceGroupManagers', 'autoscalers',
+    'backendServices', 'forwardingRules', 'addresses', 'resourcePolicies',
+]
+SERVICE_PATH = '/compute/v1/'
+
+
+class FakeCompute:
+    """
+    In-process stand-in of Compute Engine REST API v1 for resources used by deploy:
+    images, instance templates, health checks, regional instance groups, autoscalers,
+    backend services, forwarding rules, addresses, resource policies and operations.
+    Operation latency, instance group stabilization, errors and inventory size are configurable
+    """
+    def __init__(
+            self,
+            operation_latency: float = 0.0,
+            stabilization_latency: float = 0.0,
+            http_error_rate: float = 0.0,
+            operation_error_rate: float = 0.0,
+            address: str = '127.0.0.1',
+            seed: int = 0,
+    ):
+        self.operation_latency = operation_latency  # seconds operation stays RUNNING
+        self.stabilization_latency = stabilization_latency  # seconds instance group is not stable
+        self.http_error_rate = http_error_rate  # share of requests answered 503
+        self.operation_error_rate = operation_error_rate  # share of operations finished with error
+        self.address = address  # IP of every reserved address ( health checks of load balancer )
+        self.random = random.Random(seed)
+        # (project, scope, collection) -> {name: resource}
+        self.resources: Dict[Tuple[str, str, str], Dict[str, dict]] = {}
+        # operation name -> (operation, done time, error)
+        self.operations: Dict[str, Tuple[dict, float, Optional[dict]]] = {}
+        # (HTTP method, API path template) -> requests
+        self.requests: Counter = Counter()
+        self._ids = itertools.count(1000)
+        self._lock = threading.Lock()
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    # ============ Server ============
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}{SERVICE_PATH}"
+
+    def start(self) -> str:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+                status, response = fake.handle(self.command, self.path, body)
+                payload = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='fake-compute', daemon=True).start()
+        return self.endpoint
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    # ============ Inventory ============
+    @staticmethod
+    def _timestamp() -> str:
+        return datetime.now(tz=timezone.utc).isoformat()
+
+    def _self_link(self, project: str, scope: str, collection: str, name: str) -> str:
+        return f"https://www.googleapis.com/compute/v1/projects/{project}/{scope}/{collection}/{name}"
+
+    def add(self, project: str, scope: str, collection: str, body: dict) -> dict:
+        resource = dict(body, id=str(next(self._ids)), creationTimestamp=self._timestamp(),
+                        selfLink=self._self_link(project, scope, collection, body['name']))
+        if collection == 'addresses':
+            resource.setdefault('address', self.address)
+            resource.setdefault('status', 'RESERVED')
+            resource.setdefault('users', [])
+        elif collection == 'images':
+            resource.setdefault('status', 'READY')
+            resource.setdefault('diskSizeGb', '10')
+        elif collection == 'instanceGroupManagers':
+            resource['stableAt'] = time.time() + self.stabilization_latency
+            resource.setdefault('targetSize', 1)
+        elif collection == 'autoscalers':
+            resource.setdefault('recommendedSize', resource.get('autoscalingPolicy', {}).get('minNumReplicas', 1))
+        self.resources.setdefault((project, scope, collection), {})[body['name']] = resource
+        return resource
+
+    def populate(self, project: str, region: str, services: int, releases: int = 2):
+        """
+        Resources of other services in project ( inventory size ), every service has
+        releases with full set of release resources
+        """
+        scope = f"regions/{region}"
+        for service, release in itertools.product(range(services), range(releases)):
+            name = f"other-{service:05d}-{release}-0-0"
+            for collection in ('images', 'instanceTemplates', 'healthChecks'):
+                self.add(project, 'global', collection, {'name': name})
+            for collection in ('instanceGroupManagers', 'autoscalers', 'backendServices', 'forwardingRules',
+                               'addresses', 'healthChecks'):
+                self.add(project, scope, collection, {'name': name})
+
+    def count(self, project: str) -> int:
+        return sum(len(x) for (p, _, _), x in self.resources.items() if p == project)
+
+    # ============ Operations ============
+    def _operation(self, project: str, scope: str, operation_type: str, target: str) -> dict:
+        name = f"operation-{next(self._ids)}"
+        operation = {
+            'kind': 'compute#operation',
+            'name': name,
+            'operationType': operation_type,
+            'targetLink': target,
+            'status': 'PENDING',
+            'selfLink': self._self_link(project, scope, 'operations', name),
+        }
+        error = None
+        if self.random.random() < self.operation_error_rate:
+            error = {'errors': [{'code': 'RESOURCE_OPERATION_RATE_EXCEEDED', 'message': 'Injected error'}]}
+        self.operations[name] = (operation, time.time() + self.operation_latency, error)
+        return operation
+
+    def _operation_status(self, name: str) -> Tuple[int, dict]:
+        if name not in self.operations:
+            return self._error(404, f"Operation {name} not found")
+        operation, done_at, error = self.operations[name]
+        response = dict(operation, status='DONE' if time.time() >= done_at else 'RUNNING')
+        if response['status'] == 'DONE' and error:
+            response.update({'error': error, 'httpErrorStatusCode': 400, 'httpErrorMessage': 'BAD REQUEST'})
+        return 200, response
+
+    # ============ Requests ============
+    @staticmethod
+    def _error(code: int, message: str) -> Tuple[int, dict]:
+        return code, {'error': {'code': code, 'message': message, 'errors': [{'message': message}]}}
+
+    @staticmethod
+    def _template(parts: list) -> str:
+        return '/'.join('{}' if index % 2 else part for index, part in enumerate(parts))
+
+    def handle(self, method: str, path: str, body: dict) -> Tuple[int, dict]:
+        url = urlparse(path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = url.path[len(SERVICE_PATH):].strip('/').split('/')
+        with self._lock:
+            self.requests[(method, self._template(parts))] += 1
+            if self.random.random() < self.http_error_rate:
+                return self._error(503, 'Injected backend error')
+            if parts[0] != 'projects' or len(parts) < 3:
+                return self._error(404, f"Unknown path {url.path}")
+            project = parts[1]
+            rest = parts[2:]
+            if rest[0] == 'aggregated':
+                return 200, {'items': {}}
+            if rest[0] == 'global':
+                scope, rest = 'global', rest[1:]
+            elif len(rest) == 2:
+                return self._scope(project, rest)
+            else:
+                scope, rest = f"{rest[0]}/{rest[1]}", rest[2:]
+            collection = rest[0]
+            name = rest[1] if len(rest) > 1 else None
+            action = rest[2] if len(rest) > 2 else None
+            if collection == 'operations':
+                return self._operation_status(name)
+            if collection in ('disks', 'machineTypes', 'subnetworks'):
+                return self._synthesized(project, scope, collection, name)
+            return self._resource(method, project, scope, collection, name, action, query, body)
+
+    def _scope(self, project: str, rest: list) -> Tuple[int, dict]:
+        # regions.get: quotas of region
+        quotas = [{'metric': metric, 'limit': 100000.0, 'usage': 0.0}
+                  for metric in ('CPUS', 'INSTANCES', 'SSD_TOTAL_GB', 'DISKS_TOTAL_GB', 'INTERNAL_ADDRESSES')]
+        return 200, {'name': rest[1], 'quotas': quotas}
+
+    def _synthesized(self, project: str, scope: str, collection: str, name: str) -> Tuple[int, dict]:
+        if collection == 'disks':
+            return 200, {'name': name, 'status': 'READY', 'selfLink': self._self_link(project, scope, collection, name)}
+        if collection == 'machineTypes':
+            match = re.search(r'-(\d+)(-\d+)?$', name)
+            return 200, {'name': name, 'guestCpus': int(match.group(1)) if match else 2}
+        return 200, {'name': name, 'region': scope, 'ipCidrRange': '10.0.0.0/16'}
+
+    def _resource(self, method, project, scope, collection, name, action, query, body) -> Tuple[int, dict]:
+        items = self.resources.setdefault((project, scope, collection), {})
+        if name is None:
+            if method == 'GET':
+                # list with pagination
+                names = sorted(items)
+                offset = int(query.get('pageToken') or 0)
+                size = int(query.get('maxResults') or 500)
+                response = {'kind': f"compute#{collection}List", 'items': [
+                    self._view(items[x]) for x in names[offset:offset + size]]}
+                if offset + size < len(names):
+                    response['nextPageToken'] = str(offset + size)
+                return 200, response
+            if method == 'POST':
+                if body['name'] in items:
+                    return self._error(409, f"The resource '{body['name']}' already exists")
+                resource = self.add(project, scope, collection, body)
+                self._use_address(project, scope, collection, resource)
+                return 200, self._operation(project, scope, 'insert', resource['selfLink'])
+            return self._error(405, f"Method {method} not allowed")
+
+        if name not in items:
+            return self._error(404, f"The resource '{collection}/{name}' was not found")
+        resource = items[name]
+        if action:
+            if action == 'listErrors':
+                return 200, {'items': []}
+            if action == 'listManagedInstances':
+                return 200, {'managedInstances': []}
+            if action == 'resize':
+                resource['targetSize'] = int(query.get('size', resource.get('targetSize', 0)))
+            return 200, self._operation(project, scope, action, resource['selfLink'])
+        if method == 'GET':
+            return 200, self._view(resource)
+        if method == 'DELETE':
+            del items[name]
+            self._release_address(project, scope, resource)
+            return 200, self._operation(project, scope, 'delete', resource['selfLink'])
+        if method in ('PUT', 'PATCH'):
+            resource.update({k: v for k, v in body.items() if k != 'name'})
+            return 200, self._operation(project, scope, method.lower(), resource['selfLink'])
+        return self._error(405, f"Method {method} not allowed")
+
+    @staticmethod
+    def _view(resource: dict) -> dict:
+        view = {k: v for k, v in resource.items() if k != 'stableAt'}
+        if 'stableAt' in resource:
+            view['status'] = {'isStable': time.time() >= resource['stableAt']}
+        return view
+
+    def _use_address(self, project: str, scope: str, collection: str, resource: dict):
+        if collection != 'forwardingRules':
+            return
+        for address in self.resources.get((project, scope, 'addresses'), {}).values():
+            if address['status'] == 'RESERVED' and address['address'] == resource.get('IPAddress') and \
+                    address['name'] == resource['name']:
+                address.update({'status': 'IN_USE', 'users': [resource['selfLink']]})
+
+    def _release_address(self, project: str, scope: str, resource: dict):
+        for address in self.resources.get((project, scope, 'addresses'), {}).values():
+            if resource['selfLink'] in address.get('users', []):
+                address.update({'status': 'RESERVED', 'users': []})
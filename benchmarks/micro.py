@@ -0,0 +1,281 @@
+#!python3
+"""
+Microbenchmarks of inventory parsing and body generation on synthetic inputs
+
+- python3 -m benchmarks.micro
+- python3 -m benchmarks.micro --save benchmarks/baseline.json
+- python3 -m benchmarks.micro --check benchmarks/baseline.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Optional
+import yaml
+from _logger import DeployLogger
+from metadata import DeploymentMetadata
+from providers.gcp import GCP, GcpSession
+from release import Release
+import operations
+from benchmarks.deploy import PROJECT, REGION, SERVICE, StaticIngresses, bench_metadata
+
+INVENTORY_SIZES = [10, 1000, 10000, 100000]
+INSTANCES = [1, 50, 500]
+# Share of inventory resources which belong to benchmarked service ( releases not deleted yet )
+SERVICE_SHARE = 10
+# Collections listed by GCP.overview: (list method resource, regional, naming)
+COLLECTIONS = [
+    ('images', False, 'image'),
+    ('instanceTemplates', False, 'release'),
+    ('healthChecks', False, 'instance'),
+    ('resourcePolicies', True, 'policy'),
+    ('regionHealthChecks', True, 'instance'),
+    ('regionAutoscalers', True, 'release'),
+    ('regionInstanceGroupManagers', True, 'release'),
+    ('regionBackendServices', True, 'instance'),
+    ('forwardingRules', True, 'instance'),
+    ('addresses', True, 'instance'),
+]
+# Versions of service deleted in release matching case ( delete_previous of long history )
+MATCHING_VERSIONS = 10
+
+
+def resource_name(naming: str, owner: str, version: str, index: int) -> str:
+    """
+    Resource name the way Release names resources of service version
+    """
+    if naming == 'image':
+        return f"{owner}-{version}-{'boot' if index % 2 else 'data'}-img"
+    if naming == 'policy':
+        return f"{owner}-{version}-placement"
+    if naming == 'instance':
+        return f"{owner}-service{index % 3:02d}-{version}"
+    return f"{owner}-{version}"
+
+
+def synthetic_inventory(size: int) -> Dict[str, List[dict]]:
+    """
+    List responses of GCP project with size resources spread over collections,
+    every SERVICE_SHARE resource belongs to benchmarked service, the others to other services
+    """
+    inventory = {}
+    per_collection = max(size // len(COLLECTIONS), 1)
+    for resource, _, naming in COLLECTIONS:
+        items = []
+        for index in range(per_collection):
+            owner = SERVICE if index % SERVICE_SHARE == 0 else f"other{index % 997:03d}"
+            version = f"1-{index // 30}-0"
+            items.append({
+                'name': resource_name(naming, owner, version, index),
+                'creationTimestamp': f"2024-01-01T00:{index // 60 % 60:02d}:{index % 60:02d}.000-07:00",
+                'diskSizeGb': '10',
+                'status': 'IN_USE',
+                'address': f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}",
+                'IPAddress': f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}",
+                'ports': ['8080'],
+                'autoscalingPolicy': {'mode': 'ON', 'minNumReplicas': 2, 'maxNumReplicas': 3,
+                                      'cpuUtilization': {'utilizationTarget': 0.8}},
+            })
+        inventory[resource] = items
+    return inventory
+
+
+class MicroBenchmark:
+    def __init__(self, workdir: str, logger, rounds: int):
+        self.workdir = workdir
+        self.logger = logger
+        self.rounds = rounds
+        self.devnull = open(os.devnull, 'w')
+        self.metadatas = {}
+
+    def metadata(self, instances: int) -> DeploymentMetadata:
+        if instances not in self.metadatas:
+            data = bench_metadata([8000 + x for x in range(instances)])
+            data['load_balancer']['addressPool'] = {'enabled': True}
+            metadata_file = os.path.join(self.workdir, f"metadata_{instances}.yaml")
+            with open(metadata_file, 'w') as file:
+                file.write(yaml.safe_dump(data))
+            self.metadatas[instances] = DeploymentMetadata(metadata_file=metadata_file, logger=self.logger)
+        return self.metadatas[instances]
+
+    def gcp(self, inventory: Dict[str, List[dict]], instances: int = 3) -> GCP:
+        """
+        GCP object which lists synthetic inventory from session cache, no API calls
+        """
+        session = GcpSession(None, self.logger, inventory_ttl=10 ** 9)
+        for resource, regional, _ in COLLECTIONS:
+            params = (('region', REGION),) if regional else ()
+            session.inventory((resource, PROJECT, params), lambda items=inventory[resource]: items)
+        return GCP(metadata=self.metadata(instances), gcp_token=None, logger=self.logger, service=SERVICE,
+                   session=session)
+
+    def list_filters(self, gcp: GCP):
+        gcp.listImages()
+        gcp.listInstanceTemplates()
+        gcp.listResourcePolicies()
+        gcp.listHealthCheck()
+        gcp.listRegionHealthChecks()
+        gcp.listrRegionAutoscalers()
+        gcp.listRegionInstanceGroupManagers()
+        gcp.listBackendServices()
+        gcp.listForwardingRules()
+        gcp.listAddresses()
+
+    def versions(self, gcp: GCP):
+        with redirect_stdout(self.devnull):
+            gcp.getResourcesVersions()
+
+    def matching(self, gcp: GCP):
+        previous = sorted(operations.previous_versions(gcp, StaticIngresses()))[:MATCHING_VERSIONS]
+        for version in previous:
+            release = Release(service=SERVICE, version=version, metadata=gcp.metadata, logger=self.logger, gcp=gcp)
+            for resource in gcp.gcp_resources:
+                release.release_resources(resource)
+
+    def release(self, instances: int) -> Release:
+        release = Release(service=SERVICE, version='1.0.0', metadata=self.metadata(instances),
+                          logger=self.logger, gcp=None)
+        # Pool addresses claimed before forwarding rules are built, instead of addresses.get per rule
+        release.claimed_addresses = {f"{SERVICE}-{x['name']}-{release.version}": '10.0.0.1'
+                                     for x in release.service_instances}
+        return release
+
+    def measure(self, function: Callable, setup: Optional[Callable] = None) -> Dict:
+        """
+        Best and median time of rounds, peak memory allocated by function in separate run
+        """
+        times = []
+        for _ in range(self.rounds):
+            state = setup() if setup else None
+            gc.collect()
+            start_time = time.perf_counter()
+            function(state)
+            times.append(time.perf_counter() - start_time)
+        state = setup() if setup else None
+        gc.collect()
+        tracemalloc.start()
+        function(state)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {'seconds': min(times), 'median': statistics.median(times), 'peak_kb': round(peak / 1024, 1)}
+
+    def run(self, sizes: List[int], instances: List[int]) -> Dict[str, Dict]:
+        cases = {}
+        for size in sizes:
+            inventory = synthetic_inventory(size)
+
+            def listed(inventory=inventory):
+                gcp = self.gcp(inventory)
+                self.list_filters(gcp)
+                return gcp
+
+            def versioned():
+                gcp = listed()
+                self.versions(gcp)
+                return gcp
+
+            cases[f"list_filters[inventory={size}]"] = self.measure(
+                self.list_filters, lambda inventory=inventory: self.gcp(inventory))
+            cases[f"versions[inventory={size}]"] = self.measure(self.versions, listed)
+            cases[f"matching[inventory={size}]"] = self.measure(self.matching, versioned)
+        for count in instances:
+            for builder in ('region_backend_service', 'forwarding_rule', 'ip_addresses'):
+                cases[f"{builder}[instances={count}]"] = self.measure(
+                    lambda release, builder=builder: getattr(release, builder)(),
+                    lambda count=count: self.release(count))
+        return cases
+
+
+def reference() -> float:
+    """
+    Seconds of fixed pure Python workload, baselines are scaled by it to speed of current machine
+    """
+    def workload():
+        names = [f"service-{x:05d}-{x % 7}-0-0" for x in range(100000)]
+        return len({x.split('-')[1] for x in names if 'service' in x})
+    times = []
+    for _ in range(5):
+        start_time = time.perf_counter()
+        workload()
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+def check(results: Dict, baseline: Dict, tolerance: float, memory_tolerance: float, logger) -> List[str]:
+    """
+    Cases slower or allocating more than baseline, baseline time is scaled to speed of current machine
+    """
+    scale = results['reference'] / baseline['reference']
+    regressions = []
+    for case, measured in results['cases'].items():
+        expected = baseline['cases'].get(case)
+        if not expected:
+            continue
+        # 1ms slack, short cases are dominated by timer and scheduler noise
+        allowed_seconds = expected['seconds'] * scale * (1 + tolerance) + 0.001
+        allowed_peak = expected['peak_kb'] * (1 + memory_tolerance) + 64
+        if measured['seconds'] > allowed_seconds:
+            regressions.append("{}: {:.4f}s, baseline {:.4f}s ( scaled {:.4f}s )".format(
+                case, measured['seconds'], expected['seconds'], expected['seconds'] * scale))
+        if measured['peak_kb'] > allowed_peak:
+            regressions.append("{}: peak {:.1f}KB, baseline {:.1f}KB".format(
+                case, measured['peak_kb'], expected['peak_kb']))
+    for regression in regressions:
+        logger.colored(f"Regression {regression}", 'Red', 'error')
+    return regressions
+
+
+def report(results: Dict, baseline: Optional[Dict], logger):
+    scale = results['reference'] / baseline['reference'] if baseline else 1
+    logger.colored("{:<42} {:>10} {:>10} {:>11} {:>13}".format(
+        'case', 'best', 'median', 'peak KB', 'vs baseline'), 'Light_Purple')
+    for case, measured in results['cases'].items():
+        expected = (baseline or {}).get('cases', {}).get(case)
+        ratio = "{:>12.2f}x".format(measured['seconds'] / (expected['seconds'] * scale)) \
+            if expected and expected['seconds'] else "{:>13}".format('-')
+        logger.colored("{:<42} {:>9.4f}s {:>9.4f}s {:>11.1f} {}".format(
+            case, measured['seconds'], measured['median'], measured['peak_kb'], ratio), 'Light_Purple')
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        prog='python3 -m benchmarks.micro',
+        description='Microbenchmarks of inventory parsing and body generation')
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=INVENTORY_SIZES,
+                            help='resources in synthetic inventory')
+    arg_parser.add_argument('--instances', type=int, nargs='+', default=INSTANCES,
+                            help='service instances of release')
+    arg_parser.add_argument('--rounds', type=int, default=5, help='timed runs of every case, best is compared')
+    arg_parser.add_argument('--save', type=str, help='save results as baseline json file')
+    arg_parser.add_argument('--check', type=str, help='compare with baseline json file, exit 3 on regression')
+    arg_parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown share of baseline')
+    arg_parser.add_argument('--memory-tolerance', type=float, default=0.2,
+                            help='allowed peak memory growth share of baseline')
+    args = arg_parser.parse_args()
+
+    logger = DeployLogger(loglvl='WARN', name='benchmark')
+    summary_logger = DeployLogger(loglvl='INFO', name='benchmark.summary')
+    baseline = None
+    if args.check:
+        with open(args.check) as file:
+            baseline = json.loads(file.read())
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = {
+            'python': platform.python_version(),
+            'reference': reference(),
+            'cases': MicroBenchmark(workdir, logger, args.rounds).run(args.sizes, args.instances),
+        }
+    report(results, baseline, summary_logger)
+    if args.save:
+        with open(args.save, 'w') as file:
+            file.write(json.dumps(results, indent=4) + '\n')
+        summary_logger.colored(f"Saved baseline: {args.save}", 'Green')
+    if baseline and check(results, baseline, args.tolerance, args.memory_tolerance, summary_logger):
+        exit(3)
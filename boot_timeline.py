@@ -0,0 +1,208 @@
+import json
+import math
+import os
+import re
+import statistics
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+
+# Startup script markers written to guest attributes ( deploy/<marker> ) or
+# to serial port ( "DEPLOY-MARKER <marker>" ) mapped to timeline events
+STARTUP_MARKERS = {
+    'startup-begin': 'startup_begin',
+    'startup-end': 'startup_end',
+    'app-ready': 'app_ready',
+}
+GUEST_ATTRIBUTES_NAMESPACE = 'deploy'
+# Phase measured for autohealing calibration: app-ready marker is written by instance itself,
+# first healthy probe can not be observed before initialDelaySec of autohealing policy
+CALIBRATION_PHASE = 'running_to_app_ready'
+SERIAL_MARKER = re.compile(r'^(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}).*DEPLOY-MARKER (\S+)')
+
+
+def percentile(values: List[float], rank: float) -> Optional[float]:
+    """
+    Percentile of values with linear interpolation between closest ranks
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * rank / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def parse_timestamp(value) -> Optional[float]:
+    """
+    Converting GCP RFC3339 timestamp, serial port timestamp or epoch seconds to epoch seconds
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        if re.match(r'^\d{4}/\d{2}/\d{2} ', value):
+            # Serial port output of GCE agent is in UTC
+            return datetime.strptime(value, '%Y/%m/%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    except ValueError:
+        return None
+
+
+class BootTimeline:
+    """
+    Boot timeline of instances in managed instance group of release:
+    creation, RUNNING status, startup script markers and first healthy probe
+    """
+    # phase name, start event, end event
+    PHASES = [
+        ('provisioning', 'created', 'running'),
+        ('os_boot', 'running', 'startup_begin'),
+        ('startup_script', 'startup_begin', 'startup_end'),
+        ('app_warmup', 'startup_end', 'app_ready'),
+        ('health_detection', 'app_ready', 'healthy'),
+        ('startup_to_healthy', 'startup_end', 'healthy'),
+        ('running_to_healthy', 'running', 'healthy'),
+        ('running_to_app_ready', 'running', 'app_ready'),
+        ('total', 'created', 'healthy'),
+    ]
+
+    def __init__(self, service: str, version: str, logger):
+        self.service_name = service
+        self.version = version
+        self.logger = logger
+        # instance name -> {event: epoch seconds}
+        self.instances: Dict[str, Dict[str, float]] = {}
+        # instance name -> {event: source of timestamp}
+        self.sources: Dict[str, Dict[str, str]] = {}
+
+    def record(self, instance: str, event: str, timestamp, source: str = 'observed', overwrite: bool = False):
+        """
+        Save timestamp of instance event, first observed timestamp wins
+        unless overwrite with more precise value from GCP API
+        """
+        timestamp = parse_timestamp(timestamp)
+        if timestamp is None:
+            return
+        events = self.instances.setdefault(instance, {})
+        if event in events and not overwrite:
+            return
+        events[event] = timestamp
+        self.sources.setdefault(instance, {})[event] = source
+
+    def record_markers(self, instance: str, markers: Dict[str, str], source: str):
+        for marker, value in markers.items():
+            event = STARTUP_MARKERS.get(marker)
+            if event:
+                self.record(instance, event, value, source=source, overwrite=True)
+
+    def healthy_instances(self) -> List[str]:
+        return [name for name, events in self.instances.items() if 'healthy' in events]
+
+    def phases(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per instance duration of boot phases in seconds
+        """
+        result = {}
+        for instance, events in self.instances.items():
+            durations = {}
+            for phase, start, end in self.PHASES:
+                if start in events and end in events:
+                    durations[phase] = round(events[end] - events[start], 1)
+            result[instance] = durations
+        return result
+
+    def breakdown(self) -> Dict[str, Dict[str, float]]:
+        """
+        Aggregated min/median/max of every phase over instances of release
+        """
+        collected = {}
+        for durations in self.phases().values():
+            for phase, duration in durations.items():
+                collected.setdefault(phase, []).append(duration)
+        result = {}
+        for phase, _, _ in self.PHASES:
+            if phase in collected:
+                values = collected[phase]
+                result[phase] = {
+                    'min': min(values),
+                    'median': round(statistics.median(values), 1),
+                    'max': max(values),
+                    'instances': len(values),
+                }
+        return result
+
+    def summary(self):
+        self.logger.colored("==== Boot timeline of {} version {} ====".format(
+            self.service_name, self.version), 'Cyan')
+        for phase, values in self.breakdown().items():
+            self.logger.colored("{:<20} min: {:>7}s median: {:>7}s max: {:>7}s ( instances: {} )".format(
+                phase, values['min'], values['median'], values['max'], values['instances']), 'Light_Purple')
+
+    def to_dict(self) -> Dict:
+        return {
+            'service_name': self.service_name,
+            'version': self.version,
+            'instances': {
+                name: {
+                    'events': {
+                        event: datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+                        for event, ts in sorted(events.items(), key=lambda x: x[1])
+                    },
+                    'sources': self.sources.get(name, {}),
+                    'phases': self.phases().get(name, {}),
+                }
+                for name, events in self.instances.items()
+            },
+            'breakdown': self.breakdown(),
+        }
+
+    def drop_to_file(self, filename: str):
+        with open(filename, 'w') as file:
+            file.write(json.dumps(self.to_dict(), indent=4))
+
+
+class BootHistory:
+    """
+    Rolling history of measured RUNNING to app-ready intervals of instances per service
+    """
+    def __init__(self, filename: str, size: int = 50):
+        self.filename = filename
+        self.size = size
+        self.history: Dict[str, List[Dict]] = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r') as file:
+                self.history = json.loads(file.read())
+
+    def add(self, service: str, version: str, boot_timeline: BootTimeline) -> int:
+        recorded = datetime.now(tz=timezone.utc).isoformat()
+        samples = self.history.setdefault(service, [])
+        count = 0
+        for instance, durations in boot_timeline.phases().items():
+            if CALIBRATION_PHASE in durations:
+                samples.append({'version': version, 'instance': instance, 'phase': CALIBRATION_PHASE,
+                                'seconds': durations[CALIBRATION_PHASE], 'recorded': recorded})
+                count += 1
+        self.history[service] = samples[-self.size:]
+        return count
+
+    def samples(self, service: str) -> List[float]:
+        # Samples without phase are RUNNING to healthy intervals bounded by applied initialDelaySec
+        return [x['seconds'] for x in self.history.get(service, []) if x.get('phase') == CALIBRATION_PHASE]
+
+    def percentile(self, service: str, rank: float) -> Optional[float]:
+        return percentile(self.samples(service), rank)
+
+    def save(self):
+        with open(self.filename, 'w') as file:
+            file.write(json.dumps(self.history, indent=4))
@@ -0,0 +1,352 @@
+import hmac
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+from _logger import ColorFormatter, DeployLogger
+from metadata import DeploymentMetadata
+from providers.gcp import GCP, GcpSession
+from providers.gke import GKE
+from tracing import tracer
+from matrix import MATRIX_LOG_FORMAT
+import operations
+
+DAEMON_OPERATIONS = ['deploy', 'delete', 'delete_previous', 'overview', 'scale_down', 'scale_up']
+# Operations of one release version
+VERSION_OPERATIONS = {'deploy', 'delete', 'scale_down', 'scale_up'}
+# Job states
+QUEUED = 'QUEUED'
+RUNNING = 'RUNNING'
+DONE = 'DONE'
+FAILED = 'FAILED'
+
+
+class Job:
+    """
+    Operation of service requested by client, log records of job are kept
+    as progress events streamed to clients
+    """
+    def __init__(self, job_id: int, request: Dict, metadata: DeploymentMetadata):
+        self.id = job_id
+        self.service = request['service']
+        self.operation = request['operation']
+        self.version = request.get('version') or ''
+        self.options = {k: bool(request.get(k)) for k in ('skip_preflight', 'defer', 'boot_timeline')}
+        self.metadata = metadata
+        self.status = QUEUED
+        self.error = ''
+        self.created = time.time()
+        self.started = 0.0
+        self.finished = 0.0
+        self.events: List[str] = []
+        self.changed = threading.Condition()
+
+    @property
+    def key(self) -> str:
+        """
+        Queue of job: jobs of one service in one project and region never overlap
+        """
+        return f"{self.service}@{self.metadata.gcp_project}/{self.metadata.gcp_region}"
+
+    def add_event(self, message: str):
+        with self.changed:
+            self.events.append(message)
+            self.changed.notify_all()
+
+    def finish(self, status: str, error: str = ''):
+        with self.changed:
+            self.status = status
+            self.error = error
+            self.finished = time.time()
+            self.changed.notify_all()
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'service': self.service,
+            'operation': self.operation,
+            'version': self.version,
+            'region': self.metadata.gcp_region,
+            'project': self.metadata.gcp_project,
+            'status': self.status,
+            'error': self.error,
+            'created': round(self.created, 3),
+            'started': round(self.started, 3),
+            'finished': round(self.finished, 3),
+            'events': len(self.events),
+        }
+
+
+class JobHandler(logging.Handler):
+    """
+    Log records of job logger as job progress events
+    """
+    def __init__(self, job: Job):
+        super().__init__()
+        self.job = job
+        self.setFormatter(ColorFormatter(MATRIX_LOG_FORMAT, datefmt="%H:%M:%S"))
+
+    def emit(self, record):
+        try:
+            self.job.add_event(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class Daemon:
+    """
+    Long-running deploy process: authenticated GCP and GKE clients and GCP inventory
+    are kept in memory between jobs, jobs are queued per service and run
+    concurrently with global and per service limits
+    """
+    def __init__(
+            self,
+            gcp_token: str,
+            logger,
+            api_token: str,
+            max_parallel: int = 4,
+            max_per_service: int = 1,
+            rate_limit: float = 0,
+            inventory_ttl: int = 300,
+            history: int = 200,
+    ):
+        self.logger = logger
+        self.max_parallel = max_parallel
+        self.max_per_service = max_per_service
+        self.history = history  # finished jobs kept for clients
+        self.session = GcpSession(gcp_token, logger, rate_limit=rate_limit, inventory_ttl=inventory_ttl)
+        self.api_token = api_token
+        self.executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='job')
+        self.jobs: Dict[int, Job] = OrderedDict()
+        self.queues: Dict[str, Deque[Job]] = {}
+        self.running: Dict[str, int] = {}
+        self.started = time.time()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    # ============ Jobs ============
+    def submit(self, request: Dict) -> Job:
+        """
+        Queue job of request, ValueError when request is not valid
+        """
+        if request.get('operation') not in DAEMON_OPERATIONS:
+            raise ValueError("Operation must be one of: {}".format(', '.join(DAEMON_OPERATIONS)))
+        if not request.get('service') or not request.get('metadata'):
+            raise ValueError("Job requires service and metadata")
+        if request['operation'] in VERSION_OPERATIONS and not request.get('version'):
+            raise ValueError(f"Operation {request['operation']} requires version")
+        try:
+            metadata = DeploymentMetadata.load(request['metadata'], self.logger)
+        except SystemExit:
+            raise ValueError(f"Failed reading metadata file {request['metadata']}")
+
+        with self._lock:
+            job = Job(next(self._ids), request, metadata)
+            self.jobs[job.id] = job
+            self.queues.setdefault(job.key, deque()).append(job)
+            self.logger.colored("Queued job {} {} of {} {} ( {} )".format(
+                job.id, job.operation, job.service, job.version, job.key), 'Cyan')
+            self._dispatch()
+        return job
+
+    def _dispatch(self):
+        # Called with lock held: oldest queued job of service below its limit is started only
+        # when worker is free, job waiting for worker stays QUEUED
+        while sum(self.running.values()) < self.max_parallel:
+            ready = [x for key, x in self.queues.items() if self.running.get(key, 0) < self.max_per_service]
+            if not ready:
+                return
+            queue = min(ready, key=lambda x: x[0].id)
+            job = queue.popleft()
+            if not queue:
+                del self.queues[job.key]
+            self.running[job.key] = self.running.get(job.key, 0) + 1
+            job.status = RUNNING
+            job.started = time.time()
+            self.executor.submit(self._run, job)
+
+    def _run(self, job: Job):
+        logger = DeployLogger(loglvl=self.logger.loglvl, name=f"{job.service}@{job.metadata.gcp_region}#{job.id}")
+        handler = JobHandler(job)
+        logger.logger.addHandler(handler)
+        try:
+            self.execute(job, logger)
+            job.finish(DONE)
+        except (Exception, SystemExit) as exc:
+            logger.colored(f"{job.operation} failed: {exc}", 'Red', 'error')
+            job.finish(FAILED, str(exc))
+        finally:
+            logger.logger.removeHandler(handler)
+            logging.Logger.manager.loggerDict.pop(logger.name, None)
+            self.logger.colored("Job {} {} of {} {}: {} in {:.1f}s".format(
+                job.id, job.operation, job.service, job.version, job.status, job.finished - job.started),
+                'Green' if job.status == DONE else 'Red')
+            with self._lock:
+                self.running[job.key] -= 1
+                if not self.running[job.key]:
+                    del self.running[job.key]
+                self._dispatch()
+                self._cleanup()
+
+    def _cleanup(self):
+        # Called with lock held: finished jobs over history and spans of finished jobs are dropped
+        finished = [x for x in self.jobs.values() if x.status in (DONE, FAILED)]
+        for job in finished[:max(len(finished) - self.history, 0)]:
+            del self.jobs[job.id]
+        running = [x.started for x in self.jobs.values() if x.status == RUNNING]
+        tracer.prune(min(running) if running else time.time())
+
+    def execute(self, job: Job, logger):
+        metadata = job.metadata
+        gcp = GCP(metadata=metadata, gcp_token=self.session.gcp_token, logger=logger,
+                  service=job.service, session=self.session)
+        if job.operation in ('deploy', 'delete_previous'):
+            # Kubernetes API client of cluster context is shared by jobs of process
+            gke = GKE(job.service, metadata, logger)
+            gke.get_ingresses()
+            if job.operation == 'deploy':
+                operations.deploy(job.service, job.version, metadata, logger, gcp, gke,
+                                  boot_timeline=job.options['boot_timeline'],
+                                  preflight=not job.options['skip_preflight'])
+            else:
+                operations.delete_previous(job.service, metadata, logger, gcp, gke, defer=job.options['defer'])
+        elif job.operation == 'overview':
+            gcp.overview()
+        elif job.operation == 'delete':
+            operations.delete(job.service, job.version, metadata, logger, gcp)
+        elif job.operation == 'scale_down':
+            operations.scale_down(job.service, job.version, metadata, logger, gcp)
+        elif job.operation == 'scale_up':
+            operations.scale_up(job.service, job.version, metadata, logger, gcp)
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                'uptime': round(time.time() - self.started, 1),
+                'running': sum(self.running.values()),
+                'queued': sum(len(x) for x in self.queues.values()),
+                'queues': {k: [x.id for x in v] for k, v in self.queues.items()},
+            }
+
+    def list_jobs(self) -> List[Dict]:
+        with self._lock:
+            return [x.to_dict() for x in self.jobs.values()]
+
+    def job(self, job_id: str) -> Optional[Job]:
+        try:
+            with self._lock:
+                return self.jobs.get(int(job_id))
+        except ValueError:
+            return None
+
+    # ============ HTTP API ============
+    def serve(self, host: str = '127.0.0.1', port: int = 8470):
+        """
+        HTTP API of daemon:
+        POST /jobs - queue job ( service, operation, metadata, version, skip_preflight, defer, boot_timeline )
+        GET /jobs, GET /jobs/<id> - jobs states, GET /status - queues of daemon
+        GET /jobs/<id>/events?since=N - progress of job, ndjson stream which ends when job finishes
+        Every request requires header Authorization: Bearer <api token>
+        """
+        daemon = self
+        expected = f"Bearer {self.api_token}".encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _authorized(self) -> bool:
+                if hmac.compare_digest(self.headers.get('Authorization', '').encode(), expected):
+                    return True
+                self._reply(401, {'error': 'Missing or wrong API token'})
+                return False
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                url = urlparse(self.path)
+                parts = url.path.strip('/').split('/')
+                if parts == ['status']:
+                    return self._reply(200, daemon.status())
+                if parts == ['jobs']:
+                    return self._reply(200, daemon.list_jobs())
+                job = daemon.job(parts[1]) if len(parts) > 1 and parts[0] == 'jobs' else None
+                if job is None:
+                    return self._reply(404, {'error': f"Not found {url.path}"})
+                if len(parts) == 2:
+                    return self._reply(200, job.to_dict())
+                if parts[2] == 'events':
+                    try:
+                        since = max(int(parse_qs(url.query).get('since', ['0'])[0]), 0)
+                    except ValueError:
+                        return self._reply(400, {'error': 'Parameter since must be number of event'})
+                    return self._stream(job, since)
+                return self._reply(404, {'error': f"Not found {url.path}"})
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                if urlparse(self.path).path.strip('/') != 'jobs':
+                    return self._reply(404, {'error': f"Not found {self.path}"})
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                    job = daemon.submit(request)
+                except (ValueError, TypeError, AttributeError) as exc:
+                    return self._reply(400, {'error': str(exc)})
+                return self._reply(202, job.to_dict())
+
+            def _stream(self, job: Job, since: int):
+                # Connection is closed after last event ( HTTP/1.0 ), every event is one json line
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                cursor = since
+                try:
+                    while True:
+                        with job.changed:
+                            job.changed.wait_for(lambda: len(job.events) > cursor or job.finished, timeout=15)
+                            events = job.events[cursor:]
+                            finished = bool(job.finished) and cursor + len(events) == len(job.events)
+                        for event in events:
+                            self.wfile.write(json.dumps({'event': 'log', 'message': event}).encode() + b'\n')
+                        cursor += len(events)
+                        if finished:
+                            self.wfile.write(json.dumps({'event': 'finished', 'job': job.to_dict()}).encode() + b'\n')
+                            return
+                        if not events:
+                            # Keep-alive of idle stream, broken client connection is detected here
+                            self.wfile.write(json.dumps({'event': 'status', 'status': job.status}).encode() + b'\n')
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        self.logger.colored("Deploy daemon listening on http://{}:{}, parallel jobs: {}, per service: {}".format(
+            host, port, self.max_parallel, self.max_per_service), 'Cyan')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.executor.shutdown(wait=True)
+
+
+def parse_listen(listen: str) -> Tuple[str, int]:
+    host, _, port = listen.rpartition(':')
+    return host or '127.0.0.1', int(port)
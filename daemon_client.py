@@ -0,0 +1,106 @@
+#!python3
+"""
+Thin client of deploy daemon ( run.py --operation daemon ): queues job and prints its progress,
+exit code is 0 when job is done and 3 when it failed. Standard library only, starts fast in CI jobs
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+arg_parser = argparse.ArgumentParser(
+    prog='daemon_client.py',
+    description='Queue job in deploy daemon and stream its progress.',
+    usage='''\n- python3 %(prog)s --daemon {} --metadata {} --service {} --version {} --operation {}
+- python3 %(prog)s --daemon {} --jobs''',
+)
+arg_parser.add_argument('--daemon', action='store', type=str, default='http://127.0.0.1:8470',
+                        help='URL of deploy daemon')
+arg_parser.add_argument('--token', action='store', type=str, default=os.environ.get('DEPLOY_DAEMON_TOKEN'),
+                        help='API token of deploy daemon ( default: DEPLOY_DAEMON_TOKEN )')
+arg_parser.add_argument('--metadata', action='store', type=str, help='file with deploy metadata')
+arg_parser.add_argument('--service', action='store', type=str, help='Deployable service name')
+arg_parser.add_argument('--version', action='store', type=str, help='Release version')
+arg_parser.add_argument('--operation', action='store', type=str,
+                        choices=['deploy', 'delete', 'delete_previous', 'overview', 'scale_down', 'scale_up'])
+arg_parser.add_argument('--skip-preflight', action='store_true', help='deploy: do not run preflight checks')
+arg_parser.add_argument('--defer', action='store_true', help='delete_previous: record releases for deferred teardown')
+arg_parser.add_argument('--boot-timeline', action='store_true', help='deploy: record boot timeline')
+arg_parser.add_argument('--attach', action='store', type=int, help='stream progress of queued job by id')
+arg_parser.add_argument('--jobs', action='store_true', help='print jobs and queues of daemon')
+
+
+def call(url: str, token: str, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={
+        'Content-Type': 'application/json',
+        'Authorization': f"Bearer {token}",
+    }, method='POST' if data is not None else 'GET')
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as exc:
+        print(f"Deploy daemon rejected request: {exc.read().decode()}", file=sys.stderr)
+        sys.exit(3)
+    except urllib.error.URLError as exc:
+        print(f"Deploy daemon {url} is not available: {exc.reason}", file=sys.stderr)
+        sys.exit(3)
+
+
+def stream(daemon: str, token: str, job_id: int) -> dict:
+    """
+    Progress events of job until it finishes, stream is resumed after lost connection
+    """
+    received = 0
+    while True:
+        request = urllib.request.Request(f"{daemon}/jobs/{job_id}/events?since={received}",
+                                         headers={'Authorization': f"Bearer {token}"})
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                for line in response:
+                    event = json.loads(line)
+                    if event['event'] == 'log':
+                        received += 1
+                        print(event['message'], file=sys.stderr, flush=True)
+                    elif event['event'] == 'finished':
+                        return event['job']
+        except urllib.error.HTTPError as exc:
+            print(f"Deploy daemon rejected events of job {job_id}: {exc}", file=sys.stderr)
+            sys.exit(3)
+        except (urllib.error.URLError, ConnectionError, TimeoutError) as exc:
+            print(f"Lost connection to deploy daemon: {exc}, reconnecting", file=sys.stderr)
+            time.sleep(2)
+
+
+if __name__ == "__main__":
+    args = arg_parser.parse_args()
+    daemon = args.daemon.rstrip('/')
+    if not args.token:
+        arg_parser.error('--token or DEPLOY_DAEMON_TOKEN is required')
+    if args.jobs:
+        print(json.dumps({'status': call(f"{daemon}/status", args.token),
+                          'jobs': call(f"{daemon}/jobs", args.token)}, indent=4))
+        sys.exit(0)
+    if args.attach:
+        job = {'id': args.attach}
+    else:
+        if not args.operation or not args.service or not args.metadata:
+            arg_parser.error('--operation, --service and --metadata are required')
+        job = call(f"{daemon}/jobs", args.token, {
+            'service': args.service,
+            'operation': args.operation,
+            'version': args.version,
+            # Daemon reads metadata file, relative path is resolved in working directory of client
+            'metadata': os.path.abspath(args.metadata),
+            'skip_preflight': args.skip_preflight,
+            'defer': args.defer,
+            'boot_timeline': args.boot_timeline,
+        })
+        print(f"Queued job {job['id']} {job['operation']} of {job['service']} {job['version']}", file=sys.stderr)
+    job = stream(daemon, args.token, job['id'])
+    print(f"Job {job['id']} {job['operation']} of {job['service']} {job['version']}: {job['status']} "
+          f"{job['error']}".rstrip(), file=sys.stderr)
+    sys.exit(0 if job['status'] == 'DONE' else 3)
@@ -0,0 +1,54 @@
+import json
+import threading
+from typing import Dict
+from tracing import Tracer, Span, RUN, STEP, OPERATION, STABILIZATION, HEALTHCHECK
+
+# Categories of spans streamed as progress, API and Kubernetes calls are in trace only
+EVENT_CATEGORIES = (RUN, STEP, OPERATION, STABILIZATION, HEALTHCHECK)
+
+
+class EventStream:
+    """
+    Progress of release operations from spans of process tracer as NDJSON: one event per line
+    ( step start and end, operation status, stabilization poll, health check result ), flushed
+    after every event
+    """
+    def __init__(self, tracer: Tracer, stream, labels: Dict):
+        self.tracer = tracer
+        self.stream = stream
+        self.labels = {k: v for k, v in labels.items() if v}
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.tracer.subscribe(self.on_span)
+
+    def stop(self):
+        self.tracer.unsubscribe(self.on_span)
+
+    def event(self, kind: str, span: Span) -> Dict:
+        event = dict(self.labels)
+        event.update(span.args)
+        event.update({
+            'type': kind,
+            'category': span.category,
+            'name': span.name,
+            'time': round(span.end if kind == 'end' else span.start, 3),
+            'span': span.id,
+            'parent': span.parent,
+        })
+        if kind == 'end':
+            event['start'] = round(span.start, 3)
+            event['duration'] = round(span.duration, 3)
+        return event
+
+    def on_span(self, kind: str, span: Span):
+        if span.category not in EVENT_CATEGORIES:
+            return
+        line = json.dumps(self.event(kind, span), default=str)
+        with self._lock:
+            try:
+                self.stream.write(line + '\n')
+                self.stream.flush()
+            except (OSError, ValueError):
+                # Reader of stream is gone, operation continues without events
+                self.stop()
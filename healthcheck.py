@@ -3,8 +3,10 @@ import sys
 import logging
 from logging import Logger
 import json
+from typing import Dict, Optional
+from _logger import paint
+from tracing import tracer, HEALTHCHECK
 
-logging.basicConfig(format="%(asctime)s %(levelname)s: %(message)s", datefmt="%H:%M:%S", stream=sys.stderr)
 logger: Logger = logging.getLogger("py")
 # logger.setLevel(f'{args.log_lvl}'.upper())
 logger.setLevel('DEBUG')
@@ -16,7 +18,7 @@ logging.getLogger("chardet.charsetprober").disabled = True
 
 
 def http_healthcheck(
-        resources: dict, healthcheck_endpoint: str):
+        resources: dict, healthcheck_endpoint: str, instance_names: Optional[Dict[str, str]] = None):
 # {
 #     "kind": "compute#forwardingRule",
 #     "name": "",
@@ -46,8 +48,14 @@ def http_healthcheck(
     for resource in resources:
         url = f"http://{resource['IPAddress']}:{resource['ports'][0]}{healthcheck_endpoint}"
         try:
-            response = requests.get(
-                url=url, timeout=connection_timeout)
+            # Service instance of forwarding rule labels health check latency metric
+            with tracer.span('GET', HEALTHCHECK, method='GET', resource=url,
+                             instance=(instance_names or {}).get(resource['name'], '')) as span:
+                response = requests.get(
+                    url=url, timeout=connection_timeout)
+                span.args['status_code'] = response.status_code
+                if response.status_code != 200:
+                    span.args['outcome'] = f"error {response.status_code}"
             # print(response)
             resource.update({'url': url, 'status_code': response.status_code, 'body': response.json()})
         except Exception as exc:
@@ -60,19 +68,20 @@ def http_healthcheck(
     print("===== Healthcheck results =====")
     for result in results:
         if result['status_code'] != 200:
-            print(f"\x1b[31;1m{result['name']} || {result['url']} || {result['status_code']} \x1b[0m")
+            print(paint(f"{result['name']} || {result['url']} || {result['status_code']} ", 'Red'))
             print(f"Body: {json.dumps(result['body'], indent=4)}")
         else:
-            print(f"\x1b[32;20m{result['name']} || {result['url']} || {result['status_code']} \x1b[0m")
+            print(paint(f"{result['name']} || {result['url']} || {result['status_code']} ", 'Green'))
             # print(f"Body: {json.dumps(result['body'], indent=4)}")
 
     if len([x for x in results if x['status_code'] != 200]):
-        print("\x1b[31;1m===== Healthcheck failed! =====\x1b[0m")
+        print(paint("===== Healthcheck failed! =====", 'Red'))
         """Please check services on instances in instance group managed 
         ( Details about instances you can find in previous stage ) or contact with DevOps Teams"""
         exit(3)
-    print("\x1b[32;1m===== Healthcheck passed! =====\x1b[0m")
+    print(paint("===== Healthcheck passed! =====", 'Green'))
 
 
 if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s %(levelname)s: %(message)s", datefmt="%H:%M:%S", stream=sys.stderr)
     http_healthcheck()
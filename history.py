@@ -0,0 +1,251 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS releases (
+    id INTEGER PRIMARY KEY,
+    service TEXT NOT NULL,
+    version TEXT NOT NULL,
+    project TEXT NOT NULL,
+    region TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL,
+    duration REAL,
+    previous_version TEXT,
+    error TEXT,
+    definitions TEXT,
+    UNIQUE (service, project, region, version, operation, started)
+);
+CREATE INDEX IF NOT EXISTS releases_service ON releases (service, project, region, operation, finished);
+CREATE INDEX IF NOT EXISTS releases_finished ON releases (finished);
+CREATE TABLE IF NOT EXISTS steps (
+    release_id INTEGER NOT NULL REFERENCES releases (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    outcome TEXT
+);
+CREATE INDEX IF NOT EXISTS steps_release ON steps (release_id);
+CREATE TABLE IF NOT EXISTS resources (
+    release_id INTEGER NOT NULL REFERENCES releases (id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS resources_release ON resources (release_id);
+CREATE INDEX IF NOT EXISTS resources_name ON resources (name);
+"""
+# Default history.file of metadata
+HISTORY_FILE = 'deploy_history.db'
+# Time format of start_deploy and end_deploy of deploy result files
+RESULT_TIME_FORMAT = '%Y-%m-%d-%H-%M'
+# Bodies of deploy result file -> GCP collection of resources
+RESULT_COLLECTIONS = {
+    'disk_images': 'images',
+    'resource_policy': 'resourcePolicies',
+    'instance_template': 'instanceTemplates',
+    'health_checks': 'regionHealthChecks',
+    'instance_group_managed': 'regionInstanceGroupManagers',
+    'autoscaler': 'autoscalers',
+    'addresses': 'addresses',
+    'backends': 'regionBackendServices',
+    'forwarding_rules': 'forwardingRules',
+}
+# Database files with schema created by this process
+_initialized = set()
+_initialized_lock = threading.Lock()
+
+
+class DeployHistory:
+    """
+    Releases of services with step timings, resource names and outcomes in local SQLite
+    database indexed by service, project and region. Database is shared between CI jobs
+    and daemon threads of one machine, every call uses its own connection
+    """
+    def __init__(self, filename: str, logger, keep: int = 100, max_age_days: int = 0):
+        self.filename = filename
+        self.logger = logger
+        self.keep = keep
+        self.max_age_days = max_age_days
+        with _initialized_lock:
+            if os.path.abspath(filename) not in _initialized:
+                with self._connect() as db:
+                    db.executescript(SCHEMA)
+                _initialized.add(os.path.abspath(filename))
+
+    @classmethod
+    def from_metadata(cls, metadata, logger) -> 'DeployHistory':
+        config = metadata.metadata.get('history') or {}
+        return cls(config.get('file', HISTORY_FILE), logger,
+                   keep=config.get('keep', 100), max_age_days=config.get('maxAgeDays', 0))
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.filename, timeout=30)
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA foreign_keys=ON')
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def record(
+            self, service: str, version: str, project: str, region: str, operation: str, status: str,
+            started: float, finished: float, previous_version: Optional[str] = None, error: str = '',
+            definitions: Optional[Dict] = None, steps: Optional[List[Dict]] = None,
+            resources: Optional[Dict[str, List[str]]] = None) -> Optional[int]:
+        """
+        Saves release operation with its steps ( name, started, duration, outcome ) and resource names,
+        returns id of release or None when the same operation is recorded already
+        """
+        with self._connect() as db:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO releases (service, version, project, region, operation, status, started, "
+                "finished, duration, previous_version, error, definitions) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (service, version, project, region, operation, status, started, finished,
+                 round(finished - started, 3) if finished else None, previous_version, error,
+                 json.dumps(definitions) if definitions is not None else None))
+            if not cursor.rowcount:
+                return None
+            release_id = cursor.lastrowid
+            db.executemany("INSERT INTO steps (release_id, name, started, duration, outcome) VALUES (?, ?, ?, ?, ?)",
+                           [(release_id, x['name'], x['started'], x['duration'], x.get('outcome'))
+                            for x in steps or []])
+            db.executemany("INSERT INTO resources (release_id, kind, name) VALUES (?, ?, ?)",
+                           [(release_id, kind, name) for kind, names in (resources or {}).items() for name in names])
+        self.prune(service, project, region)
+        return release_id
+
+    def previous_version(
+            self, service: str, project: str, region: str, version: str,
+            existing: Optional[List[str]] = None) -> Optional[str]:
+        """
+        Version of latest successful deploy of service before version, only versions
+        which still have resources in project when existing versions are given
+        """
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT version FROM releases WHERE service = ? AND project = ? AND region = ? "
+                "AND operation = 'deploy' AND status = 'DONE' AND version != ? ORDER BY finished DESC",
+                (service, project, region, version)).fetchall()
+        for (candidate, ) in rows:
+            if existing is None or candidate in existing:
+                return candidate
+        return None
+
+    def releases(self, service: str, project: str, region: str, limit: int = 20) -> List[Dict]:
+        """
+        Latest release operations of service, newest first
+        """
+        with self._connect() as db:
+            db.row_factory = sqlite3.Row
+            rows = db.execute(
+                "SELECT id, version, operation, status, started, finished, duration, previous_version, error "
+                "FROM releases WHERE service = ? AND project = ? AND region = ? ORDER BY started DESC LIMIT ?",
+                (service, project, region, limit)).fetchall()
+        return [dict(x) for x in rows]
+
+    def step_trends(self, service: str, project: str, region: str, limit: int = 10) -> Dict[str, List[float]]:
+        """
+        Durations of deploy steps in latest successful deploys of service, oldest first
+        """
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT steps.name, steps.duration FROM steps JOIN ("
+                "SELECT id, finished FROM releases WHERE service = ? AND project = ? AND region = ? "
+                "AND operation = 'deploy' AND status = 'DONE' ORDER BY finished DESC LIMIT ?"
+                ") AS latest ON steps.release_id = latest.id ORDER BY latest.finished, steps.started",
+                (service, project, region, limit)).fetchall()
+        trends: Dict[str, List[float]] = {}
+        for name, duration in rows:
+            trends.setdefault(name, []).append(duration)
+        return trends
+
+    def prune(self, service: str, project: str, region: str):
+        """
+        Retention: latest keep operations of service and operations younger than maxAgeDays
+        """
+        with self._connect() as db:
+            if self.keep:
+                db.execute(
+                    "DELETE FROM releases WHERE service = ? AND project = ? AND region = ? AND id NOT IN ("
+                    "SELECT id FROM releases WHERE service = ? AND project = ? AND region = ? "
+                    "ORDER BY started DESC LIMIT ?)",
+                    (service, project, region, service, project, region, self.keep))
+            if self.max_age_days:
+                db.execute("DELETE FROM releases WHERE started < ?", (time.time() - self.max_age_days * 86400, ))
+
+    def import_files(self, filenames: List[str], project: str, region: str) -> int:
+        """
+        Deploy result files <service>_<version>_<time>.json of earlier deploys, returns count of imported
+        """
+        imported = 0
+        for filename in filenames:
+            if filename.endswith('_boot_timeline.json'):
+                continue
+            try:
+                with open(filename, 'r') as file:
+                    definitions = json.loads(file.read())
+                meta = definitions['metadata']
+                service, version = meta['service_name'], meta['version']
+                started = datetime.strptime(meta['start_deploy'], RESULT_TIME_FORMAT).timestamp()
+                finished = datetime.strptime(meta['end_deploy'], RESULT_TIME_FORMAT).timestamp() \
+                    if meta.get('end_deploy') else None
+            except (OSError, ValueError, KeyError, TypeError) as exc:
+                self.logger.colored(f"Skipping {filename}, not a deploy result file: {exc}", 'Yellow')
+                continue
+            release_id = self.record(
+                service, version, project, region, 'deploy', 'DONE' if finished else 'FAILED',
+                started, finished or started, previous_version=meta.get('previous_version'),
+                definitions=definitions, resources=result_resources(definitions))
+            if release_id:
+                imported += 1
+                self.logger.colored(f"Imported {service} {version} from {filename}", 'Cyan')
+            else:
+                self.logger.logger.info("Deploy of %s is imported already", filename)
+        return imported
+
+    def show(self, service: str, project: str, region: str, limit: int = 20):
+        releases = self.releases(service, project, region, limit)
+        self.logger.colored("==== History of {} in {} {} ( {} ) ====".format(
+            service, project, region, self.filename), 'Cyan')
+        self.logger.colored("{:<20} {:<16} {:<8} {:<20} {:>9} {:<20}".format(
+            'started', 'operation', 'status', 'version', 'duration', 'previous'), 'Light_Purple')
+        for x in releases:
+            self.logger.colored("{:<20} {:<16} {:<8} {:<20} {:>8}s {:<20}".format(
+                datetime.fromtimestamp(x['started']).strftime('%Y-%m-%d %H:%M:%S'), x['operation'], x['status'],
+                x['version'], round(x['duration'] or 0, 1), x['previous_version'] or ''),
+                'Green' if x['status'] == 'DONE' else 'Red')
+        trends = self.step_trends(service, project, region)
+        if trends:
+            self.logger.colored("Deploy steps, seconds of latest deploys ( oldest first ):", 'Cyan')
+            for name, durations in trends.items():
+                self.logger.colored("{:<40} {}".format(
+                    name[:40], ' '.join(f"{x:.1f}" for x in durations)), 'Light_Purple')
+
+
+def result_resources(definitions: Dict) -> Dict[str, List[str]]:
+    """
+    Resource names of release per GCP collection from bodies of deploy result file
+    """
+    resources = {}
+    for kind, collection in RESULT_COLLECTIONS.items():
+        bodies = definitions.get(kind) or []
+        names = [x['name'] for x in (bodies if isinstance(bodies, list) else [bodies])
+                 if isinstance(x, dict) and x.get('name')]
+        if names:
+            resources.setdefault(collection, []).extend(names)
+    return resources
+
+
+def find_result_files(directory: str = '.') -> List[str]:
+    return sorted(os.path.join(directory, x) for x in os.listdir(directory)
+                  if x.endswith('.json') and not x.endswith('_boot_timeline.json') and x.count('_') >= 2)
@@ -0,0 +1,139 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List
+import yaml
+from _logger import DeployLogger
+from metadata import DeploymentMetadata
+from providers.gcp import GCP, GcpSession
+from providers.gke import GKE
+import operations
+
+# Log format of matrix run, logger name shows target of message
+MATRIX_LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s]: %(message)s"
+MATRIX_OPERATIONS = ['deploy', 'delete_previous', 'overview']
+
+
+def load_targets(filename: str, logger) -> List[Dict]:
+    """
+    Targets of matrix file: list of service, metadata file, version and operation
+    """
+    try:
+        with open(filename, 'r') as file:
+            targets = (yaml.safe_load(file.read()) or {}).get('targets') or []
+    except Exception as exc:
+        logger.colored(f"Failed reading matrix targets file {filename}: {exc}", 'Red', 'error')
+        exit(3)
+    for target in targets:
+        target.setdefault('operation', 'deploy')
+        if not target.get('service') or not target.get('metadata'):
+            logger.colored(f"Matrix target requires service and metadata: {target}", 'Red', 'error')
+            exit(3)
+        if target['operation'] not in MATRIX_OPERATIONS:
+            logger.colored("Matrix target {} has unsupported operation {}, supported: {}".format(
+                target['service'], target['operation'], ', '.join(MATRIX_OPERATIONS)), 'Red', 'error')
+            exit(3)
+        if target['operation'] == 'deploy' and not target.get('version'):
+            logger.colored(f"Matrix target {target['service']} deploy requires version", 'Red', 'error')
+            exit(3)
+    return targets
+
+
+class Matrix:
+    """
+    Many services and regions in one process: targets share GCP authentication,
+    API clients, inventory and rate limiter, and run concurrently with global
+    and per region limits
+    """
+    def __init__(
+            self,
+            targets: List[Dict],
+            gcp_token: str,
+            logger,
+            max_parallel: int = 4,
+            max_per_region: int = 2,
+            rate_limit: float = 0,
+            inventory_ttl: int = 300,
+            boot_timeline: bool = False,
+    ):
+        self.targets = targets
+        self.logger = logger
+        self.max_parallel = max_parallel
+        self.max_per_region = max(max_per_region, 1)
+        self.boot_timeline = boot_timeline
+        self.session = GcpSession(gcp_token, logger, rate_limit=rate_limit, inventory_ttl=inventory_ttl)
+
+    def _target_name(self, target: Dict, region: str = '') -> str:
+        return f"{target['service']}@{region}" if region else target['service']
+
+    def run_target(self, target: Dict, metadata: DeploymentMetadata) -> Dict:
+        logger = DeployLogger(loglvl=self.logger.loglvl, name=self._target_name(target, metadata.gcp_region))
+        result = {
+            'service': target['service'],
+            'region': metadata.gcp_region,
+            'version': target.get('version') or '',
+            'operation': target['operation'],
+            'status': 'DONE',
+            'duration': 0,
+            'error': '',
+        }
+        start_time = time.time()
+        try:
+            gke = GKE(target['service'], metadata, logger)
+            gke.get_ingresses()
+            gcp = GCP(metadata=metadata, gcp_token=self.session.gcp_token, logger=logger,
+                      service=target['service'], session=self.session)
+            if target['operation'] == 'deploy':
+                operations.deploy(target['service'], target['version'], metadata, logger, gcp, gke,
+                                  boot_timeline=self.boot_timeline)
+            elif target['operation'] == 'delete_previous':
+                operations.delete_previous(target['service'], metadata, logger, gcp, gke,
+                                           defer=target.get('defer', False))
+            else:
+                gcp.overview()
+        except (Exception, SystemExit) as exc:
+            result['status'] = 'FAILED'
+            result['error'] = str(exc)
+            logger.colored(f"{target['operation']} failed: {exc}", 'Red', 'error')
+        result['duration'] = round(time.time() - start_time, 1)
+        return result
+
+    def run(self) -> List[Dict]:
+        # Metadata of all targets is read before any target starts
+        loaded = [(target, DeploymentMetadata.load(target['metadata'], self.logger)) for target in self.targets]
+
+        self.logger.colored("Matrix of {} targets in regions {}, parallel: {}, per region: {}".format(
+            len(loaded), ', '.join(sorted({x.gcp_region for _, x in loaded})), self.max_parallel,
+            self.max_per_region), 'Cyan')
+        results = []
+        pending = list(loaded)
+        running: Dict[Future, str] = {}
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            while pending or running:
+                # Targets are submitted in order when their region has free slot, targets
+                # waiting for busy region never hold workers of other regions
+                for target, metadata in list(pending):
+                    if len(running) >= self.max_parallel:
+                        break
+                    if list(running.values()).count(metadata.gcp_region) < self.max_per_region:
+                        pending.remove((target, metadata))
+                        running[executor.submit(self.run_target, target, metadata)] = metadata.gcp_region
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    results.append(future.result())
+        order = {self._target_name(t, m.gcp_region): i for i, (t, m) in enumerate(loaded)}
+        results.sort(key=lambda x: order.get(f"{x['service']}@{x['region']}", 0))
+        self.summary(results)
+        return results
+
+    def summary(self, results: List[Dict]):
+        self.logger.colored("==== Matrix summary ====", 'Cyan')
+        self.logger.colored("{:<30} {:<20} {:<16} {:<16} {:<8} {:>9}".format(
+            'service', 'region', 'version', 'operation', 'status', 'duration'), 'Light_Purple')
+        for x in results:
+            self.logger.colored("{:<30} {:<20} {:<16} {:<16} {:<8} {:>8}s".format(
+                x['service'], x['region'], x['version'], x['operation'], x['status'], x['duration']),
+                'Green' if x['status'] == 'DONE' else 'Red')
+        for x in results:
+            if x['error']:
+                self.logger.logger.error("%s@%s: %s", x['service'], x['region'], x['error'])
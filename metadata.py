@@ -1,11 +1,289 @@
+import logging
+import os
 import sys
+import threading
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple
 import yaml
 # from _logger import DeployLogger
 
+try:
+    # libyaml loader, pure Python loader when PyYAML is built without libyaml
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 # logger = DeployLogger(loglvl='INFO', name='metadata')
 
 
+class Key(NamedTuple):
+    """
+    Metadata key: accepted types of value, mandatory or not, and schema
+    of nested mapping ( or of every item of list )
+    """
+    types: Tuple[type, ...]
+    required: bool = True
+    schema: Optional[Dict[str, 'Key']] = None
+
+
+def required(*types: type, schema: Optional[Dict[str, Key]] = None) -> Key:
+    return Key(types, True, schema)
+
+
+def optional(*types: type, schema: Optional[Dict[str, Key]] = None) -> Key:
+    return Key(types, False, schema)
+
+
+NUMBER = (int, float)
+# Keys used by release operations, other keys of metadata are not checked
+SCHEMA = {
+    'gcp_project': required(dict, schema={
+        'name': required(str),
+        'region': required(str),
+        'network': required(str),
+        'subnetwork': required(str),
+        'service_account': required(str),
+        'zones': optional(list),
+    }),
+    'healthcheck_endpoint': required(str),
+    'service_instances': required(list, schema={
+        'name': required(str),
+        'port': required(dict),
+        'healthcheck': optional(str),
+    }),
+    'gce_instance': required(dict, schema={
+        'base_instance_name': required(str),
+        'machine_type': required(str),
+        'source_boot_disk': required(str),
+        'source_data_disk': required(str),
+        'tags': required(list),
+        'performance_profile': optional(str),
+        'performance_profiles': optional(dict),
+    }),
+    'gce_instance_group': required(dict, schema={
+        'size': required(int),
+        'targetSize': required(int),
+        'autoHealing': required(dict, schema={
+            'initialDelaySec': required(int),
+            'healthCheck': required(str),
+            'serviceInstance': optional(str),
+            'calibration': optional(dict),
+        }),
+        'distributionPolicy': required(dict, schema={
+            'targetShape': required(str),
+            'zones': required(list, schema={'zone': required(str)}),
+        }),
+        'scaling': required(dict, schema={
+            'mode': required(str),
+            'minNumReplicas': required(int),
+            'maxNumReplicas': required(int),
+            'coolDownPeriodSec': required(int),
+            'cpuUtilizationTarget': required(*NUMBER),
+            'customMetricUtilizations': optional(list),
+            'preScale': optional(bool),
+            'warmupWindowSec': optional(int),
+            'predictiveMethod': optional(str),
+            'scaleInControl': optional(dict),
+            'scalingSchedules': optional(dict),
+        }),
+        'instanceFlexibility': optional(list),
+        'stockoutFallback': optional(dict),
+        'placement': optional(dict),
+        'standby': optional(dict),
+    }),
+    'health_check': optional(dict, schema={
+        'managed': optional(bool),
+        'type': optional(str),
+        'checkIntervalSec': optional(int),
+        'timeoutSec': optional(int),
+        'healthyThreshold': optional(int),
+        'unhealthyThreshold': optional(int),
+    }),
+    'load_balancer': required(dict, schema={
+        'loadBalancingScheme': required(str),
+        'protocol': required(str),
+        'sessionAffinity': required(str),
+        'timeoutSec': required(int),
+        'balancingMode': required(str),
+        'drainingTimeoutSec': required(int),
+        'maxConnectionsPerInstance': optional(int),
+        'addressPool': optional(dict),
+    }),
+    'gke_cluster': required(dict, schema={
+        'name': required(str),
+        'namespace': required(str),
+        'context': optional(str),
+        'ingress': optional(dict),
+        'instances': optional(list),
+    }),
+    'teardown': optional(dict),
+    'history': optional(dict, schema={
+        'file': optional(str),
+        'keep': optional(int),
+        'maxAgeDays': optional(int),
+        'exportJson': optional(bool),
+    }),
+}
+# Parameters of health checks managed by release
+MANAGED_HEALTH_CHECK_KEYS = ['checkIntervalSec', 'timeoutSec', 'healthyThreshold', 'unhealthyThreshold']
+
+
+def validate(data: Any, schema: Dict[str, Key] = SCHEMA, path: str = '') -> List[str]:
+    """
+    All problems of metadata against schema in one pass: missing keys and wrong types
+    """
+    if not isinstance(data, dict):
+        return [f"{path or 'metadata'}: expected mapping, got {type(data).__name__}"]
+    problems = []
+    for name, key in schema.items():
+        key_path = f"{path}.{name}" if path else name
+        if data.get(name) is None:
+            if key.required:
+                problems.append(f"{key_path}: required key is missing")
+            continue
+        value = data[name]
+        # bool is int in Python, YAML on/off/yes/no are not numbers
+        if not isinstance(value, key.types) or (isinstance(value, bool) and bool not in key.types):
+            problems.append("{}: expected {}, got {} {!r}".format(
+                key_path, ' or '.join(x.__name__ for x in key.types), type(value).__name__, value))
+            continue
+        if key.schema and isinstance(value, dict):
+            problems.extend(validate(value, key.schema, key_path))
+        elif key.schema and isinstance(value, list):
+            for index, item in enumerate(value):
+                problems.extend(validate(item, key.schema, f"{key_path}[{index}]"))
+    if not path and (data.get('health_check') or {}).get('managed'):
+        problems.extend(f"health_check.{x}: required key of managed health checks is missing"
+                        for x in MANAGED_HEALTH_CHECK_KEYS if data['health_check'].get(x) is None)
+    if not path and isinstance(data.get('gce_instance_group'), dict):
+        group = data['gce_instance_group']
+        policy = group.get('distributionPolicy')
+        shape = policy.get('targetShape') if isinstance(policy, dict) else None
+        # GCP accepts instance flexibility policy only with non-EVEN target shape ( compact placement is single zone )
+        if group.get('instanceFlexibility') and shape == 'EVEN' and not (group.get('placement') or {}).get('enabled'):
+            problems.append("gce_instance_group.instanceFlexibility: requires distributionPolicy.targetShape "
+                            "BALANCED, ANY or ANY_SINGLE_ZONE, got EVEN")
+    return problems
+
+
+class LoadBalancer(NamedTuple):
+    loadBalancingScheme: str
+    protocol: str
+    sessionAffinity: str
+    timeoutSec: int
+    balancingMode: str
+    drainingTimeoutSec: int
+    maxConnectionsPerInstance: Optional[int] = None
+    addressPool: Optional[dict] = None
+
+
+class Scaling(NamedTuple):
+    mode: str
+    minNumReplicas: int
+    maxNumReplicas: int
+    coolDownPeriodSec: int
+    cpuUtilizationTarget: float
+    customMetricUtilizations: Tuple[dict, ...] = ()
+
+
+class DistributionPolicy(NamedTuple):
+    targetShape: str
+    zones: Tuple[dict, ...]
+
+
+def section(typed, data: Dict):
+    """
+    Typed section from validated mapping of metadata
+    """
+    values = {k: data[k] for k in typed._fields if data.get(k) is not None}
+    return typed(**{k: tuple(v) if isinstance(v, list) else v for k, v in values.items()})
+
+
+class FrozenDict(dict):
+    """
+    Read-only mapping of loaded metadata shared by matrix targets and daemon jobs. Unlike MappingProxyType
+    it is serialized by json ( request bodies, history ), copies ( dict(), .copy(), deepcopy ) are mutable
+    """
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Metadata is read-only, change a copy of it")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self), )
+
+
+def freeze(value):
+    """
+    Read-only copy of parsed metadata: mappings as FrozenDict, lists as tuples
+    """
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(x) for x in value)
+    return value
+
+
+def thaw(value):
+    """
+    Mutable copy of frozen metadata value
+    """
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(x) for x in value]
+    return value
+
+
+# Metadata file path -> ( modification time and size, metadata )
+_CACHE: Dict[str, Tuple[Tuple[int, int], 'DeploymentMetadata']] = {}
+_CACHE_LOCK = threading.Lock()
+
+
 class DeploymentMetadata:
+    """
+    Deploy metadata validated against schema, attributes and nested values can not be changed after file is loaded
+    """
+    __slots__ = (
+        'metadata_file', 'logger', 'service_instances', 'gcp_token', 'gcp_project', 'gcp_region', 'network',
+        'subnetwork', 'service_account', 'machine_type', 'instance_name', 'instance_tags', 'source_boot_disk',
+        'source_data_disk', 'initialDelaySec', 'instance_group_size', 'target_size', 'healthcheck_endpoint',
+        'gke_cluster', 'gke_namespace', 'gke_context', 'instance_group_helthcheck', 'health_check', 'load_balancer',
+        'scaling', 'distribution_policy', 'metadata', '_frozen',
+    )
+    metadata_file: str
+    service_instances: Tuple[Mapping, ...]
+    gcp_project: str
+    gcp_region: str
+    network: str
+    subnetwork: str
+    service_account: str
+    machine_type: str
+    instance_name: str
+    instance_tags: Tuple[str, ...]
+    source_boot_disk: str
+    source_data_disk: str
+    initialDelaySec: int
+    instance_group_size: int
+    target_size: int
+    healthcheck_endpoint: str
+    gke_cluster: str
+    gke_namespace: str
+    gke_context: Optional[str]
+    instance_group_helthcheck: str
+    health_check: Mapping
+    load_balancer: LoadBalancer
+    scaling: Scaling
+    distribution_policy: DistributionPolicy
+    metadata: Mapping
+
     def __init__(
             self,
             metadata_file: str,
@@ -17,40 +295,52 @@ class DeploymentMetadata:
         # self.service_name = app
         # self.service_version = version
         self.logger = logger
-
-        self.service_instances = []
-
         self.gcp_token = None
-        self.gcp_project = None
-        self.gcp_region = None
-        self.network = None
-        self.subnetwork = None
-        self.service_account = None
-
-        self.machine_type = None
-        self.instance_name = None
-        self.instance_tags = None
-        self.source_boot_disk = None
-        self.source_data_disk = None
-        self.initialDelaySec = None
-        self.instance_group_size = None
-
-        self.gke_cluster = None
-        self.gke_namespace = None
-        self.instance_group_helthcheck = None
-        self.metadata = None  # dict
-
         self.load_metadata()
+        self._frozen = True
+
+    def __setattr__(self, name: str, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f"Metadata of {self.metadata_file} is frozen, {name} can not be changed")
+        object.__setattr__(self, name, value)
+
+    @classmethod
+    def load(cls, metadata_file: str, logger) -> 'DeploymentMetadata':
+        """
+        Metadata of file parsed once per path and modification time ( matrix targets, daemon jobs )
+        """
+        path = os.path.abspath(metadata_file)
+        try:
+            stat = os.stat(path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return cls(metadata_file=metadata_file, logger=logger)
+        with _CACHE_LOCK:
+            cached = _CACHE.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        metadata = cls(metadata_file=metadata_file, logger=logger)
+        with _CACHE_LOCK:
+            _CACHE[path] = (stamp, metadata)
+        return metadata
 
     def load_metadata(self):
         try:
             with open(self.metadata_file, 'r') as f:
                 self.logger.colored(f"Reading metadata file: {self.metadata_file}", 'Cyan', 'info')
-                metadata = yaml.safe_load(f.read())
-            self.logger.logger.debug('Metadata: \n%s', yaml.dump(metadata))
+                metadata = yaml.load(f.read(), Loader=SafeLoader)
+            if self.logger.logger.isEnabledFor(logging.DEBUG):
+                self.logger.logger.debug('Metadata: \n%s', yaml.dump(metadata))
         except Exception as exc:
             self.logger.logger.error("Failed reading metadata file: %s", str(exc), stack_info=False)
             sys.exit(3)
+        problems = validate(metadata)
+        if problems:
+            self.logger.colored("Metadata file {} is not valid: \n- {}".format(
+                self.metadata_file, '\n- '.join(problems)), 'Red', 'error')
+            sys.exit(3)
+        # Metadata is shared by releases of matrix targets and daemon jobs through load cache
+        metadata = freeze(metadata)
         # ===== GCP Project
         # setattr(self, "gcp_token", metadata['gcp_project']['auth_json_file'])  # json file name
         # setattr(self, "gcp_project", metadata['gcp_project']['name'])
@@ -69,6 +359,7 @@ class DeploymentMetadata:
         self.service_account = metadata['gcp_project']['service_account']
 
         self.service_instances = metadata['service_instances']
+        self.healthcheck_endpoint = metadata['healthcheck_endpoint']
 
         self.source_boot_disk = metadata['gce_instance']['source_boot_disk']
         self.source_data_disk = metadata['gce_instance']['source_data_disk']
@@ -81,10 +372,17 @@ class DeploymentMetadata:
         self.instance_tags = metadata['gce_instance']['tags']
 
         self.instance_group_size = metadata['gce_instance_group']['size']
+        self.target_size = metadata['gce_instance_group']['targetSize']
         self.initialDelaySec = metadata['gce_instance_group']['autoHealing']['initialDelaySec']
         self.instance_group_helthcheck = metadata['gce_instance_group']['autoHealing']['healthCheck']
+        self.distribution_policy = section(DistributionPolicy, metadata['gce_instance_group']['distributionPolicy'])
+        self.scaling = section(Scaling, metadata['gce_instance_group']['scaling'])
+        # Optional per release health checks parameters
+        self.health_check = metadata.get('health_check') or {}
+        self.load_balancer = section(LoadBalancer, metadata['load_balancer'])
 
         self.gke_namespace = metadata['gke_cluster']['namespace']
         self.gke_cluster = metadata['gke_cluster']['name']
+        self.gke_context = metadata['gke_cluster'].get('context')
 
-        self.metadata = metadata
\ No newline at end of file
+        self.metadata = metadata
@@ -0,0 +1,111 @@
+import os
+import time
+from typing import Dict, Tuple
+from tracing import Tracer, Span, API, K8S, OPERATION, STABILIZATION, HEALTHCHECK, STEP, RUN
+
+# Metric name -> ( type, help )
+METRICS = {
+    'gcp_deploy_run_duration_seconds': ('gauge', 'Duration of release operation'),
+    'gcp_deploy_run_success': ('gauge', 'Release operation finished without error ( 1 ) or failed ( 0 )'),
+    'gcp_deploy_run_timestamp_seconds': ('gauge', 'Time release operation finished'),
+    'gcp_deploy_step_duration_seconds': ('gauge', 'Duration of release step'),
+    # Totals of last run are gauges: every run replaces file, counters would reset on every run
+    'gcp_deploy_api_calls_last_run': ('gauge', 'API calls per method in last run'),
+    'gcp_deploy_api_errors_last_run': ('gauge', 'Failed API calls per method in last run'),
+    'gcp_deploy_api_retries_last_run': ('gauge', 'Retried API requests per method in last run'),
+    'gcp_deploy_api_duration_seconds_last_run': ('gauge', 'Time spent in API calls per method in last run'),
+    'gcp_deploy_operation_wait_seconds_last_run': ('gauge', 'Time spent waiting GCP operations in last run'),
+    'gcp_deploy_operations_last_run': ('gauge', 'Waited GCP operations in last run'),
+    'gcp_deploy_mig_stabilization_seconds': ('gauge', 'Time instance group took to become stable'),
+    'gcp_deploy_healthcheck_latency_seconds': ('gauge', 'Latency of load balancer health check request'),
+}
+LABELS = ('service', 'version', 'region', 'operation')
+
+
+def _escape(value) -> str:
+    return str(value if value is not None else '').replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.3f}"
+
+
+def _labels(labels: Dict) -> str:
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+class MetricsExporter:
+    """
+    Prometheus metrics of release operations from spans of process tracer,
+    written in node-exporter textfile collector format
+    """
+    def __init__(self, tracer: Tracer, default_labels: Dict):
+        self.tracer = tracer
+        # Labels of spans outside release operations ( operation of run.py )
+        self.default_labels = {k: default_labels.get(k) or '' for k in LABELS}
+        self.samples: Dict[str, Dict[Tuple, float]] = {name: {} for name in METRICS}
+
+    def _add(self, name: str, labels: Dict, value: float, accumulate: bool = True):
+        key = tuple(sorted(labels.items()))
+        if accumulate:
+            self.samples[name][key] = self.samples[name].get(key, 0) + value
+        else:
+            self.samples[name][key] = value
+
+    def _run_labels(self, root: Span) -> Dict:
+        if root.category != RUN:
+            return self.default_labels
+        labels = dict(self.default_labels, operation=root.name)
+        labels.update({k: root.args[k] for k in ('service', 'version', 'region') if root.args.get(k)})
+        return labels
+
+    def collect(self):
+        spans = self.tracer.finished_spans()
+        roots = {x.id: x for x in spans if x.parent is None}
+        for span in spans:
+            root = roots.get(span.trace)
+            labels = self._run_labels(root) if root else self.default_labels
+            if span is root and span.category == RUN:
+                self._add('gcp_deploy_run_duration_seconds', labels, span.duration, accumulate=False)
+                self._add('gcp_deploy_run_success', labels, 1 if span.args.get('outcome') == 'ok' else 0,
+                          accumulate=False)
+                self._add('gcp_deploy_run_timestamp_seconds', labels, span.end, accumulate=False)
+            elif span.category == STEP:
+                self._add('gcp_deploy_step_duration_seconds', dict(labels, step=span.name), span.duration)
+            elif span.category in (API, K8S):
+                method = dict(labels, api=span.category, method=span.name)
+                self._add('gcp_deploy_api_calls_last_run', method, 1)
+                self._add('gcp_deploy_api_errors_last_run', method, 0 if span.args.get('outcome') == 'ok' else 1)
+                self._add('gcp_deploy_api_retries_last_run', method, span.args.get('retries', 0))
+                self._add('gcp_deploy_api_duration_seconds_last_run', method, span.duration)
+            elif span.category == OPERATION:
+                self._add('gcp_deploy_operation_wait_seconds_last_run', labels, span.duration)
+                self._add('gcp_deploy_operations_last_run', labels, 1)
+            elif span.category == STABILIZATION:
+                self._add('gcp_deploy_mig_stabilization_seconds',
+                          dict(labels, instance_group=span.args.get('instance_group_name', '')), span.duration)
+            elif span.category == HEALTHCHECK and span.args.get('instance'):
+                # Labeled by service instance, URL of request changes with every release
+                self._add('gcp_deploy_healthcheck_latency_seconds',
+                          dict(labels, instance=span.args['instance']), span.duration, accumulate=False)
+
+    def render(self) -> str:
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            if not self.samples[name]:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key, value in sorted(self.samples[name].items()):
+                lines.append(f"{name}{_labels(dict(key))} {_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def drop_to_file(self, filename: str):
+        """
+        Metrics file is replaced atomically, collector never reads partially written file
+        """
+        self.collect()
+        temporary = f"{filename}.{os.getpid()}.{int(time.time())}.tmp"
+        with open(temporary, 'w') as file:
+            file.write(self.render())
+        os.replace(temporary, filename)
@@ -0,0 +1,115 @@
+from _logger import lazy_json
+from release import Release
+from preflight import Preflight
+from teardown import TeardownQueue
+
+
+def previous_versions(gcp, gke, standby: bool = False) -> set:
+    """
+    Versions of service found in GCP project which are not current in load balancer,
+    warm standby releases ( rollback targets ) only with standby
+    """
+    version_for_delete = set()
+    for versions in gcp.gcp_resources_version.values():
+        for version in versions:
+            if version not in gke.current_versions:
+                version_for_delete.add(version)
+    if not standby:
+        version_for_delete -= gcp.standby_versions()
+    return version_for_delete
+
+
+def deploy(service: str, version: str, metadata, logger, gcp, gke, boot_timeline: bool = False,
+           preflight: bool = True) -> Release:
+    logger.colored(
+        f"Receiving command on deploy service {service} version {version}", 'Cyan', 'info')
+
+    # Initialize Release object of release version
+    release = Release(service=service, version=version, metadata=metadata, logger=logger, gcp=gcp,
+                      boot_timeline=boot_timeline)
+    # Checking what release version not current
+    if release.version in gke.current_versions:
+        logger.colored('Sorry, but this version: {} already deployed and is current ( in LoadBalancer )'.format(
+                     release.version), 'Red', 'error')
+        exit(3)
+    logger.colored('Discovering GCP project: {} in region: {}'.format(
+                metadata.gcp_project, metadata.gcp_region), 'Cyan')
+
+    # Discovering GCP project
+    gcp.overview()
+    gcp.remove_expired_warmup_schedules()
+    release.prescale(gke.current_version)
+    # Checks of references, quotas and address space before any resource is created
+    if preflight:
+        Preflight(release, gcp, logger, current_version=gke.current_version).run()
+
+    if release.version in previous_versions(gcp, gke, standby=True):
+        gke.require_current_versions()
+        logger.logger.info(
+            'This deployment of %s version %s found in GCP project bun is not current',
+            release.service_name, release.version)
+        release.delete()
+
+    logger.colored('Start deploy service: {}, version {}'.format(
+        release.service_name, release.version), 'Cyan')
+    release.deploy()
+    return release
+
+
+def delete_previous(service: str, metadata, logger, gcp, gke, defer: bool = False):
+    gke.require_current_versions()
+    gcp.overview()
+    logger.colored(f"==== Find previous versions of {service} in GCP project {metadata.gcp_project} ====",
+                   'Cyan')
+    version_for_delete = previous_versions(gcp, gke)
+    logger.colored(f"Current working {service} version: {', '.join(sorted(gke.current_versions))}", 'Cyan')
+    if gcp.standby_versions():
+        logger.colored(f"Standby {service} versions are kept: {', '.join(sorted(gcp.standby_versions()))}", 'Cyan')
+    if version_for_delete and defer:
+        teardown = metadata.metadata.get('teardown') or {}
+        queue = TeardownQueue(teardown.get('queueFile', 'teardown_queue.json'), logger)
+        for version in version_for_delete:
+            queue.add(service, version, metadata.gcp_project, metadata.gcp_region,
+                      teardown.get('gracePeriodSec', 3600))
+    elif version_for_delete:
+        logger.colored("Well be delete following %s releases versions: \n %s", 'Cyan', None,
+                       service, lazy_json(list(version_for_delete)))
+
+        releases_for_deleting = []
+        for version in version_for_delete:
+            releases_for_deleting.append(
+                Release(
+                    service=service,
+                    version=version,
+                    metadata=metadata,
+                    logger=logger,
+                    gcp=gcp)
+            )
+
+        for release in releases_for_deleting:
+            release.delete()
+    else:
+        logger.colored(f'In GCP project {metadata.gcp_project} for service {service} '
+                       f'not found previous version for deleting', 'Cyan', 'info')
+
+
+def delete(service: str, version: str, metadata, logger, gcp):
+    gcp.overview()
+    release = Release(service=service, version=version, metadata=metadata, logger=logger, gcp=gcp)
+    logger.logger.info('Delete deployment service: %s, version %s', release.service_name, release.version)
+    release.delete()
+
+
+def scale_down(service: str, version: str, metadata, logger, gcp):
+    gcp.overview()
+    release = Release(service=service, version=version, metadata=metadata, logger=logger, gcp=gcp)
+    logger.logger.info('==== Scale down deployment service: %s, version %s', release.service_name, release.version)
+    gcp.delete_region_autoscaler(release.autoscaler_name)
+    gcp.resizeRegionInstanceGroupManagers(group_name=release.instance_group_name, group_size=0)
+
+
+def scale_up(service: str, version: str, metadata, logger, gcp):
+    gcp.overview()
+    release = Release(service=service, version=version, metadata=metadata, logger=logger, gcp=gcp)
+    logger.logger.info('==== Scale up deployment service: %s, version %s', release.service_name, release.version)
+    release.scale_up()
@@ -0,0 +1,171 @@
+import ipaddress
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from release import Release, machine_type_family
+from tracing import tracer
+
+# Regional quota metrics of persistent disk types
+DISK_QUOTA_METRICS = {
+    'pd-standard': 'DISKS_TOTAL_GB',
+    'pd-balanced': 'SSD_TOTAL_GB',
+    'pd-ssd': 'SSD_TOTAL_GB',
+}
+# Machine families which vCPUs are counted in CPUS quota metric, other families have <FAMILY>_CPUS metric
+CPUS_QUOTA_FAMILIES = {'n1', 'e2', 'f1', 'g1'}
+# Addresses of every subnetwork primary range reserved by GCP
+SUBNETWORK_RESERVED_ADDRESSES = 4
+
+
+def cpu_quota_metric(machine_type: str) -> str:
+    family, _ = machine_type_family(machine_type)
+    return 'CPUS' if family in CPUS_QUOTA_FAMILIES else f"{family.upper()}_CPUS"
+
+
+class Preflight:
+    """
+    Checks of release references and capacity before any resource is created:
+    health checks, source disks, subnetwork, machine type, regional quotas and
+    address space. Checks run concurrently and report all problems at once
+    """
+    def __init__(self, release: Release, gcp, logger, current_version: Optional[str] = None):
+        self.release = release
+        self.gcp = gcp
+        self.logger = logger
+        self.metadata = release.metadata
+        self.current_version = current_version
+        # Instances of release footprint, calculated once before checks
+        self.footprint = 0
+
+    def zones(self) -> List[str]:
+        zones = [x['zone'].split('/')[-1] for x in self.metadata.distribution_policy.zones]
+        return zones or self.metadata.metadata['gcp_project'].get('zones') or []
+
+    def instances_footprint(self) -> int:
+        """
+        Instances which must fit next to current release: new release at its maximal size
+        and growth of current release up to its maximal size ( double blue-green footprint )
+        """
+        max_replicas = self.metadata.scaling.maxNumReplicas
+        new_release = max(self.metadata.target_size, self.release.warmup_capacity, max_replicas)
+        if not self.current_version:
+            return new_release
+        current_release = f"{self.release.service_name}-{self.current_version.replace('.', '-').lower()}"
+        current_size = self.gcp.getLiveCapacity(current_release, current_release)
+        return new_release + max(max_replicas - current_size, 0)
+
+    def addresses_footprint(self) -> int:
+        if self.release.use_address_pool:
+            free = [x for x in self.gcp.address_pool if x['status'] == 'RESERVED']
+            return max(len(self.release.service_instances) - len(free), 0)
+        return len(self.release.service_instances)
+
+    def check_health_checks(self) -> List[str]:
+        if self.metadata.health_check.get('managed'):
+            # Health checks are created by release, only parameters are validated
+            params = self.metadata.health_check
+            problems = [f"Service instance {x['name']} has no port for health check"
+                        for x in self.release.service_instances if not x.get('port')]
+            if params['timeoutSec'] > params['checkIntervalSec']:
+                problems.append(f"Health check timeoutSec: {params['timeoutSec']} must be less or equal "
+                                f"checkIntervalSec: {params['checkIntervalSec']}")
+            return problems
+        urls = {self.release.health_check_url(x) for x in self.release.service_instances}
+        urls.add(self.release.autohealing_health_check())
+        return [f"Health check not found: {url}" for url in sorted(urls) if self.gcp.getHealthCheck(url) is None]
+
+    def check_source_disks(self) -> List[str]:
+        problems = []
+        for disk in (self.metadata.source_boot_disk, self.metadata.source_data_disk):
+            response = self.gcp.getDisk(disk)
+            if response is None:
+                problems.append(f"Source disk not found: {disk}")
+            elif response.get('status') != 'READY':
+                problems.append(f"Source disk {disk} status is {response.get('status')}")
+        return problems
+
+    def check_machine_type(self) -> List[str]:
+        problems = []
+        for zone in self.zones():
+            if self.gcp.getMachineType(zone, self.metadata.machine_type) is None:
+                problems.append(f"Machine type {self.metadata.machine_type} is not available in zone {zone}")
+        return problems
+
+    def check_subnetwork(self) -> List[str]:
+        subnetwork = self.gcp.getSubnetwork(self.metadata.subnetwork)
+        if subnetwork is None:
+            return [f"Subnetwork not found: {self.metadata.subnetwork}"]
+        if subnetwork['region'].split('/')[-1] != self.metadata.gcp_region:
+            return [f"Subnetwork {subnetwork['name']} is in region {subnetwork['region'].split('/')[-1]}, "
+                    f"release region: {self.metadata.gcp_region}"]
+        size = ipaddress.ip_network(subnetwork['ipCidrRange']).num_addresses - SUBNETWORK_RESERVED_ADDRESSES
+        used = self.gcp.countSubnetworkAddresses(self.metadata.subnetwork) + \
+            self.gcp.countSubnetworkInstances(self.metadata.subnetwork)
+        required = self.footprint + self.addresses_footprint()
+        self.logger.logger.info("Subnetwork %s %s: %s addresses, used: %s, required: %s",
+                                subnetwork['name'], subnetwork['ipCidrRange'], size, used, required)
+        if size - used < required:
+            return [f"Subnetwork {subnetwork['name']} {subnetwork['ipCidrRange']} has {size - used} free addresses, "
+                    f"release requires {required}"]
+        return []
+
+    def check_quotas(self) -> List[str]:
+        quotas = self.gcp.getRegionQuotas()
+        zones = self.zones()
+        machine_type = self.gcp.getMachineType(zones[0], self.metadata.machine_type) if zones else None
+        instances = self.footprint
+        profile = self.release.performance_profile()
+        required = {'INSTANCES': instances}
+        if machine_type:
+            required[cpu_quota_metric(self.metadata.machine_type)] = machine_type['guestCpus'] * instances
+        for disk in ('bootDisk', 'dataDisk'):
+            metric = DISK_QUOTA_METRICS.get(profile[disk]['diskType'])
+            if metric:
+                required[metric] = required.get(metric, 0) + profile[disk]['diskSizeGb'] * instances
+        if self.addresses_footprint():
+            required['INTERNAL_ADDRESSES'] = self.addresses_footprint()
+
+        problems = []
+        for metric, value in required.items():
+            quota = quotas.get(metric)
+            if quota is None:
+                continue
+            free = quota['limit'] - quota['usage']
+            self.logger.logger.info("Quota %s limit: %s usage: %s required: %s",
+                                    metric, quota['limit'], quota['usage'], value)
+            if free < value:
+                problems.append(f"Quota {metric} in region {self.metadata.gcp_region}: "
+                                f"free {free:g} of {quota['limit']:g}, release requires {value}")
+        return problems
+
+    def _run_check(self, check: Callable) -> List[str]:
+        try:
+            return check()
+        except (Exception, SystemExit) as exc:
+            return [f"{check.__name__} failed: {exc}"]
+
+    def run(self) -> Dict[str, List[str]]:
+        checks = [
+            self.check_health_checks,
+            self.check_source_disks,
+            self.check_machine_type,
+            self.check_subnetwork,
+            self.check_quotas,
+        ]
+        self.logger.colored("==== Preflight of {} version {} ====".format(
+            self.release.service_name, self.release.version), 'Cyan')
+        start_time = time.time()
+        with tracer.run('preflight', self.logger, service=self.release.service_name, version=self.release.version):
+            self.footprint = self.instances_footprint()
+            with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+                results = dict(zip([x.__name__ for x in checks],
+                                   executor.map(tracer.wrap(self._run_check), checks)))
+        problems = [problem for check_problems in results.values() for problem in check_problems]
+        if problems:
+            self.logger.colored("Preflight of {} version {} failed in {:.2f}s: \n- {}".format(
+                self.release.service_name, self.release.version, time.time() - start_time,
+                '\n- '.join(problems)), 'Red', 'error')
+            exit(3)
+        self.logger.colored("Preflight of {} version {} passed in {:.2f}s".format(
+            self.release.service_name, self.release.version, time.time() - start_time), 'Green')
+        return results
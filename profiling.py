@@ -0,0 +1,112 @@
+import cProfile
+import io
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+
+class Profiler:
+    """
+    CPU profile of run.py operation: cProfile stats of main thread and sampled
+    stacks of all threads in collapsed format ( flamegraph.pl, speedscope ), every
+    sample is marked on-CPU or blocked by CPU time of its thread between samples
+    """
+    def __init__(self, prefix: str, logger, interval: float = 0.005):
+        self.prefix = prefix
+        self.logger = logger
+        self.interval = interval  # seconds between stack samples
+        self.profile = cProfile.Profile()
+        self.samples: Counter = Counter()
+        self.cpu_samples: Counter = Counter()
+        # thread name -> [ on-CPU samples, blocked samples ]
+        self.threads: Dict[str, list] = {}
+        self.rounds = 0  # sampling rounds of all threads
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._started = 0.0
+        self._usage = None
+
+    @staticmethod
+    def _stack(frame) -> str:
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(frames))
+
+    @staticmethod
+    def _thread_cpu(ident: int) -> Optional[float]:
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(ident))
+        except (AttributeError, OSError):
+            return None
+
+    def _sample(self):
+        own = threading.get_ident()
+        cpu_times = {}
+        while not self._stop.wait(self.interval):
+            names = {x.ident: x.name for x in threading.enumerate()}
+            self.rounds += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                name = names.get(ident, str(ident))
+                cpu = self._thread_cpu(ident)
+                on_cpu = cpu is not None and ident in cpu_times and cpu - cpu_times[ident] >= self.interval / 2
+                cpu_times[ident] = cpu
+                stack = f"{name};{self._stack(frame)}"
+                self.samples[stack] += 1
+                counts = self.threads.setdefault(name, [0, 0])
+                if on_cpu:
+                    self.cpu_samples[stack] += 1
+                    counts[0] += 1
+                else:
+                    counts[1] += 1
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._usage = resource.getrusage(resource.RUSAGE_SELF)
+        self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._sampler.start()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self._stop.set()
+        self._sampler.join()
+        wall = time.perf_counter() - self._started
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        user = usage.ru_utime - self._usage.ru_utime
+        system = usage.ru_stime - self._usage.ru_stime
+
+        self.profile.dump_stats(f"{self.prefix}.prof")
+        for filename, samples in ((f"{self.prefix}.collapsed", self.samples),
+                                  (f"{self.prefix}.cpu.collapsed", self.cpu_samples)):
+            with open(filename, 'w') as file:
+                file.write(''.join(f"{stack} {count}\n" for stack, count in samples.most_common()))
+
+        self.logger.colored("==== Profile ====", 'Cyan')
+        # Process CPU time is summed over threads and may exceed wall time, blocked time is
+        # taken from blocked samples of every thread, each sample stands for one sampling period
+        period = wall / self.rounds if self.rounds else 0
+        self.logger.colored("Wall time: {:.2f}s, CPU time of all threads: {:.2f}s ( user {:.2f}s, system {:.2f}s ), "
+                            "blocked time of all threads ( I/O, sleep, waits, sampled ): {:.2f}s".format(
+                                wall, user + system, user, system,
+                                sum(x[1] for x in self.threads.values()) * period), 'Light_Purple')
+        for name, (on_cpu, blocked) in sorted(self.threads.items()):
+            total = (on_cpu + blocked) or 1
+            self.logger.colored(
+                "Thread {:<30} samples: {:>7}, on CPU: {:>5.1f}%, blocked: {:>5.1f}% ( {:.2f}s )".format(
+                    name, on_cpu + blocked, on_cpu * 100 / total, blocked * 100 / total, blocked * period),
+                'Light_Purple')
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(15)
+        self.logger.logger.info("Main thread functions by cumulative time: \n%s", stream.getvalue())
+        self.logger.colored("Saved profile: {0}.prof ( snakeviz, pstats ), {0}.collapsed ( all samples ), "
+                            "{0}.cpu.collapsed ( on-CPU samples )".format(self.prefix), 'Green')
@@ -1,10 +1,16 @@
 from google.oauth2.service_account import Credentials
-from googleapiclient import discovery, errors
+from googleapiclient import discovery, errors, http as api_http
+import google_auth_httplib2
+import httplib2
 import json
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
 import sys
 import re
+import threading
 import time
+from _logger import lazy_json, lazy_lines
+from boot_timeline import GUEST_ATTRIBUTES_NAMESPACE, SERIAL_MARKER, parse_timestamp
+from tracing import tracer, traced, API, OPERATION, STABILIZATION
 
 
 #  ===================   GCP Provider =====================
@@ -17,6 +23,161 @@ class GceOperationStatus:
     DONE = "DONE"
 
 
+class RateLimiter:
+    """
+    Token bucket limiting GCP API calls per second of all threads, rate 0 - unlimited
+    """
+    def __init__(self, rate: float = 0, burst: int = 10):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SessionHttp(httplib2.Http):
+    """
+    HTTP transport of GCP API client which passes every request through session rate limiter
+    """
+    def __init__(self, rate_limiter: RateLimiter, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limiter = rate_limiter
+        # HTTP requests sent by transport ( retries included )
+        self.attempts = 0
+
+    def request(self, *args, **kwargs):
+        self.rate_limiter.acquire()
+        self.attempts += 1
+        return super().request(*args, **kwargs)
+
+
+class TracedHttpRequest(api_http.HttpRequest):
+    """
+    GCP API request recording span of every execute with API method, resource and retries
+    """
+    def execute(self, http=None, num_retries=0):
+        transport = http or self.http
+        # AuthorizedHttp keeps session transport in http attribute
+        session_http = getattr(transport, 'http', transport)
+        attempts = getattr(session_http, 'attempts', 0)
+        resource = self.uri.split('?')[0].split('/projects/')[-1]
+        with tracer.span(self.methodId or self.method, API, method=self.method, resource=resource) as span:
+            try:
+                return super().execute(http=http, num_retries=num_retries)
+            finally:
+                span.args['retries'] = max(getattr(session_http, 'attempts', 0) - attempts - 1, 0)
+
+
+class GcpSession:
+    """
+    Authentication, API clients, inventory cache and rate limiter shared
+    by GCP objects of one process ( API client per thread, it is not thread safe )
+    """
+    def __init__(
+            self,
+            gcp_token,
+            logger,
+            api_version: str = 'v1',
+            gcp_resource: str = "compute",
+            rate_limit: float = 0,
+            inventory_ttl: int = 0,
+            credentials=None,
+            api_endpoint: Optional[str] = None,
+    ):
+        self.gcp_token = gcp_token      # json file name with GCP SA key
+        # Endpoint of API instead of public one ( local fake Compute API of benchmarks )
+        self.api_endpoint = api_endpoint
+        self.logger = logger
+        self.api_version = api_version  # GCP api version
+        self.gcp_resource = gcp_resource
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.inventory_ttl = inventory_ttl  # seconds list responses are shared, 0 - not cached
+        self._credentials = credentials
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._inventory = {}
+
+    def credentials(self):
+        with self._lock:
+            if self._credentials is None:
+                try:
+                    self._credentials = Credentials.from_service_account_file(self.gcp_token)
+                except Exception as exc:
+                    self.logger.colored("Failed auth in GCP with key file {}: \n{}".format(
+                        self.gcp_token, exc), 'Red', 'error')
+                    sys.exit(3)
+            return self._credentials
+
+    def client(self) -> Any:
+        """
+        GCP API client of current thread
+        """
+        if getattr(self._local, 'client', None) is None:
+            http = google_auth_httplib2.AuthorizedHttp(
+                self.credentials(), http=SessionHttp(self.rate_limiter))
+            try:
+                self._local.client = discovery.build(
+                    serviceName=self.gcp_resource, version=self.api_version,
+                    http=http, cache_discovery=False, requestBuilder=TracedHttpRequest,
+                    client_options={'api_endpoint': self.api_endpoint} if self.api_endpoint else None
+                )
+            except Exception as exc:
+                self.logger.colored("Failed connect to GCP api_version: {} \n{}".format(
+                    self.api_version, exc), 'Red')
+                sys.exit(3)
+        return self._local.client
+
+    def inventory(self, key: tuple, fetch: Callable, refresh: bool = False) -> list:
+        """
+        List response shared between GCP objects of the same project and region
+        """
+        if not self.inventory_ttl:
+            return fetch()
+        with self._lock:
+            cached = self._inventory.get(key)
+        if cached and not refresh and time.monotonic() - cached[0] < self.inventory_ttl:
+            return cached[1]
+        items = fetch()
+        with self._lock:
+            self._inventory[key] = (time.monotonic(), items)
+        return items
+
+    def invalidate(self, project: str):
+        """
+        Drop cached lists of project after its resources were changed
+        """
+        with self._lock:
+            self._inventory = {k: v for k, v in self._inventory.items() if k[1] != project}
+
+
+# Errors of instance group when zone or placement has no capacity for new instances
+CAPACITY_ERROR_CODES = {
+    "ZONE_RESOURCE_POOL_EXHAUSTED",
+    "ZONE_RESOURCE_POOL_EXHAUSTED_WITH_DETAILS",
+    "RESOURCE_POOL_EXHAUSTED",
+}
+
+
+class InstanceGroupCapacityError(Exception):
+    """
+    Instance group can not create instances because of capacity stockout
+    """
+
+
 class GCP:
     def __init__(
             self,
@@ -29,7 +190,7 @@ class GCP:
             num_retries: int = 2,
             operation_pull_interval: int = 5,
             stabilisation_interval: int = 900,
-            
+            session: Optional[GcpSession] = None,
     ):
         self.operation_pull_interval = operation_pull_interval  # seconds
         self.instance_group_stabilisation_interval = stabilisation_interval  # second
@@ -39,6 +200,9 @@ class GCP:
         self.api_version = api_version  # GCP api version
         self.num_retries = num_retries  # Retries count of api request
         self.gcp_token = gcp_token      # json file name with GCP SA key
+        # Shared authentication and API clients
+        self.session = session or GcpSession(
+            gcp_token, logger, api_version=api_version, gcp_resource=gcp_resource)
 
         self.gcp_project = metadata.gcp_project
         self.gcp_region = metadata.gcp_region
@@ -48,35 +212,40 @@ class GCP:
         self.gcp_resources = {
             "images": [],
             "instanceTemplates": [],
+            "regionHealthChecks": [],
             "regionInstanceGroupManagers": [],
             "autoscalers": [],
             "regionBackendServices": [],
             "forwardingRules": [],
-            "addresses": []
+            "addresses": [],
+            "resourcePolicies": []
         }
         self.gcp_resources_version = {}
+        # Reserved internal addresses of service pool ( label address-pool: <service> )
+        self.address_pool = []
 
     def gcp_discovery(self) -> Any:  # pylint: disable=missing-docstring
         """
         Create connection to GCP
         :return: GCP connector object
         """
-        try:
-            auth = Credentials.from_service_account_file(self.gcp_token)
-        except Exception as exc:
-            self.logger.colored("Failed auth in GCP project {} with key file {}: \n{}".format(
-                self.gcp_project, self.gcp_token, exc), 'Red', 'error')
-            sys.exit(3)
-        try:
-            gcp_connect = discovery.build(
-                serviceName=self.gcp_resource, version=self.api_version,
-                credentials=auth, cache_discovery=False
-            )
-        except Exception as exc:
-            self.logger.colored("Failed connect to GCP project {} api_version: {} \n{}".format(
-                self.gcp_project, self.api_version, exc), 'Red')
-            sys.exit(3)
-        return gcp_connect
+        return self.session.client()
+
+    def _list(self, resource: str, refresh: bool = False, **params) -> list:
+        """
+        All items of GCP resource list ( all pages ), regional list when region passed
+        """
+        def fetch():
+            items = []
+            collection = getattr(self.gcp_discovery(), resource)()
+            request = collection.list(project=self.gcp_project, **params)
+            while request is not None:
+                response = request.execute(num_retries=self.num_retries)
+                items.extend(response.get('items', []))
+                request = collection.list_next(previous_request=request, previous_response=response)
+            return items
+        key = (resource, self.gcp_project, tuple(sorted(params.items())))
+        return self.session.inventory(key, fetch, refresh=refresh)
 
     def getResourcesVersions(self):
         for resource in self.gcp_resources:
@@ -90,8 +259,11 @@ class GCP:
                                 f"{self.service_name}-(.*)-(boot-img|data-img)",
                                 item["name"],
                             )[0][0]
+                        elif resource == "resourcePolicies":
+                            version = re.findall(f"{self.service_name}-(.*)-placement", item["name"])[0]
                         elif (
                             resource == "regionBackendServices"
+                            or resource == "regionHealthChecks"
                             or resource == "forwardingRules"
                             or resource == "addresses"
                         ):
@@ -124,24 +296,40 @@ class GCP:
 
         print(json.dumps(self.gcp_resources_version, indent=4))
 
-    def listAddresses(self):
+    def standby_versions(self) -> set:
+        """
+        Versions of service kept as warm standby: instance group without autoscaler
+        with suspended or stopped instances
+        """
+        autoscalers = {x['name'] for x in self.gcp_resources['autoscalers']}
+        return {x['name'][len(self.service_name) + 1:] for x in self.gcp_resources['regionInstanceGroupManagers']
+                if x.get('standbySize') and x['name'] not in autoscalers}
+
+    def listAddresses(self, refresh: bool = False):
         self.logger.colored("Сhecking usable addresses of service: {} in subnet: {} region: {}".format(
                        self.service_name, self.metadata.subnetwork, self.gcp_region), 'Cyan')
 
-        addresses = self.gcp_discovery().addresses().list(
-            project=self.gcp_project, region=self.gcp_region
-        ).execute(num_retries=self.num_retries)
+        addresses = self._list('addresses', refresh=refresh, region=self.gcp_region)
 
-        if addresses.get('items'):
+        if addresses:
 
             self.gcp_resources['addresses'] = []
-            for x in addresses.get('items'):
-                if self.service_name in x['name'] and x['status'] == 'IN_USE':
+            self.address_pool = []
+            for x in addresses:
+                if x.get('labels', {}).get('address-pool') == self.service_name:
+                    self.address_pool.append(
+                        {"name": x['name'], "status": x['status'], 'address': x['address'],
+                         'users': x.get('users', [])})
+                elif self.service_name in x['name'] and x['status'] == 'IN_USE':
                     self.gcp_resources['addresses'].append(
                         {"name": x['name'], "status": x['status'], 'address': x['address']})
 
             self.logger.logger.info(
-                "Found in use addresses: \n- %s", '\n- '.join(map(str, self.gcp_resources['addresses'])))
+                "Found in use addresses: \n- %s", lazy_lines(self.gcp_resources['addresses']))
+            if self.address_pool:
+                self.logger.logger.info(
+                    "Found address pool: \n- %s", lazy_lines(
+                        [{k: x[k] for k in ('name', 'status', 'address')} for x in self.address_pool]))
 
             # reserved_ip = [x for x in addresses.get('items') if x['status'] != 'IN_USE']
             # self.logger.logger.info('Reserved addresses count: %s', len(reserved_ip))
@@ -156,12 +344,10 @@ class GCP:
         self.logger.colored("Getting forwarding-rules of service: {} from GCP project: {} region: {}".format(
             self.service_name, self.gcp_project, self.gcp_region), 'Cyan')
 
-        forwarding_rules = self.gcp_discovery().forwardingRules().list(
-            project=self.gcp_project, region=self.gcp_region).execute()
-        if forwarding_rules.get('items'):
-            # self.logger.logger.debug("Items: \n%s", json.dumps(forwarding_rules.get('items'), indent=4))
+        forwarding_rules = self._list('forwardingRules', region=self.gcp_region)
+        if forwarding_rules:
             self.gcp_resources['forwardingRules'] = []
-            for x in forwarding_rules.get('items'):
+            for x in forwarding_rules:
                 if self.service_name in x['name']:
                     self.gcp_resources['forwardingRules'].append(
                         {"name": x.get('name'), "ip": x.get('IPAddress'), "ports": x.get('ports')})
@@ -169,72 +355,100 @@ class GCP:
             self.gcp_resources['forwardingRules'] = []
 
         self.logger.logger.info(
-            "Found forwarding rules: \n- %s", '\n- '.join(map(str, self.gcp_resources['forwardingRules'])))
+            "Found forwarding rules: \n- %s", lazy_lines(self.gcp_resources['forwardingRules']))
 
     def listBackendServices(self):
         self.logger.colored("Getting backend-services for service: {} from GCP project: {} region: {}".format(
                             self.service_name, self.gcp_project, self.gcp_region), 'Cyan')
-        backends = self.gcp_discovery().regionBackendServices().list(
-            project=self.gcp_project, region=self.gcp_region).execute()
-        if backends.get('items'):
+        backends = self._list('regionBackendServices', region=self.gcp_region)
+        if backends:
             self.gcp_resources['regionBackendServices'] = []
-            for x in backends['items']:
+            for x in backends:
                 if self.service_name in x['name']:
                     self.gcp_resources['regionBackendServices'].append({'name': x['name']})
         else:
             self.gcp_resources['regionBackendServices'] = []
 
         self.logger.logger.info(
-            "Found GCP Backend Services: \n- %s", '\n- '.join(map(str, self.gcp_resources['regionBackendServices'])))
+            "Found GCP Backend Services: \n- %s", lazy_lines(self.gcp_resources['regionBackendServices']))
 
     def listRegionInstanceGroupManagers(self):
         self.logger.colored("Getting instance groups managed for service: {} from GCP project: {} region: {}".format(
             self.service_name, self.gcp_project, self.gcp_region), 'Cyan')
-        instance_groups = self.gcp_discovery().regionInstanceGroupManagers().list(
-            project=self.gcp_project, region=self.gcp_region).execute()
-        if instance_groups.get('items'):
+        instance_groups = self._list('regionInstanceGroupManagers', region=self.gcp_region)
+        if instance_groups:
             items = []
-            for x in instance_groups['items']:
+            for x in instance_groups:
                 if self.service_name in x['name']:
-                    items.append({"name": x['name'], "deployed": x['creationTimestamp']})
+                    items.append({"name": x['name'], "deployed": x['creationTimestamp'],
+                                  "standbySize": x.get('targetSuspendedSize', 0) + x.get('targetStoppedSize', 0)})
             self.gcp_resources['regionInstanceGroupManagers'] = sorted(items,
                                                                        key=lambda d: d['deployed'], reverse=True)
         else:
             self.gcp_resources['regionInstanceGroupManagers'] = []
 
         self.logger.logger.info(
-            "Found GCP Instance Groups: \n- %s", '\n- '.join(
-                map(str, self.gcp_resources['regionInstanceGroupManagers'])))
+            "Found GCP Instance Groups: \n- %s", lazy_lines(self.gcp_resources['regionInstanceGroupManagers']))
 
     def listrRegionAutoscalers(self):
         self.logger.colored("Getting autoscalers for service: {} from GCP project: {} region: {}".format(
             self.service_name, self.gcp_project, self.gcp_region), 'Cyan')
-        autoscalers = self.gcp_discovery().regionAutoscalers().list(
-            project=self.gcp_project, region=self.gcp_region).execute()
-        if autoscalers.get('items'):
+        autoscalers = self._list('regionAutoscalers', region=self.gcp_region)
+        if autoscalers:
             items = []
-            for x in autoscalers['items']:
+            for x in autoscalers:
                 if self.service_name in x['name']:
-                    items.append({"name": x['name'], "deployed": x['creationTimestamp']})
+                    items.append({"name": x['name'], "deployed": x['creationTimestamp'],
+                                  "policy": self._autoscaler_policy(x)})
             self.gcp_resources['autoscalers'] = sorted(items, key=lambda d: d['deployed'], reverse=True)
         self.logger.logger.info(
-            "Found following autoscaler's: \n- %s", '\n- '.join(map(str, self.gcp_resources['autoscalers'])))
+            "Found following autoscaler's: \n- %s", lazy_lines([x['name'] for x in self.gcp_resources['autoscalers']]))
+        for autoscaler in self.gcp_resources['autoscalers']:
+            self.logger.colored("Active policy of autoscaler %s: \n%s", 'Light_Purple', None,
+                                autoscaler['name'], lazy_json(autoscaler['policy']))
+
+    @staticmethod
+    def _autoscaler_policy(autoscaler: dict) -> dict:
+        """
+        Short view of autoscaler policy: replicas, predictive mode,
+        scale-in controls and scaling schedules with their state
+        """
+        policy = autoscaler.get('autoscalingPolicy', {})
+        schedules_status = autoscaler.get('scalingScheduleStatus', {})
+        return {
+            "mode": policy.get('mode'),
+            "minNumReplicas": policy.get('minNumReplicas'),
+            "maxNumReplicas": policy.get('maxNumReplicas'),
+            "recommendedSize": autoscaler.get('recommendedSize'),
+            "cpuUtilizationTarget": policy.get('cpuUtilization', {}).get('utilizationTarget'),
+            "predictiveMethod": policy.get('cpuUtilization', {}).get('predictiveMethod', 'NONE'),
+            "scaleInControl": policy.get('scaleInControl'),
+            "scalingSchedules": {
+                name: {
+                    "schedule": schedule.get('schedule'),
+                    "minRequiredReplicas": schedule.get('minRequiredReplicas'),
+                    "durationSec": schedule.get('durationSec'),
+                    "state": schedules_status.get(name, {}).get('state'),
+                }
+                for name, schedule in policy.get('scalingSchedules', {}).items()
+            },
+        }
 
     def listImages(self):
         self.logger.colored("Getting disk images for {} from GCP project {}".format(
             self.service_name, self.gcp_project), 'Cyan')
         try:
-            images = self.gcp_discovery().images().list(project=self.gcp_project).execute()
-            if not images.get('items'):
+            images = self._list('images')
+            if not images:
                 raise Exception("Disk images for %s in GCP project %s not found", self.service_name, self.gcp_project)
 
             self.gcp_resources['images'] = []
-            if images.get('items'):
-                for x in images.get('items'):
+            if images:
+                for x in images:
                     if self.service_name in x['name']:
                         self.gcp_resources['images'].append(
                             {"name": x['name'], "size": x['diskSizeGb'], "timeStamp": x['creationTimestamp']})
-            self.logger.logger.info("Found disk images: \n- %s", '\n- '.join(map(str, self.gcp_resources['images'])))
+            self.logger.logger.info("Found disk images: \n- %s", lazy_lines(self.gcp_resources['images']))
         except errors.HttpError as gcp_api_err:
             self.logger.colored(gcp_api_err, "Red", 'error')
             exit(3)
@@ -242,15 +456,15 @@ class GCP:
     def listInstanceTemplates(self):
         self.logger.colored("Getting Instance Template for service: {} from GCP project: {} region: {}".format(
             self.service_name, self.gcp_project, self.gcp_region), 'Cyan')
-        instanceTemplates = self.gcp_discovery().instanceTemplates().list(project=self.gcp_project).execute()
-        if instanceTemplates.get('items'):
+        instanceTemplates = self._list('instanceTemplates')
+        if instanceTemplates:
             self.gcp_resources['instanceTemplates'] = []
-            for x in instanceTemplates['items']:
+            for x in instanceTemplates:
                 if self.service_name in x['name']:
                     self.gcp_resources['instanceTemplates'].append({'name': x['name']})
 
         self.logger.logger.info(
-            "Found Instance Templates: \n- %s", '\n- '.join(map(str, self.gcp_resources['instanceTemplates'])))
+            "Found Instance Templates: \n- %s", lazy_lines(self.gcp_resources['instanceTemplates']))
 
     def getAddresses(self, name: str):
         self.logger.logger.debug("Getting ip address of %s", name)
@@ -263,19 +477,54 @@ class GCP:
         self.logger.colored("Getting healthchecks for service: {} from GCP project: {} region: {}".format(
             self.service_name, self.gcp_project, self.gcp_region), 'Cyan')
 
-        healthchecks = self.gcp_discovery().healthChecks().list(project=self.gcp_project).execute()
-        if healthchecks.get('items'):
-            hl = [x['name'] for x in healthchecks['items'] if self.service_name in x['name']]
+        healthchecks = self._list('healthChecks')
+        if healthchecks:
+            hl = [x['name'] for x in healthchecks if self.service_name in x['name']]
         else:
             hl = []
-        self.logger.logger.info("Found Healthchecks: \n- %s", '\n- '.join(map(str, hl)))
+        self.logger.logger.info("Found Healthchecks: \n- %s", lazy_lines(hl))
+
+    def listRegionHealthChecks(self):
+        self.logger.colored("Getting regional healthchecks for service: {} from GCP project: {} region: {}".format(
+            self.service_name, self.gcp_project, self.gcp_region), 'Cyan')
+        healthchecks = self._list('regionHealthChecks', region=self.gcp_region)
+        self.gcp_resources['regionHealthChecks'] = []
+        if healthchecks:
+            for x in healthchecks:
+                if self.service_name in x['name']:
+                    self.gcp_resources['regionHealthChecks'].append(
+                        {'name': x['name'], 'checkIntervalSec': x.get('checkIntervalSec'),
+                         'timeoutSec': x.get('timeoutSec'), 'healthyThreshold': x.get('healthyThreshold'),
+                         'unhealthyThreshold': x.get('unhealthyThreshold')})
+
+        self.logger.logger.info(
+            "Found regional Healthchecks: \n- %s", lazy_lines(self.gcp_resources['regionHealthChecks']))
+
+    def listResourcePolicies(self):
+        self.logger.colored("Getting resource policies for service: {} from GCP project: {} region: {}".format(
+            self.service_name, self.gcp_project, self.gcp_region), 'Cyan')
+        policies = self._list('resourcePolicies', region=self.gcp_region)
+        self.gcp_resources['resourcePolicies'] = []
+        if policies:
+            for x in policies:
+                if self.service_name in x['name']:
+                    self.gcp_resources['resourcePolicies'].append({'name': x['name'], 'status': x.get('status')})
+
+        self.logger.logger.info(
+            "Found resource policies: \n- %s", lazy_lines(self.gcp_resources['resourcePolicies']))
 
     def overview(self):
+        with tracer.run('overview', self.logger, service=self.service_name, region=self.gcp_region):
+            self._overview()
+
+    def _overview(self):
         self.logger.colored(f"==== Starting overviewing resources in GCP {self.gcp_project} project ====",
                             'Cyan', 'info')
         self.listImages()
         self.listInstanceTemplates()
+        self.listResourcePolicies()
         self.listHealthCheck()
+        self.listRegionHealthChecks()
         self.listrRegionAutoscalers()
         self.listRegionInstanceGroupManagers()
         self.listBackendServices()
@@ -325,7 +574,34 @@ class GCP:
                 operation_name = response["name"]
             except errors.HttpError as gcp_api_err:
                 if gcp_api_err.error_details:
-                    self.logger.colored(json.dumps(gcp_api_err.error_details[0], indent=4), "Red", 'error')
+                    self.logger.colored("%s", "Red", 'error', lazy_json(gcp_api_err.error_details[0]))
+                else:
+                    self.logger.colored(gcp_api_err, "Red", 'error')
+                exit(3)
+            except KeyError:
+                raise Exception(
+                    "Wrong response '{}' returned - it should contain "
+                    "'name' field".format(response))
+            operations.append({'operation_msg': msg, 'operation_name': operation_name})
+            self.logger.logger.debug("Operation response: %s", response)
+        for operation in operations:
+            self._wait_for_operation_to_complete(
+                project_id=self.gcp_project, region=self.gcp_region, operation_name=operation['operation_name'],
+                event=operation['operation_msg'])
+
+    def delete_region_health_checks(self, data: list):
+        self.logger.logger.debug("Deleting following regional health checks: %s", data)
+        operations = []
+        for health_check_name in data:
+            msg = "Deleting regional health check: {} START".format(health_check_name)
+            self.logger.colored(msg, 'Cyan')
+            try:
+                response = self.gcp_discovery().regionHealthChecks().delete(
+                    project=self.gcp_project, region=self.gcp_region, healthCheck=health_check_name).execute()
+                operation_name = response["name"]
+            except errors.HttpError as gcp_api_err:
+                if gcp_api_err.error_details:
+                    self.logger.colored("%s", "Red", 'error', lazy_json(gcp_api_err.error_details[0]))
                 else:
                     self.logger.colored(gcp_api_err, "Red", 'error')
                 exit(3)
@@ -391,6 +667,27 @@ class GCP:
             project_id=self.gcp_project, operation_name=operation_name, event=msg)
         self.logger.logger.debug("Operation response: %s", response)
 
+    def delete_resource_policies(self, data: list):
+        self.logger.logger.debug("Deleting following resource policies: %s", data)
+        operations = []
+        for policy_name in data:
+            msg = "Deleting resource policy: {} START".format(policy_name)
+            self.logger.colored(msg, 'Cyan')
+            response = self.gcp_discovery().resourcePolicies().delete(
+                project=self.gcp_project, region=self.gcp_region, resourcePolicy=policy_name).execute()
+            try:
+                operation_name = response["name"]
+            except KeyError:
+                raise Exception(
+                    "Wrong response '{}' returned - it should contain "
+                    "'name' field".format(response))
+            operations.append({'operation_msg': msg, 'operation_name': operation_name})
+            self.logger.logger.debug("Operation response: %s", response)
+        for operation in operations:
+            self._wait_for_operation_to_complete(
+                project_id=self.gcp_project, region=self.gcp_region, operation_name=operation['operation_name'],
+                event=operation['operation_msg'])
+
     def delete_disk_images(self, data: list):
         self.logger.logger.debug("Deleting following disk images: %s", data)
         operations = []
@@ -502,14 +799,14 @@ class GCP:
     def insert_instance_template(self, body: dict):
         msg = "Creating instance template: {}".format(body['name'])
         self.logger.colored(msg, 'Cyan')
-        self.logger.logger.debug("Body: \n%s", json.dumps(body, indent=4))
+        self.logger.logger.debug("Body: \n%s", lazy_json(body))
         try:
             response = self.gcp_discovery().instanceTemplates().insert(
                 project=self.gcp_project, body=body).execute()
             operation_name = response["name"]
         except errors.HttpError as gcp_api_err:
             if gcp_api_err.error_details:
-                self.logger.colored(json.dumps(gcp_api_err.error_details[0], indent=4), "Red", 'error')
+                self.logger.colored("%s", "Red", 'error', lazy_json(gcp_api_err.error_details[0]))
             else:
                 self.logger.colored(gcp_api_err, "Red", 'error')
             exit(3)
@@ -539,9 +836,68 @@ class GCP:
     #     self.logger.logger.debug("Operation response: %s", response)
     #     return response.get('targetLink')
 
-    def insert_region_instance_group_managed(self, body: dict):
+    def insert_region_health_checks(self, body: list):
+        """
+        Creating regional health checks, health checks which already
+        exist in GCP project are updated with new parameters
+        """
+        existing = [x['name'] for x in self.gcp_resources['regionHealthChecks']]
+        operations = []
+        for health_check in body:
+            self.logger.logger.debug("Regional health check body: \n%s", lazy_json(health_check))
+            try:
+                if health_check['name'] in existing:
+                    msg = "Updating regional health check: {}".format(health_check['name'])
+                    self.logger.colored(msg, "Cyan")
+                    response = self.gcp_discovery().regionHealthChecks().update(
+                        project=self.gcp_project, region=self.gcp_region,
+                        healthCheck=health_check['name'], body=health_check).execute()
+                else:
+                    msg = "Creating regional health check: {}".format(health_check['name'])
+                    self.logger.colored(msg, "Cyan")
+                    response = self.gcp_discovery().regionHealthChecks().insert(
+                        project=self.gcp_project, region=self.gcp_region, body=health_check).execute()
+                operation_name = response["name"]
+            except errors.HttpError as gcp_api_err:
+                if gcp_api_err.error_details:
+                    self.logger.colored("%s", "Red", 'error', lazy_json(gcp_api_err.error_details[0]))
+                else:
+                    self.logger.colored(gcp_api_err, "Red", 'error')
+                exit(3)
+            except KeyError:
+                raise Exception(
+                    "Wrong response '{}' returned - it should contain "
+                    "'name' field".format(response))
+            self.logger.logger.debug("Operation response: %s", response)
+            operations.append({'operation_msg': msg, 'operation_name': operation_name})
+        for operation in operations:
+            self._wait_for_operation_to_complete(
+                project_id=self.gcp_project, region=self.gcp_region,
+                operation_name=operation['operation_name'], event=operation['operation_msg'])
+
+    def insert_resource_policy(self, body: dict):
+        msg = "Creating resource policy: {}".format(body['name'])
+        self.logger.colored(msg, 'Cyan')
+        self.logger.logger.debug("Body: \n%s", lazy_json(body))
+        existing = [x['name'] for x in self.gcp_resources['resourcePolicies']]
+        if body['name'] in existing:
+            self.logger.logger.info("Resource policy %s already exists: [ SKIP ]", body['name'])
+            return
+        response = self.gcp_discovery().resourcePolicies().insert(
+            project=self.gcp_project, region=self.gcp_region, body=body).execute()
+        try:
+            operation_name = response["name"]
+        except KeyError:
+            raise Exception(
+                "Wrong response '{}' returned - it should contain "
+                "'name' field".format(response))
+        self._wait_for_operation_to_complete(
+            project_id=self.gcp_project, region=self.gcp_region, operation_name=operation_name, event=msg)
+        self.logger.logger.debug("Operation response: %s", response)
+
+    def insert_region_instance_group_managed(self, body: dict, boot_timeline=None, raise_on_capacity: bool = False):
         msg = "Creating regional instance group manager: {}".format(body['name'])
-        self.logger.logger.debug("Body: \n%s", json.dumps(body, indent=4))
+        self.logger.logger.debug("Body: \n%s", lazy_json(body))
         self.logger.colored(msg, 'Cyan')
         response = self.gcp_discovery().regionInstanceGroupManagers().insert(
             project=self.gcp_project, region=self.gcp_region, body=body).execute()
@@ -559,7 +915,8 @@ class GCP:
         self.logger.logger.debug("Operation response: %s", response)
 
         self._wait_for_instance_group_to_stable(project_id=self.gcp_project, region=self.gcp_region,
-                                                instance_group_name=body['name'])
+                                                instance_group_name=body['name'], boot_timeline=boot_timeline,
+                                                raise_on_capacity=raise_on_capacity)
         deploy_interval = (time.time() - start_time)
         self.logger.colored(
             "Instance Group Managed: {} deploy interval: {}".format(
@@ -568,7 +925,7 @@ class GCP:
 
     def insert_region_autoscaler(self, body):
         msg = "Creating autoscaler of managed instance group: {}".format(body['name'])
-        self.logger.logger.debug("Body: \n%s", json.dumps(body, indent=4))
+        self.logger.logger.debug("Body: \n%s", lazy_json(body))
         response = self.gcp_discovery().regionAutoscalers().insert(
             project=self.gcp_project, region=self.gcp_region, body=body).execute()
         try:
@@ -588,7 +945,7 @@ class GCP:
         for region_backend in body:
             msg = "Creating regional backend: {}".format(region_backend['name'])
             self.logger.colored(msg, "Cyan")
-            self.logger.logger.debug("Regional backend body: \n%s", json.dumps(region_backend, indent=4))
+            self.logger.logger.debug("Regional backend body: \n%s", lazy_json(region_backend))
             response = self.gcp_discovery().regionBackendServices().insert(
                 project=self.gcp_project, region=self.gcp_region, body=region_backend).execute()
             try:
@@ -610,7 +967,7 @@ class GCP:
         for forwarding_rule in body:
             msg = "Creating forwarding rule: {}".format(forwarding_rule['name'])
             self.logger.colored(msg, "Cyan")
-            self.logger.logger.debug("Forwarding rule body: \n%s", json.dumps(forwarding_rule, indent=4))
+            self.logger.logger.debug("Forwarding rule body: \n%s", lazy_json(forwarding_rule))
             response = self.gcp_discovery().forwardingRules().insert(
                 project=self.gcp_project, region=self.gcp_region, body=forwarding_rule).execute()
             try:
@@ -626,6 +983,24 @@ class GCP:
                 project_id=self.gcp_project, region=self.gcp_region,
                 operation_name=operation['operation_name'], event=operation['operation_msg'])
 
+    def patch_region_instance_group_manager(self, group_name: str, body: dict):
+        msg = "Updating regional instance group manager: {}".format(group_name)
+        self.logger.colored(msg, 'Cyan')
+        self.logger.logger.debug("Body: \n%s", lazy_json(body))
+        response = self.gcp_discovery().regionInstanceGroupManagers().patch(
+            project=self.gcp_project, region=self.gcp_region,
+            instanceGroupManager=group_name, body=body).execute()
+        try:
+            operation_name = response["name"]
+        except KeyError:
+            raise Exception(
+                "Wrong response '{}' returned - it should contain "
+                "'name' field".format(response))
+        self.logger.logger.debug("Response: %s", response)
+        self._wait_for_operation_to_complete(
+            project_id=self.gcp_project, region=self.gcp_region,
+            event=msg, operation_name=operation_name)
+
     def resizeRegionInstanceGroupManagers(self, group_name: str, group_size: int):
         msg = "Scale down instance group: {}".format(group_name)
         self.logger.colored(msg, 'Cyan', 'info')
@@ -644,29 +1019,198 @@ class GCP:
             event=msg, operation_name=operation_name)
         self.logger.logger.debug("Operation response: %s", response)
 
+    def getRegionInstanceGroupManager(self, group_name: str) -> Optional[dict]:
+        try:
+            return self.gcp_discovery().regionInstanceGroupManagers().get(
+                project=self.gcp_project, region=self.gcp_region,
+                instanceGroupManager=group_name).execute(num_retries=self.num_retries)
+        except errors.HttpError as gcp_api_err:
+            if gcp_api_err.resp.status == 404:
+                return None
+            raise
+
+    def getRegionAutoscaler(self, autoscaler_name: str) -> Optional[dict]:
+        try:
+            return self.gcp_discovery().regionAutoscalers().get(
+                project=self.gcp_project, region=self.gcp_region,
+                autoscaler=autoscaler_name).execute(num_retries=self.num_retries)
+        except errors.HttpError as gcp_api_err:
+            if gcp_api_err.resp.status == 404:
+                return None
+            raise
+
+    def update_region_autoscaler(self, body: dict):
+        msg = "Updating autoscaler: {}".format(body['name'])
+        self.logger.colored(msg, 'Cyan')
+        self.logger.logger.debug("Body: \n%s", lazy_json(body))
+        response = self.gcp_discovery().regionAutoscalers().update(
+            project=self.gcp_project, region=self.gcp_region, autoscaler=body['name'], body=body).execute()
+        try:
+            operation_name = response["name"]
+        except KeyError:
+            raise Exception(
+                "Wrong response '{}' returned - it should contain "
+                "'name' field".format(response))
+        self.logger.logger.debug("Response: %s", response)
+        self._wait_for_operation_to_complete(
+            project_id=self.gcp_project, region=self.gcp_region,
+            event=msg, operation_name=operation_name)
+
+    def remove_expired_warmup_schedules(self):
+        """
+        Removing warm-up scaling schedules of pre-scale which window has ended, cron schedule
+        of warm-up would start again in the same minute of next year
+        """
+        now = time.time()
+        for autoscaler in self.gcp_resources.get('autoscalers') or []:
+            created = parse_timestamp(autoscaler['deployed']) or now
+            expired = [
+                name for name, schedule in autoscaler['policy']['scalingSchedules'].items()
+                if name.startswith('warmup-') and schedule.get('state') != 'ACTIVE'
+                and created + (schedule.get('durationSec') or 0) < now
+            ]
+            if not expired:
+                continue
+            body = self.getRegionAutoscaler(autoscaler['name'])
+            if body is None:
+                continue
+            for name in expired:
+                body['autoscalingPolicy'].get('scalingSchedules', {}).pop(name, None)
+            self.logger.colored("Removing ended warm-up schedules of autoscaler {}: {}".format(
+                autoscaler['name'], ', '.join(expired)), 'Cyan')
+            self.update_region_autoscaler(body)
+
+    def getLiveCapacity(self, group_name: str, autoscaler_name: str) -> int:
+        """
+        Live size of instance group: the biggest of its target size and autoscaler recommended size
+        """
+        instance_group = self.getRegionInstanceGroupManager(group_name)
+        if instance_group is None:
+            return 0
+        autoscaler = self.getRegionAutoscaler(autoscaler_name) or {}
+        capacity = max(instance_group.get('targetSize', 0), autoscaler.get('recommendedSize', 0))
+        self.logger.colored("Instance group: {} target size: {} autoscaler recommended size: {}".format(
+            group_name, instance_group.get('targetSize'), autoscaler.get('recommendedSize')), 'Cyan')
+        return capacity
+
+    def suspendRegionInstanceGroupInstances(self, group_name: str, instances: list, mode: str = 'suspend'):
+        """
+        Moving running instances of instance group to standby pool:
+        suspend - suspended instances ( memory preserved ), stop - stopped instances
+        """
+        msg = "Moving {} instances of instance group {} to standby pool ( {} )".format(
+            len(instances), group_name, mode)
+        self.logger.colored(msg, 'Cyan', 'info')
+        managers = self.gcp_discovery().regionInstanceGroupManagers()
+        if mode == 'stop':
+            request = managers.stopInstances(
+                project=self.gcp_project, region=self.gcp_region, instanceGroupManager=group_name,
+                body={"instances": instances, "forceStop": False})
+        else:
+            request = managers.suspendInstances(
+                project=self.gcp_project, region=self.gcp_region, instanceGroupManager=group_name,
+                body={"instances": instances, "forceSuspend": False})
+        response = request.execute()
+        try:
+            operation_name = response["name"]
+        except KeyError:
+            raise Exception(
+                "Wrong response '{}' returned - it should contain "
+                "'name' field".format(response))
+        self.logger.logger.debug("Response: %s", response)
+        self._wait_for_operation_to_complete(
+            project_id=self.gcp_project, region=self.gcp_region,
+            event=msg, operation_name=operation_name)
+
+    def resumeRegionInstanceGroupInstances(self, group_name: str, instances: list, mode: str = 'suspend'):
+        """
+        Returning instances from standby pool to instance group and waiting all of them RUNNING
+        """
+        msg = "Resuming {} standby instances of instance group {}".format(len(instances), group_name)
+        self.logger.colored(msg, 'Cyan', 'info')
+        managers = self.gcp_discovery().regionInstanceGroupManagers()
+        if mode == 'stop':
+            request = managers.startInstances(
+                project=self.gcp_project, region=self.gcp_region, instanceGroupManager=group_name,
+                body={"instances": instances})
+        else:
+            request = managers.resumeInstances(
+                project=self.gcp_project, region=self.gcp_region, instanceGroupManager=group_name,
+                body={"instances": instances})
+        response = request.execute()
+        try:
+            operation_name = response["name"]
+        except KeyError:
+            raise Exception(
+                "Wrong response '{}' returned - it should contain "
+                "'name' field".format(response))
+        self.logger.logger.debug("Response: %s", response)
+        start_time = time.time()
+        self._wait_for_operation_to_complete(
+            project_id=self.gcp_project, region=self.gcp_region,
+            event=msg, operation_name=operation_name)
+        count = 0
+        maximum_counts = int(self.instance_group_stabilisation_interval/self.operation_pull_interval)
+        while True:
+            running = [x for x in self.listManagedInstances(group_name)
+                       if x['instance'] in instances and x.get('instanceStatus') == 'RUNNING']
+            self.logger.colored("Instance group: %s resumed instances running: %s/%s ( %ss )", 'Yellow', None,
+                                group_name, len(running), len(instances), round(time.time() - start_time))
+            if len(running) >= len(instances):
+                break
+            count += 1
+            if count > maximum_counts:
+                self.logger.colored(
+                    "Standby instances of {} are not running in time interval {} seconds".format(
+                        group_name, self.instance_group_stabilisation_interval), "Red")
+                exit(3)
+            time.sleep(self.operation_pull_interval)
+        self._wait_for_instance_group_to_stable(
+            project_id=self.gcp_project, region=self.gcp_region, instance_group_name=group_name)
+
+    def wait_for_instance_group_to_stable(self, group_name: str, boot_timeline=None, raise_on_capacity: bool = False):
+        self._wait_for_instance_group_to_stable(
+            project_id=self.gcp_project, region=self.gcp_region, instance_group_name=group_name,
+            boot_timeline=boot_timeline, raise_on_capacity=raise_on_capacity)
+
+    @traced(STABILIZATION, 'instance_group_name')
     def _wait_for_instance_group_to_stable(
             self, project_id: str,
-            region: str, instance_group_name: str
+            region: str, instance_group_name: str,
+            boot_timeline=None, raise_on_capacity: bool = False
     ) -> None:
         msg = "Wait instance group {} is stabilization START".format(instance_group_name)
         self.logger.colored(msg, 'Cyan')
+        start_time = time.time()
         count = 0
         maximum_counts = int(self.instance_group_stabilisation_interval/self.operation_pull_interval)
         while True:
+            if boot_timeline is not None:
+                self._record_boot_progress(instance_group_name, boot_timeline)
             instance_group_response = self._instance_group_status(
                 service=self.gcp_discovery(),
                 instance_group=instance_group_name, region=region,
                 project_id=project_id, num_retries=self.num_retries
             )
+            tracer.event('poll', instance_group_name, STABILIZATION, instance_group_name=instance_group_name,
+                         isStable=instance_group_response.get("status").get('isStable'), poll=count + 1,
+                         elapsed=round(time.time() - start_time, 1),
+                         currentActions=instance_group_response.get('currentActions'))
             if instance_group_response.get("status").get('isStable') is True:
-                self.logger.colored("Instance group: {} return status isStable: {}".format(
-                    instance_group_name, instance_group_response.get("status").get('isStable')), 'Green')
+                self.logger.colored("Instance group: %s return status isStable: %s", 'Green', None,
+                                    instance_group_name, instance_group_response.get("status").get('isStable'))
                 # self.logger.logger.info('Instance group: %s return status isStable: %s', instance_group_name, instance_group_response.get("status").get('isStable'))
                 break
             else:
-                self.logger.colored("Instance group: {} return status isStable: {}".format(
-                    instance_group_name, instance_group_response.get("status").get('isStable')), 'Yellow')
+                self.logger.colored("Instance group: %s return status isStable: %s", 'Yellow', None,
+                                    instance_group_name, instance_group_response.get("status").get('isStable'))
                 self.logger.logger.debug("Instance group response body: %s", instance_group_response)
+                if raise_on_capacity:
+                    capacity_errors = self._instance_group_capacity_errors(instance_group_name, start_time)
+                    if capacity_errors:
+                        raise InstanceGroupCapacityError(
+                            "Instance group {} has no capacity: \n- {}".format(
+                                instance_group_name, '\n- '.join(capacity_errors)))
             count += 1
             if count > maximum_counts:
                 # self.logger.logger.error('Instance group did not return status isStable: True in time interval %s seconds',
@@ -677,6 +1221,205 @@ class GCP:
                 exit(3)
             time.sleep(self.operation_pull_interval)
 
+    def listManagedInstances(self, instance_group_name: str) -> list:
+        response = self.gcp_discovery().regionInstanceGroupManagers().listManagedInstances(
+            project=self.gcp_project, region=self.gcp_region,
+            instanceGroupManager=instance_group_name).execute(num_retries=self.num_retries)
+        return response.get('managedInstances', [])
+
+    @staticmethod
+    def parse_resource_url(url: str) -> Dict[str, str]:
+        """
+        Collections and names of GCP resource url, example:
+        projects/p/zones/z/disks/d -> {'projects': 'p', 'zones': 'z', 'disks': 'd'}
+        """
+        parts = url.split('/')
+        parts = parts[parts.index('projects'):] if 'projects' in parts else parts
+        result = {}
+        index = 0
+        while index < len(parts):
+            if parts[index] == 'global':
+                result['global'] = 'global'
+                index += 1
+                continue
+            result[parts[index]] = parts[index + 1] if index + 1 < len(parts) else ''
+            index += 2
+        return result
+
+    def _get_or_none(self, request) -> Optional[dict]:
+        try:
+            return request.execute(num_retries=self.num_retries)
+        except errors.HttpError as gcp_api_err:
+            if gcp_api_err.resp.status == 404:
+                return None
+            raise
+
+    def getHealthCheck(self, url: str) -> Optional[dict]:
+        """
+        Global or regional health check by its url
+        """
+        resource = self.parse_resource_url(url)
+        project = resource.get('projects', self.gcp_project)
+        if resource.get('regions'):
+            return self._get_or_none(self.gcp_discovery().regionHealthChecks().get(
+                project=project, region=resource['regions'], healthCheck=resource['healthChecks']))
+        return self._get_or_none(self.gcp_discovery().healthChecks().get(
+            project=project, healthCheck=resource['healthChecks']))
+
+    def getDisk(self, url: str) -> Optional[dict]:
+        resource = self.parse_resource_url(url)
+        return self._get_or_none(self.gcp_discovery().disks().get(
+            project=resource.get('projects', self.gcp_project), zone=resource['zones'], disk=resource['disks']))
+
+    def getSubnetwork(self, url: str) -> Optional[dict]:
+        resource = self.parse_resource_url(url)
+        return self._get_or_none(self.gcp_discovery().subnetworks().get(
+            project=resource.get('projects', self.gcp_project),
+            region=resource.get('regions', self.gcp_region), subnetwork=resource['subnetworks']))
+
+    def getMachineType(self, zone: str, machine_type: str) -> Optional[dict]:
+        return self._get_or_none(self.gcp_discovery().machineTypes().get(
+            project=self.gcp_project, zone=zone.split('/')[-1], machineType=machine_type.split('/')[-1]))
+
+    def getRegionQuotas(self) -> Dict[str, dict]:
+        """
+        Regional quotas of project: metric -> {limit, usage}
+        """
+        region = self.gcp_discovery().regions().get(
+            project=self.gcp_project, region=self.gcp_region).execute(num_retries=self.num_retries)
+        return {x['metric']: {'limit': x['limit'], 'usage': x['usage']} for x in region.get('quotas', [])}
+
+    def countSubnetworkAddresses(self, subnetwork: str) -> int:
+        """
+        Count of reserved internal addresses in subnetwork
+        """
+        name = subnetwork.split('/')[-1]
+        return len([x for x in self._list('addresses', region=self.gcp_region)
+                    if x.get('subnetwork', '').split('/')[-1] == name])
+
+    def countSubnetworkInstances(self, subnetwork: str) -> int:
+        """
+        Count of instance network interfaces in subnetwork ( all zones of project )
+        """
+        name = subnetwork.split('/')[-1]
+        count = 0
+        instances = self.gcp_discovery().instances()
+        # No returnPartialSuccess: discovery document of compute v1 rejects it for instances
+        request = instances.aggregatedList(
+            project=self.gcp_project,
+            fields='items/*/instances/networkInterfaces/subnetwork,nextPageToken')
+        while request is not None:
+            response = request.execute(num_retries=self.num_retries)
+            for scope in response.get('items', {}).values():
+                for instance in scope.get('instances', []):
+                    count += len([x for x in instance.get('networkInterfaces', [])
+                                  if x.get('subnetwork', '').split('/')[-1] == name])
+            request = instances.aggregatedList_next(previous_request=request, previous_response=response)
+        return count
+
+    def getInstance(self, zone: str, instance_name: str) -> dict:
+        return self.gcp_discovery().instances().get(
+            project=self.gcp_project, zone=zone, instance=instance_name).execute(num_retries=self.num_retries)
+
+    def getGuestAttributes(self, zone: str, instance_name: str, query_path: str) -> dict:
+        """
+        Guest attributes written by instance in namespace query_path as {key: value}
+        """
+        try:
+            response = self.gcp_discovery().instances().getGuestAttributes(
+                project=self.gcp_project, zone=zone, instance=instance_name,
+                queryPath=query_path).execute(num_retries=self.num_retries)
+        except errors.HttpError as gcp_api_err:
+            self.logger.logger.debug("Guest attributes of %s not found: %s", instance_name, gcp_api_err)
+            return {}
+        return {x['key']: x['value'] for x in response.get('queryValue', {}).get('items', [])}
+
+    def getSerialPortOutput(self, zone: str, instance_name: str) -> str:
+        try:
+            response = self.gcp_discovery().instances().getSerialPortOutput(
+                project=self.gcp_project, zone=zone, instance=instance_name,
+                port=1).execute(num_retries=self.num_retries)
+        except errors.HttpError as gcp_api_err:
+            self.logger.logger.debug("Serial port output of %s not available: %s", instance_name, gcp_api_err)
+            return ''
+        return response.get('contents', '')
+
+    def _record_boot_progress(self, instance_group_name: str, boot_timeline) -> list:
+        """
+        Save first observed RUNNING status and first healthy probe of instances in instance group
+        """
+        managed_instances = self.listManagedInstances(instance_group_name)
+        now = time.time()
+        for instance in managed_instances:
+            instance_name = instance['instance'].split('/')[-1]
+            boot_timeline.record(instance_name, 'seen', now)
+            if instance.get('instanceStatus') == 'RUNNING':
+                boot_timeline.record(instance_name, 'running', now)
+            if [x for x in instance.get('instanceHealth', []) if x.get('detailedHealthState') == 'HEALTHY']:
+                boot_timeline.record(instance_name, 'healthy', now)
+        return managed_instances
+
+    def collect_boot_timeline(self, instance_group_name: str, boot_timeline) -> None:
+        """
+        Waiting first healthy probe of every instance in instance group and
+        collecting creation/start timestamps and startup script markers of instances
+        """
+        msg = "Collecting boot timeline of instance group {}".format(instance_group_name)
+        self.logger.colored(msg, 'Cyan')
+        count = 0
+        maximum_counts = int(self.instance_group_stabilisation_interval/self.operation_pull_interval)
+        while True:
+            managed_instances = self._record_boot_progress(instance_group_name, boot_timeline)
+            healthy = boot_timeline.healthy_instances()
+            self.logger.colored("Instance group: %s healthy instances: %s/%s", 'Yellow', None,
+                                instance_group_name, len(healthy), len(managed_instances))
+            if managed_instances and len(healthy) >= len(managed_instances):
+                break
+            count += 1
+            if count > maximum_counts:
+                self.logger.colored(
+                    "Not all instances of {} reported healthy in time interval {} seconds".format(
+                        instance_group_name, self.instance_group_stabilisation_interval), 'Red')
+                break
+            time.sleep(self.operation_pull_interval)
+
+        for instance in managed_instances:
+            instance_url = instance['instance']
+            instance_name = instance_url.split('/')[-1]
+            zone = instance_url.split('/zones/')[1].split('/')[0]
+            details = self.getInstance(zone, instance_name)
+            boot_timeline.record(instance_name, 'created', details.get('creationTimestamp'),
+                                 source='api', overwrite=True)
+            boot_timeline.record(instance_name, 'running', details.get('lastStartTimestamp'),
+                                 source='api', overwrite=True)
+
+            markers = self.getGuestAttributes(zone, instance_name, f"{GUEST_ATTRIBUTES_NAMESPACE}/")
+            if markers:
+                boot_timeline.record_markers(instance_name, markers, source='guest-attributes')
+                continue
+            # Fallback to startup script markers in serial port output
+            serial_markers = {}
+            for line in self.getSerialPortOutput(zone, instance_name).splitlines():
+                found = SERIAL_MARKER.match(line)
+                if found:
+                    serial_markers.setdefault(found.group(2), found.group(1))
+            boot_timeline.record_markers(instance_name, serial_markers, source='serial-port')
+
+    def _instance_group_capacity_errors(self, instance_group_name: str, since: float) -> list:
+        """
+        Capacity stockout errors of instance group instances created after since
+        """
+        response = self.gcp_discovery().regionInstanceGroupManagers().listErrors(
+            project=self.gcp_project, region=self.gcp_region,
+            instanceGroupManager=instance_group_name).execute(num_retries=self.num_retries)
+        capacity_errors = []
+        for item in response.get('items', []):
+            timestamp = parse_timestamp(item.get('timestamp'))
+            if item.get('error', {}).get('code') in CAPACITY_ERROR_CODES and (timestamp or since) >= since:
+                capacity_errors.append("{}: {}".format(item['error']['code'], item['error'].get('message')))
+        return capacity_errors
+
+    @traced(OPERATION, 'operation_name', 'event')
     def _wait_for_operation_to_complete(
         self,
         project_id: str,
@@ -696,6 +1439,7 @@ class GCP:
         """
         service = self.gcp_discovery()
         # self.logger.logger.info("Operation id: %s", operation_name)
+        status = None
         while True:
             if zone is None and region is None:
                 # noinspection PyTypeChecker
@@ -713,6 +1457,10 @@ class GCP:
                 # noinspection PyTypeChecker
                 operation_response = self._check_zone_operation_status(
                     service, operation_name, project_id, zone, self.num_retries)
+            if operation_response.get("status") != status:
+                status = operation_response.get("status")
+                tracer.event('status', operation_name, OPERATION, status=status, progress=operation_response.get(
+                    'progress'), target=operation_response.get('targetLink', '').split('/')[-1], event=event)
             if operation_response.get("status") == GceOperationStatus.DONE:
                 error = operation_response.get("error")
                 if error:
@@ -721,12 +1469,12 @@ class GCP:
                     # Extracting the errors list as string and trimming square braces
                     error_msg = str(error.get("errors"))[1:-1]
                     raise Exception("{} {}: ".format(code, msg) + error_msg)
-                self.logger.colored("{}: {}".format(event, operation_response.get("status")), 'Green')
-
+                self.logger.colored("%s: %s", 'Green', None, event, operation_response.get("status"))
+                self.session.invalidate(project_id)
                 break
             else:
                 # self.logger.logger.info("\x1b[93;0mOperation status: %s\x1b[0m", operation_response.get("status"))
-                self.logger.colored("{}: {}".format(event, operation_response.get("status")), 'Yellow')
+                self.logger.colored("%s: %s", 'Yellow', None, event, operation_response.get("status"))
                 self.logger.logger.debug("Operation response body: %s", operation_response)
             time.sleep(self.operation_pull_interval)
 
@@ -1,46 +1,381 @@
-from kubernetes import client, config
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from kubernetes import client, config, watch
 from kubernetes.client.rest import ApiException
+from _logger import lazy_lines
+from tracing import tracer, K8S, HEALTHCHECK
 
 #  =================== Kubernetes Provider =====================
 
+# Annotation of ingress with version before cutover ( used by rollback )
+PREVIOUS_VERSION_ANNOTATION = 'deploy/previous-version'
+# Kubernetes API clients of process per kube config context ( None - current context ) with cluster using it
+_api_clients = {}
+_api_clients_lock = threading.Lock()
+
+
+def kube_context(cluster_name: str, context: str = None):
+    """
+    Kube config context of cluster: context of metadata, context named after cluster
+    ( name or gcloud gke_<project>_<location>_<name> ), otherwise current context
+    """
+    if context:
+        return context
+    contexts, _ = config.list_kube_config_contexts()
+    for x in contexts or []:
+        if x['name'] == cluster_name or x['name'].endswith(f"_{cluster_name}"):
+            return x['name']
+    return None
+
+
+def kube_api_client(cluster_name: str, context: str, logger):
+    """
+    Kubernetes API client of cluster shared by matrix targets and daemon jobs, kube config is loaded
+    once per context. Clusters without own context can not share current context
+    """
+    with _api_clients_lock:
+        context = kube_context(cluster_name, context)
+        if context not in _api_clients:
+            _api_clients[context] = (cluster_name, config.new_client_from_config(context=context))
+        owner, api_client = _api_clients[context]
+    if owner != cluster_name:
+        logger.colored(f"GKE cluster {cluster_name} has no kube config context, current context is used by "
+                       f"cluster {owner}, set gke_cluster.context in metadata", 'Red', 'error')
+        exit(3)
+    return api_client
+
 
 class GKE:
     # Google Kubernetes Engine
-    def __init__(self, service_name: str, metadata, logger):
+    def __init__(self, service_name: str, metadata, logger, api_client=None):
         self.namespace = metadata.gke_namespace
         self.service_name = service_name
         self.cluster_name = metadata.gke_cluster
+        self.context = metadata.gke_context
+        # Server side selection of service ingresses
+        ingress = metadata.metadata['gke_cluster'].get('ingress') or {}
+        self.label_selector = ingress.get('labelSelector', f"service={service_name}")
+        # Fallback selection of ingresses by exact names when label selector matches nothing
+        self.ingress_names = {x['kind_name'] for x in metadata.metadata['gke_cluster'].get('instances') or []}
+        # Endpoints of ingresses answering version of release which serves request ( cutover propagation )
+        self.version_probe = ingress.get('versionProbe') or {}
+        self.probe_urls = {
+            x['kind_name']: "{}://{}{}".format(x.get('protocol', 'http'), x['url'][0], x['versionPath'])
+            for x in metadata.metadata['gke_cluster'].get('instances') or [] if x.get('versionPath') and x.get('url')
+        }
+        self.current_versions = set()
         self.current_version = ''
+        # Ingresses of service without version label
+        self.unlabeled_ingresses = []
         self.logger = logger
+        self._api_client = api_client
 
-    def get_ingresses(self):
-        self.logger.colored(
-            f"Getting ingresses of service {self.service_name} in GKE cluster: {self.namespace} namespace: {self.cluster_name}", 'Cyan')
-        ingresses = []
+    @property
+    def api_client(self):
+        """
+        Kubernetes API client of cluster context, kube config is loaded once and client is reused
+        """
+        if self._api_client is None:
+            self._api_client = kube_api_client(self.cluster_name, self.context, self.logger)
+        return self._api_client
+
+    @property
+    def networking_api(self):
+        return client.NetworkingV1Api(self.api_client)
 
+    @property
+    def core_api(self):
+        return client.CoreV1Api(self.api_client)
+
+    def _list_ingresses(self, with_resource_version: bool = False):
+        """
+        Ingresses of service by label selector or by names of gke_cluster.instances,
+        with resource version also reports whether ingresses were selected by names
+        """
+        by_names = False
         try:
-            config.load_kube_config()
-            api_instance = client.NetworkingV1Api()
-            api_response = api_instance.list_namespaced_ingress(
-                self.namespace,  # Namespace
-                timeout_seconds=15,  # TimeOut connection
-                # watch=True,
-            )
+            with tracer.span('list_namespaced_ingress', K8S, resource=self.namespace, selector=self.label_selector):
+                api_response = self.networking_api.list_namespaced_ingress(
+                    self.namespace,  # Namespace
+                    label_selector=self.label_selector,
+                    timeout_seconds=15,  # TimeOut connection
+                )
+            ingresses = api_response.items
+            if not ingresses and self.ingress_names:
+                self.logger.logger.warning(
+                    "Not found ingresses with labels %s, selecting ingresses by names: %s",
+                    self.label_selector, ', '.join(sorted(self.ingress_names)))
+                with tracer.span('list_namespaced_ingress', K8S, resource=self.namespace):
+                    api_response = self.networking_api.list_namespaced_ingress(self.namespace, timeout_seconds=15)
+                ingresses = [x for x in api_response.items if x.metadata.name in self.ingress_names]
+                by_names = True
         except ApiException as e:
             self.logger.logger.error("Exception when calling NetworkingV1Api->list_namespaced_ingress: %s\n" % e)
             exit(2)
+        if with_resource_version:
+            return ingresses, api_response.metadata.resource_version, by_names
+        return ingresses
 
-        for ingress in api_response.items:
-            if self.service_name in ingress.metadata.name:
-                ingresses.append(ingress)
-        try:
-            names = [{'name': x.metadata.name, 'version': x.metadata.labels.get("version")} for x in ingresses]
-        except Exception as exc:
-            self.logger.logger.error('Not found version label in ingress manifests. \n%s', exc)
-        self.logger.logger.info("Found ingresses: \n- %s", '\n- '.join(map(str, names)))
-        versions = set([x.get("version") for x in names])
+    def get_ingresses(self):
         self.logger.colored(
-            "Ingress in GKE cluster {} configured for version: \n- {}".format(
-                self.cluster_name, '\n- '.join(map(str, versions))), 'Green', 'info')
-        if versions:
-            self.current_version = "".join(versions)
+            f"Getting ingresses of service {self.service_name} in GKE cluster: {self.cluster_name} namespace: {self.namespace}", 'Cyan')
+        ingresses = self._list_ingresses()
+        names = [{'name': x.metadata.name, 'version': (x.metadata.labels or {}).get("version")} for x in ingresses]
+        self.logger.logger.info("Found ingresses: \n- %s", lazy_lines(names))
+        self.unlabeled_ingresses = [x['name'] for x in names if not x['version']]
+        if self.unlabeled_ingresses:
+            self.logger.logger.error('Not found version label in ingress manifests: %s',
+                                     ', '.join(self.unlabeled_ingresses))
+        self.current_versions = set([x.get("version") for x in names if x.get("version")])
+        self.logger.colored("Ingress in GKE cluster %s configured for version: \n- %s", 'Green', 'info',
+                            self.cluster_name, lazy_lines(self.current_versions))
+        if len(self.current_versions) == 1:
+            self.current_version = next(iter(self.current_versions))
+        elif len(self.current_versions) > 1:
+            self.current_version = ''
+            self.logger.colored("Ingresses of {} are configured for different versions: {}".format(
+                self.service_name, ', '.join(sorted(self.current_versions))), 'Red', 'error')
+        return self.current_versions
+
+    def require_current_versions(self):
+        """
+        Releases are deleted only when current version is known: without ingresses
+        or version labels every release of service looks like previous one
+        """
+        if not self.current_versions or self.unlabeled_ingresses:
+            self.logger.colored(
+                "Current version of {} is unknown ( ingresses with labels {}: {}, without version label: {} ), "
+                "releases are not deleted".format(
+                    self.service_name, self.label_selector, ', '.join(sorted(self.current_versions)) or 'none',
+                    ', '.join(self.unlabeled_ingresses) or 'none'), 'Red', 'error')
+            exit(3)
+
+    @staticmethod
+    def _backend_services(spec: dict) -> list:
+        """
+        Backend service objects of ingress spec ( default backend and rules paths )
+        """
+        backends = []
+        if spec.get('defaultBackend', {}).get('service'):
+            backends.append(spec['defaultBackend']['service'])
+        for rule in spec.get('rules') or []:
+            for path in (rule.get('http') or {}).get('paths') or []:
+                if path.get('backend', {}).get('service'):
+                    backends.append(path['backend']['service'])
+        return backends
+
+    def _cutover_patch(self, ingress, target_version: str) -> dict:
+        """
+        Patch of ingress moving its backends and version label to target version
+        """
+        current = (ingress.metadata.labels or {}).get('version', '')
+        spec = client.ApiClient().sanitize_for_serialization(ingress.spec)
+        for backend in self._backend_services(spec):
+            if current and current in backend['name']:
+                backend['name'] = backend['name'].replace(current, target_version)
+        patch = {
+            "metadata": {
+                "labels": {"version": target_version},
+                "annotations": {PREVIOUS_VERSION_ANNOTATION: current},
+            },
+            "spec": {"rules": spec.get('rules')},
+        }
+        if spec.get('defaultBackend'):
+            patch['spec']['defaultBackend'] = spec['defaultBackend']
+        return patch
+
+    def cutover(self, version: str = '', rollback: bool = False, timeout: int = 120):
+        """
+        Moving all ingresses of service to release version concurrently and waiting
+        until every ingress reports new version, rollback moves every ingress
+        back to version from previous-version annotation
+        """
+        ingresses = self._list_ingresses()
+        api_instance = self.networking_api
+        core_instance = self.core_api
+        if not ingresses:
+            self.logger.colored(f"Not found ingresses of service {self.service_name}", 'Red', 'error')
+            exit(3)
+
+        targets = {}
+        patches = {}
+        for ingress in ingresses:
+            if rollback:
+                target = (ingress.metadata.annotations or {}).get(PREVIOUS_VERSION_ANNOTATION)
+                if not target:
+                    self.logger.colored(f"Ingress {ingress.metadata.name} has no previous version for rollback",
+                                        'Red', 'error')
+                    exit(3)
+            else:
+                target = version.replace('.', '-').lower()
+            targets[ingress.metadata.name] = target
+            patches[ingress.metadata.name] = self._cutover_patch(ingress, target)
+
+        # Backend services of target version must exist before any ingress is patched
+        missing = []
+        for name, patch in patches.items():
+            for backend in self._backend_services(patch['spec']):
+                try:
+                    with tracer.span('read_namespaced_service', K8S, resource=backend['name']):
+                        core_instance.read_namespaced_service(backend['name'], self.namespace)
+                except ApiException as e:
+                    if e.status != 404:
+                        raise
+                    missing.append(f"{name}: {backend['name']}")
+        if missing:
+            self.logger.colored("Not found backend services for cutover: \n- {}".format(
+                '\n- '.join(missing)), 'Red', 'error')
+            exit(3)
+
+        self.logger.colored("Cutover of {} ingresses: \n- {}".format(
+            self.service_name, '\n- '.join(f"{k} -> {v}" for k, v in targets.items())), 'Cyan')
+        start_time = time.time()
+
+        def patch_ingress(name):
+            with tracer.span('patch_namespaced_ingress', K8S, resource=name):
+                api_instance.patch_namespaced_ingress(name, self.namespace, patches[name])
+            return name, time.time() - start_time
+
+        with ThreadPoolExecutor(max_workers=len(patches)) as executor:
+            for name, interval in executor.map(tracer.wrap(patch_ingress), patches):
+                self.logger.logger.info("Patched ingress %s in %.2fs", name, interval)
+
+        self.wait_for_versions(targets, timeout, propagation=True)
+        mixed_window = time.time() - start_time
+        self.logger.colored("Cutover of {} finished, mixed version window: {:.2f}s".format(
+            self.service_name, mixed_window), 'Green')
+        self.current_versions = set(targets.values())
+        self.current_version = "".join(self.current_versions) if len(self.current_versions) == 1 else ''
+        return mixed_window
+
+    def wait_for_versions(self, targets: dict, timeout: int = 120, propagation: bool = False):
+        """
+        Waiting until every ingress from targets reports its target version,
+        ingress changes are watched and method returns right after last change.
+        With propagation also until load balancers serve target versions
+        """
+        if not targets:
+            self.logger.colored(f"Not found ingresses of service {self.service_name} with labels {self.label_selector}",
+                                'Red', 'error')
+            exit(3)
+        ingresses, resource_version, by_names = self._list_ingresses(with_resource_version=True)
+        versions = {x.metadata.name: (x.metadata.labels or {}).get('version') for x in ingresses}
+        deadline = time.time() + timeout
+        while [name for name, version in targets.items() if versions.get(name) != version]:
+            remaining = int(deadline - time.time())
+            if remaining <= 0:
+                pending = [name for name, version in targets.items() if versions.get(name) != version]
+                self.logger.colored("Ingresses did not report new version in {} seconds: \n- {}".format(
+                    timeout, '\n- '.join(pending)), 'Red', 'error')
+                exit(3)
+            # Ingresses selected by names are watched in whole namespace
+            selector = {} if by_names else {'label_selector': self.label_selector}
+            stream = watch.Watch()
+            try:
+                with tracer.span('watch_namespaced_ingress', K8S, resource=self.namespace):
+                    for event in stream.stream(
+                            self.networking_api.list_namespaced_ingress, self.namespace,
+                            resource_version=resource_version, timeout_seconds=remaining, **selector):
+                        ingress = event['object']
+                        resource_version = ingress.metadata.resource_version
+                        if by_names and ingress.metadata.name not in self.ingress_names:
+                            continue
+                        versions[ingress.metadata.name] = (ingress.metadata.labels or {}).get('version')
+                        if not [name for name, version in targets.items() if versions.get(name) != version]:
+                            stream.stop()
+            except ApiException as e:
+                if e.status != 410:
+                    raise
+                # Watched resource version is too old, starting from new list
+                ingresses, resource_version, by_names = self._list_ingresses(with_resource_version=True)
+                versions = {x.metadata.name: (x.metadata.labels or {}).get('version') for x in ingresses}
+        if propagation:
+            self.wait_for_propagation(targets, deadline)
+
+    def wait_for_propagation(self, targets: dict, deadline: float):
+        """
+        Waiting until ingress controller published load balancer address of every ingress and
+        version endpoint of ingress ( gke_cluster.instances[].versionPath ) answers target version
+        in consecutive responses, ingress label alone does not mean traffic reached new backends
+        """
+        interval = self.version_probe.get('intervalSec', 1)
+        while True:
+            pending = [x.metadata.name for x in self._list_ingresses() if x.metadata.name in targets
+                       and not (x.status and x.status.load_balancer and x.status.load_balancer.ingress)]
+            if not pending:
+                break
+            if time.time() > deadline:
+                self.logger.colored("Ingresses have no load balancer address: \n- {}".format(
+                    '\n- '.join(pending)), 'Red', 'error')
+                exit(3)
+            time.sleep(interval)
+
+        probes = {name: url for name, url in self.probe_urls.items() if name in targets}
+        if not probes:
+            self.logger.logger.warning("No versionPath of ingresses %s, load balancer propagation is not probed",
+                                       ', '.join(sorted(targets)))
+            return
+
+        def probe(name):
+            return name, self._probe_version(probes[name], targets[name], deadline)
+
+        with ThreadPoolExecutor(max_workers=len(probes)) as executor:
+            pending = [name for name, served in executor.map(tracer.wrap(probe), probes) if not served]
+        if pending:
+            self.logger.colored("Load balancers of ingresses do not serve new version: \n- {}".format(
+                '\n- '.join(f"{name}: {probes[name]}" for name in pending)), 'Red', 'error')
+            exit(3)
+
+    def _served_version(self, response) -> str:
+        """
+        Version answered by version endpoint in label form: header versionProbe.header,
+        field versionProbe.field of json body or whole body
+        """
+        header = self.version_probe.get('header')
+        if header:
+            answer = response.headers.get(header, '')
+        else:
+            answer = response.text
+            try:
+                body = json.loads(answer)
+                if isinstance(body, dict):
+                    answer = str(body.get(self.version_probe.get('field', 'version'), ''))
+            except ValueError:
+                pass
+        return answer.strip().replace('.', '-').lower()
+
+    def _probe_version(self, url: str, version: str, deadline: float) -> bool:
+        """
+        Requesting version endpoint until consecutive responses answer exactly version ( label form 1-2-3-00 )
+        """
+        consecutive = self.version_probe.get('consecutive', 3)
+        interval = self.version_probe.get('intervalSec', 1)
+        served = 0
+        with tracer.span('version_probe', HEALTHCHECK, resource=url, version=version):
+            while time.time() < deadline:
+                try:
+                    response = requests.get(url, timeout=self.version_probe.get('timeoutSec', 5))
+                    served = served + 1 if response.ok and self._served_version(response) == version else 0
+                except requests.RequestException as exc:
+                    self.logger.logger.debug("Version probe %s failed: %s", url, exc)
+                    served = 0
+                if served >= consecutive:
+                    return True
+                time.sleep(interval)
+        return False
+
+    def wait_for_version(self, version: str, timeout: int = 600):
+        """
+        Waiting until all ingresses of service report version and their load balancers
+        serve it ( cutover done by other process )
+        """
+        version = version.replace('.', '-').lower()
+        targets = {x.metadata.name: version for x in self._list_ingresses()}
+        self.logger.colored("Waiting ingresses of {} report version {}".format(self.service_name, version), 'Cyan')
+        start_time = time.time()
+        self.wait_for_versions(targets, timeout, propagation=True)
+        self.logger.colored("Ingresses of {} report version {} after {:.2f}s".format(
+            self.service_name, version, time.time() - start_time), 'Green')
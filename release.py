@@ -1,7 +1,58 @@
 import json
-from typing import Dict, Optional, List
-from datetime import datetime
+import math
+import sqlite3
+import time
+from typing import Dict, Optional, List, Tuple
+from datetime import datetime, timezone
+from _logger import lazy_json, lazy_lines
 from healthcheck import http_healthcheck
+from boot_timeline import BootTimeline, BootHistory, parse_timestamp
+from history import HISTORY_FILE, DeployHistory, result_resources
+from providers.gcp import InstanceGroupCapacityError
+from tracing import tracer, STEP
+
+# Performance profile used when metadata has no performance_profiles
+DEFAULT_PERFORMANCE_PROFILE = {
+    "bootDisk": {"diskType": "pd-balanced", "diskSizeGb": 80},
+    "dataDisk": {"diskType": "pd-balanced", "diskSizeGb": 50},
+    "gvnic": False,
+    "tier1Networking": False,
+}
+# Machine families which support Tier_1 networking ( with at least 30 vCPUs )
+TIER_1_MACHINE_FAMILIES = {'n2', 'n2d', 'c2', 'c2d', 'c3', 'c3d', 'c4', 'm3', 'z3', 'h3', 'a2', 'a3', 'g2'}
+TIER_1_MIN_VCPUS = 30
+# Machine families which support Hyperdisk Balanced/Extreme/Throughput
+HYPERDISK_MACHINE_FAMILIES = {'c3', 'c3d', 'c4', 'c4a', 'h3', 'm3', 'n4', 'z3', 'a3', 'x4'}
+# Machine families without Persistent Disk support ( Hyperdisk only )
+PD_UNSUPPORTED_MACHINE_FAMILIES = {'c4', 'c4a', 'n4'}
+# Machine families and minimal vCPUs which support pd-extreme
+PD_EXTREME_MACHINE_FAMILIES = {'n2': 64, 'm1': 0, 'm2': 0, 'm3': 0}
+# Disk types which accept provisionedIops / provisionedThroughput
+PROVISIONED_IOPS_DISK_TYPES = {'pd-extreme', 'hyperdisk-balanced', 'hyperdisk-extreme'}
+PROVISIONED_THROUGHPUT_DISK_TYPES = {'hyperdisk-balanced', 'hyperdisk-throughput'}
+
+
+def machine_type_family(machine_type: str) -> Tuple[str, int]:
+    """
+    Machine family and vCPUs count of machine type name,
+    examples: e2-custom-2-8192 -> (e2, 2), n2-standard-32 -> (n2, 32), custom-2-8192 -> (n1, 2)
+    """
+    parts = machine_type.split('/')[-1].split('-')
+    if parts[0] == 'custom':
+        parts = ['n1'] + parts
+    family = parts[0]
+    try:
+        vcpus = int(parts[2])
+    except (IndexError, ValueError):
+        vcpus = 0
+    return family, vcpus
+
+
+def redistribution_type(target_shape: str) -> str:
+    """
+    Instance redistribution of regional instance group, GCP rejects PROACTIVE with any shape but EVEN
+    """
+    return "PROACTIVE" if target_shape == "EVEN" else "NONE"
 
 
 class Release:
@@ -12,7 +63,8 @@ class Release:
     resource body
     """
     def __init__(
-            self, service, version: str, metadata, logger, gcp, previous_version: Optional[str] = None):
+            self, service, version: str, metadata, logger, gcp, previous_version: Optional[str] = None,
+            boot_timeline: bool = False):
         """
         Class constructor
         """
@@ -41,14 +93,42 @@ class Release:
         self.instance_template_name = self.service_name_with_version
         # Instance Group name
         self.instance_group_name = self.service_name_with_version
+        # Compact placement policy of release instances
+        self.placement_policy_name = f"{self.service_name_with_version}-placement"
+        self.placement = self.metadata.metadata['gce_instance_group'].get('placement') or {}
+        self.use_placement = bool(self.placement.get('enabled'))
+        # Pool of reserved internal addresses of service instead of per release addresses
+        self.use_address_pool = bool((self.metadata.load_balancer.addressPool or {}).get('enabled'))
+        # Forwarding rule name -> claimed address of pool
+        self.claimed_addresses = {}
         # Autascaler resource name
         self.autoscaler_name = self.service_name_with_version
         # Backend services names
         self.backend_services = [f"{self.service_name_with_version}-{x['name']}" for x in self.service_instances]
         # Forwarding rules names of backend services
         self.forwarding_rules = [f"{self.service_name_with_version}-{x['name']}" for x in self.service_instances]
+        # Autohealing initialDelaySec calibration from measured boot times
+        self.calibration = self.metadata.metadata['gce_instance_group']['autoHealing'].get('calibration') or {}
+        mode = self.calibration.get('mode', 'off')
+        if mode != 'off':
+            self.boot_history = BootHistory(
+                self.calibration.get('historyFile', 'boot_history.json'), self.calibration.get('history', 50))
+            # Boot times are measured on every deploy in apply mode, in suggest mode with --boot-timeline
+            boot_timeline = boot_timeline or self.calibration.get('collect', mode == 'apply')
+        else:
+            self.boot_history = None
+        # Boot timeline of instance group instances ( profiling mode )
+        self.boot_timeline = BootTimeline(self.service_name, self.version, self.logger) if boot_timeline else None
+        # Live capacity of current release to start new release with ( pre-scale before cutover )
+        self.warmup_capacity = 0
         # Service healthcheck endpoint. default: /healthcheck
-        self.service_healthcheck_endpoint = self.metadata.metadata['healthcheck_endpoint']
+        self.service_healthcheck_endpoint = self.metadata.healthcheck_endpoint
+        # Indexed history of release operations ( previous version, step timings, resource names ),
+        # opened on first use: releases of previous versions are created only to be matched or deleted
+        self._history = None
+        self.history_file = (self.metadata.metadata.get('history') or {}).get('file', HISTORY_FILE)
+        # Deploy result json file next to history ( <service>_<version>_<time>.json )
+        self.export_json = bool((self.metadata.metadata.get('history') or {}).get('exportJson'))
         # Release definitions
         self.definitions = {
             'metadata': {
@@ -67,13 +147,17 @@ class Release:
             "Delete backend services",
             "Delete autoscaler",
             'Delete instance group',
+            "Delete health checks",
             "Delete instance template",
+            "Delete resource policies",
             "Delete images",
         ]
         # Steps collection of deploy releases
         self.deploy_steps = [
             "Create image",
+            "Create placement policy",
             "Create Instance Template",
+            "Create health checks",
             "Create Instance Group",
             "Create autoscaler",
             "Create Backend services",
@@ -112,8 +196,86 @@ class Release:
     #
     #     return body
 
+    def performance_profile(self) -> Dict:
+        """
+        Performance profile of instance template from metadata with validation
+        of disk types, provisioned IOPS/throughput, gVNIC and Tier_1 networking
+        against machine type
+        """
+        gce_instance = self.metadata.metadata['gce_instance']
+        profiles = gce_instance.get('performance_profiles') or {}
+        profile_name = gce_instance.get('performance_profile')
+        if not profile_name:
+            return DEFAULT_PERFORMANCE_PROFILE
+        if profile_name not in profiles:
+            self.logger.colored("Performance profile {} not found in metadata, available profiles: {}".format(
+                profile_name, ', '.join(profiles)), 'Red', 'error')
+            exit(3)
+        # Disks are merged key by key, profile may change only disk type or size
+        profile = dict(DEFAULT_PERFORMANCE_PROFILE, **profiles[profile_name])
+        for disk in ('bootDisk', 'dataDisk'):
+            profile[disk] = {**DEFAULT_PERFORMANCE_PROFILE[disk], **(profiles[profile_name].get(disk) or {})}
+
+        family, vcpus = machine_type_family(self.metadata.machine_type)
+        problems = []
+        for disk in ('bootDisk', 'dataDisk'):
+            disk_type = profile[disk]['diskType']
+            if disk_type.startswith('hyperdisk') and family not in HYPERDISK_MACHINE_FAMILIES:
+                problems.append(f"{disk}: {disk_type} is not supported by machine family {family}")
+            if disk_type.startswith('pd-') and family in PD_UNSUPPORTED_MACHINE_FAMILIES:
+                problems.append(f"{disk}: {disk_type} is not supported by machine family {family}, use hyperdisk")
+            if disk_type == 'pd-extreme' and (
+                    family not in PD_EXTREME_MACHINE_FAMILIES or vcpus < PD_EXTREME_MACHINE_FAMILIES[family]):
+                problems.append(f"{disk}: pd-extreme is not supported by machine type {self.metadata.machine_type}")
+            if profile[disk].get('provisionedIops') and disk_type not in PROVISIONED_IOPS_DISK_TYPES:
+                problems.append(f"{disk}: provisionedIops is not supported by disk type {disk_type}")
+            if profile[disk].get('provisionedThroughput') and disk_type not in PROVISIONED_THROUGHPUT_DISK_TYPES:
+                problems.append(f"{disk}: provisionedThroughput is not supported by disk type {disk_type}")
+        if profile['tier1Networking']:
+            if family not in TIER_1_MACHINE_FAMILIES or vcpus < TIER_1_MIN_VCPUS:
+                problems.append(f"Tier_1 networking requires {TIER_1_MIN_VCPUS}+ vCPUs of families "
+                                f"{', '.join(sorted(TIER_1_MACHINE_FAMILIES))}, "
+                                f"machine type: {self.metadata.machine_type}")
+            if not profile['gvnic']:
+                problems.append("Tier_1 networking requires gvnic: True")
+        if problems:
+            self.logger.colored("Performance profile {} is not valid for machine type {}: \n- {}".format(
+                profile_name, self.metadata.machine_type, '\n- '.join(problems)), 'Red', 'error')
+            exit(3)
+        self.logger.logger.info("Performance profile of instance template: %s", profile_name)
+        return profile
+
+    def resource_policy(self) -> Dict:
+        # https://cloud.google.com/compute/docs/reference/rest/v1/resourcePolicies/insert
+        body = {
+            "name": self.placement_policy_name,
+            "region": self.metadata.gcp_region,
+            "description": f"Compact placement of service {self.service_name} version {self.version}",
+            "groupPlacementPolicy": {
+                "collocation": self.placement.get('collocation', 'COLLOCATED')
+            }
+        }
+        if self.placement.get('vmCount'):
+            body['groupPlacementPolicy']['vmCount'] = self.placement['vmCount']
+        self.definitions.update({'resource_policy': body})
+        return body
+
+    @staticmethod
+    def _disk_initialize_params(disk: Dict, source_image: str) -> Dict:
+        params = {
+            "diskSizeGb": str(disk['diskSizeGb']),
+            "diskType": disk['diskType'],
+            "sourceImage": source_image
+        }
+        if disk.get('provisionedIops'):
+            params['provisionedIops'] = str(disk['provisionedIops'])
+        if disk.get('provisionedThroughput'):
+            params['provisionedThroughput'] = str(disk['provisionedThroughput'])
+        return params
+
     def instance_template(self) -> Dict:
         # https://cloud.google.com/compute/docs/reference/rest/v1/instanceTemplates/insert
+        profile = self.performance_profile()
         body = {
             "description": f"Instance Template of service {self.service_name} version {self.version}",
             "kind": "compute#instanceTemplate",
@@ -126,11 +288,9 @@ class Release:
                         "boot": True,
                         "deviceName": f"{self.boot_disk_img}",
                         "index": 0,
-                        "initializeParams": {
-                            "diskSizeGb": "80",
-                            "diskType": "pd-balanced",
-                            "sourceImage": f"projects/{self.metadata.gcp_project}/global/images/{self.boot_disk_img}"
-                        },
+                        "initializeParams": self._disk_initialize_params(
+                            profile['bootDisk'],
+                            f"projects/{self.metadata.gcp_project}/global/images/{self.boot_disk_img}"),
                         "kind": "compute#attachedDisk",
                         "mode": "READ_WRITE",
                         "type": "PERSISTENT"
@@ -140,11 +300,9 @@ class Release:
                         "boot": False,
                         "deviceName": f"{self.data_disk_img}",
                         "index": 1,
-                        "initializeParams": {
-                            "diskSizeGb": "50",
-                            "diskType": "pd-balanced",
-                            "sourceImage": f"projects/{self.metadata.gcp_project}/global/images/{self.data_disk_img}"
-                        },
+                        "initializeParams": self._disk_initialize_params(
+                            profile['dataDisk'],
+                            f"projects/{self.metadata.gcp_project}/global/images/{self.data_disk_img}"),
                         "kind": "compute#attachedDisk",
                         "mode": "READ_WRITE",
                         "type": "PERSISTENT"
@@ -195,6 +353,15 @@ class Release:
                 }
             },
         }
+        if self.use_placement:
+            body['properties']['resourcePolicies'] = [self.placement_policy_name]
+        if profile['gvnic']:
+            body['properties']['networkInterfaces'][0]['nicType'] = "GVNIC"
+        if profile['tier1Networking']:
+            body['properties']['networkPerformanceConfig'] = {"totalEgressBandwidthTier": "TIER_1"}
+        if self.boot_timeline:
+            # Startup script writes boot markers to guest attributes
+            body['properties']['metadata']['items'].append({"key": "enable-guest-attributes", "value": "TRUE"})
         # self.definitions.update({'instance_template': body})
         return body
 
@@ -210,31 +377,129 @@ class Release:
     #     }
     #     return body
 
-    def region_health_check(self)-> Dict:
-        body = {
+    def health_check_url(self, instance: dict) -> str:
+        """
+        Health check of service instance: release own regional health check
+        when health checks managed by release, otherwise from metadata
+        """
+        if self.metadata.health_check.get('managed'):
+            health_check_name = f"{self.service_name}-{instance['name']}-{self.version}"
+        else:
+            health_check_name = instance['healthcheck']
+        return f"https://www.googleapis.com/compute/v1/projects/{self.metadata.gcp_project}/regions/{self.metadata.gcp_region}/healthChecks/{health_check_name}"
+
+    def autohealing_health_check(self) -> str:
+        if not self.metadata.health_check.get('managed'):
+            return self.metadata.instance_group_helthcheck
+        # Autohealing uses health check of one service instance, by default first one
+        instance_name = self.metadata.metadata['gce_instance_group']['autoHealing'].get('serviceInstance')
+        instances = [x for x in self.service_instances if x['name'] == instance_name] or self.service_instances
+        return self.health_check_url(instances[0])
 
+    def region_health_check(self) -> List:
+        # https://cloud.google.com/compute/docs/reference/rest/v1/regionHealthChecks/insert
+        if not self.metadata.health_check.get('managed'):
+            return []
+        params = self.metadata.health_check
+        if params['timeoutSec'] > params['checkIntervalSec']:
+            self.logger.colored("Health check timeoutSec: {} must be less or equal checkIntervalSec: {}".format(
+                params['timeoutSec'], params['checkIntervalSec']), 'Red', 'error')
+            exit(3)
+        check_type = params.get('type', 'TCP').upper()
+        body = {
+            "kind": "compute#healthCheck",
+            "name": "",
+            "description": f"Health check of service {self.service_name} version {self.version}",
+            "type": check_type,
+            "checkIntervalSec": params['checkIntervalSec'],
+            "timeoutSec": params['timeoutSec'],
+            "healthyThreshold": params['healthyThreshold'],
+            "unhealthyThreshold": params['unhealthyThreshold'],
         }
 
+        health_checks = []
+        for instance in self.service_instances:
+            health_check_body = body.copy()
+            health_check_name = f"{self.service_name}-{instance['name']}-{self.version}"
+            port = [x for x in instance.get('port').values()][0]
+
+            health_check_body.update({"name": health_check_name})
+            if check_type == 'HTTP':
+                health_check_body['httpHealthCheck'] = {
+                    "port": port,
+                    "requestPath": self.service_healthcheck_endpoint
+                }
+            else:
+                health_check_body['tcpHealthCheck'] = {"port": port}
+
+            health_checks.append(health_check_body)
+        self.logger.logger.debug("Health check's body collection: %s", lazy_json(health_checks))
+        self.definitions.update({'health_checks': health_checks})
+        return health_checks
+
+    def autohealing_initial_delay(self) -> int:
+        """
+        Autohealing initialDelaySec from metadata or calibrated by percentile of measured
+        RUNNING to app-ready intervals of previous deploys, at most maxRatio of metadata value
+        """
+        delay = self.metadata.initialDelaySec
+        if self.boot_history is None:
+            return delay
+        samples = self.boot_history.samples(self.service_name)
+        if len(samples) < self.calibration.get('minSamples', 5):
+            self.logger.colored("Calibration of initialDelaySec: not enough measured boot times ( {} samples )".format(
+                len(samples)), 'Yellow')
+            return delay
+        rank = self.calibration.get('percentile', 95)
+        measured = self.boot_history.percentile(self.service_name, rank)
+        # GCP accepts initialDelaySec in range 0 - 3600
+        calibrated = min(int(math.ceil(measured * self.calibration.get('margin', 1.2))),
+                         int(delay * self.calibration.get('maxRatio', 2)), 3600)
+        self.logger.colored(
+            "Calibration of initialDelaySec: p{} of {} measured boot times {}s, suggested {}s, metadata {}s".format(
+                rank, len(samples), round(measured, 1), calibrated, delay), 'Cyan')
+        if abs(delay - calibrated) > self.calibration.get('warnRatio', 0.5) * calibrated:
+            self.logger.colored(
+                "Metadata initialDelaySec {}s is far from measured boot time, suggested value: {}s".format(
+                    delay, calibrated), 'Red', 'error')
+        if self.calibration.get('mode') == 'apply':
+            return calibrated
+        return delay
+
+    def prescale(self, current_version: str):
+        """
+        Reading live size of current release instance group and autoscaler,
+        new release is started with the same capacity
+        """
+        scaling = self.metadata.metadata['gce_instance_group']['scaling']
+        if not scaling.get('preScale') or not current_version:
+            return
+        current_release = f"{self.service_name}-{current_version.replace('.', '-').lower()}"
+        capacity = self.gcp.getLiveCapacity(current_release, current_release)
+        self.warmup_capacity = min(capacity, self.metadata.scaling.maxNumReplicas)
+        self.logger.colored("Pre-scale of {} version {} to live capacity of current version {}: {} instances".format(
+            self.service_name, self.version, current_version, self.warmup_capacity), 'Cyan')
+
     def region_instance_group_manager(self) -> Dict:
         body = {
           "kind": "compute#instanceGroupManager",
           "name": self.instance_group_name,
           "autoHealingPolicies": [
             {
-              "healthCheck": self.metadata.instance_group_helthcheck,
-              "initialDelaySec": self.metadata.initialDelaySec
+              "healthCheck": self.autohealing_health_check(),
+              "initialDelaySec": self.autohealing_initial_delay()
             }
           ],
           "baseInstanceName": self.baseInstanceName,
           "distributionPolicy": {
-            "targetShape": self.metadata.metadata['gce_instance_group']['distributionPolicy']['targetShape'],
-            "zones": self.metadata.metadata['gce_instance_group']['distributionPolicy']['zones'],
+            "targetShape": self.metadata.distribution_policy.targetShape,
+            "zones": list(self.metadata.distribution_policy.zones),
           },
           "instanceGroup": f"https://www.googleapis.com/compute/v1/projects/{self.metadata.gcp_project}/regions/{self.metadata.gcp_region}/instanceGroups/{self.instance_group_name}",
           "instanceTemplate": f"https://www.googleapis.com/compute/v1/projects/{self.metadata.gcp_project}/global/instanceTemplates/{self.instance_template_name}",
 
           "listManagedInstancesResults": "PAGELESS",
-          "targetSize": self.metadata.metadata['gce_instance_group']['targetSize'],
+          "targetSize": max(self.metadata.target_size, self.warmup_capacity),
           "updatePolicy": {
             "instanceRedistributionType": "PROACTIVE",
             "maxSurge": {
@@ -250,6 +515,21 @@ class Release:
             "type": "OPPORTUNISTIC"
           }
         }
+        flexibility = self.metadata.metadata['gce_instance_group'].get('instanceFlexibility')
+        if flexibility:
+            # Ranked machine types used when preferred machine type has no capacity
+            body['instanceFlexibilityPolicy'] = {
+                "instanceSelections": {
+                    f"rank-{rank}": {"rank": rank, "machineTypes": selection['machineTypes']}
+                    for rank, selection in enumerate(flexibility, start=1)
+                }
+            }
+        if self.use_placement:
+            # Compact placement policy can be applied to regional instance group only in single zone
+            body['distributionPolicy']['targetShape'] = "ANY_SINGLE_ZONE"
+        # Proactive redistribution is allowed only with EVEN target shape
+        body['updatePolicy']['instanceRedistributionType'] = redistribution_type(
+            body['distributionPolicy']['targetShape'])
         self.definitions.update({'instance_group_managed': body})
         return body
 
@@ -258,17 +538,39 @@ class Release:
             "name": self.autoscaler_name,
             "target": f"https://www.googleapis.com/compute/v1/projects/{self.metadata.gcp_project}/regions/{self.metadata.gcp_region}/instanceGroupManagers/{self.instance_group_name}",
             "autoscalingPolicy": {
-                "coolDownPeriodSec": self.metadata.metadata['gce_instance_group']['scaling']['coolDownPeriodSec'],
+                "coolDownPeriodSec": self.metadata.scaling.coolDownPeriodSec,
                 "cpuUtilization": {
-                  "utilizationTarget": self.metadata.metadata['gce_instance_group']['scaling']['cpuUtilizationTarget']
+                  "utilizationTarget": self.metadata.scaling.cpuUtilizationTarget
                 },
-                "customMetricUtilizations": [x for x in self.metadata.metadata['gce_instance_group']['scaling']['customMetricUtilizations']],
+                "customMetricUtilizations": list(self.metadata.scaling.customMetricUtilizations),
 
-                "maxNumReplicas": self.metadata.metadata['gce_instance_group']['scaling']['maxNumReplicas'],
-                "minNumReplicas": self.metadata.metadata['gce_instance_group']['scaling']['minNumReplicas'],
-                "mode": self.metadata.metadata['gce_instance_group']['scaling']['mode']
+                "maxNumReplicas": self.metadata.scaling.maxNumReplicas,
+                "minNumReplicas": self.metadata.scaling.minNumReplicas,
+                "mode": self.metadata.scaling.mode
               }
         }
+        scaling = self.metadata.metadata['gce_instance_group']['scaling']
+        if scaling.get('predictiveMethod'):
+            body['autoscalingPolicy']['cpuUtilization']['predictiveMethod'] = scaling['predictiveMethod']
+        if scaling.get('scaleInControl'):
+            body['autoscalingPolicy']['scaleInControl'] = scaling['scaleInControl']
+        if scaling.get('scalingSchedules'):
+            body['autoscalingPolicy']['scalingSchedules'] = {
+                name: dict(schedule) for name, schedule in scaling['scalingSchedules'].items()}
+        if self.warmup_capacity > self.metadata.scaling.minNumReplicas:
+            # Autoscaler floor of live capacity during warm-up window, after window autoscaler
+            # returns to metadata policy. Cron has no year, ended schedule is removed by next deploy or gc
+            start = datetime.now(tz=timezone.utc)
+            body['autoscalingPolicy'].setdefault('scalingSchedules', {}).update({
+                f"warmup-{self.version}": {
+                    "minRequiredReplicas": self.warmup_capacity,
+                    "schedule": f"{start.minute} {start.hour} {start.day} {start.month} *",
+                    "timeZone": "UTC",
+                    # GCP minimal scaling schedule duration is 300 seconds
+                    "durationSec": max(scaling.get('warmupWindowSec', 900), 300),
+                    "description": f"Warm-up of {self.service_name} version {self.version} at live capacity"
+                }
+            })
 
         self.definitions.update({'autoscaler': body})
         return body
@@ -276,7 +578,7 @@ class Release:
     def ip_addresses(self) -> dict:
         body = {"name": "",
                 "subnetwork": self.metadata.subnetwork,
-                "addressType": self.metadata.metadata['load_balancer']['loadBalancingScheme']}
+                "addressType": self.metadata.load_balancer.loadBalancingScheme}
         addresses = []
         for instance in self.service_instances:
             address_body = body.copy()
@@ -286,23 +588,66 @@ class Release:
         self.definitions.update({'addresses': addresses})
         return addresses
 
+    def pool_addresses(self, count: int) -> List:
+        """
+        Body of new addresses of service address pool
+        """
+        existing = {x['name'] for x in self.gcp.address_pool}
+        addresses = []
+        index = 0
+        while len(addresses) < count:
+            address_name = f"{self.service_name}-pool-{index:02d}"
+            if address_name not in existing:
+                addresses.append({
+                    "name": address_name,
+                    "subnetwork": self.metadata.subnetwork,
+                    "addressType": self.metadata.load_balancer.loadBalancingScheme,
+                    "labels": {"address-pool": self.service_name},
+                })
+            index += 1
+        return addresses
+
+    def claim_addresses(self):
+        """
+        Claiming free ( RESERVED ) addresses of service pool for forwarding rules,
+        missing addresses are added to the pool. Address returns to the pool when
+        forwarding rule which uses it is deleted
+        """
+        free = sorted([x for x in self.gcp.address_pool if x['status'] == 'RESERVED'], key=lambda x: x['name'])
+        missing = len(self.service_instances) - len(free)
+        if missing > 0:
+            self.logger.colored("Address pool of {} has {} free addresses, adding {} addresses".format(
+                self.service_name, len(free), missing), 'Cyan')
+            self.gcp.insert_address(self.pool_addresses(missing))
+            self.gcp.listAddresses(refresh=True)
+            free = sorted([x for x in self.gcp.address_pool if x['status'] == 'RESERVED'], key=lambda x: x['name'])
+        claimed = []
+        for instance, address in zip(self.service_instances, free):
+            forwarding_rule_name = f"{self.service_name}-{instance['name']}-{self.version}"
+            self.claimed_addresses[forwarding_rule_name] = address['address']
+            claimed.append({"name": address['name'], "address": address['address'],
+                            "forwarding_rule": forwarding_rule_name})
+        self.logger.colored("Claimed addresses of pool: \n- %s", 'Cyan', None, lazy_lines(claimed))
+        self.definitions.update({'addresses': claimed})
+        return claimed
+
     def region_backend_service(self):
         body = {
             "kind": "compute#backendService",
-            "loadBalancingScheme": self.metadata.metadata['load_balancer']['loadBalancingScheme'],
+            "loadBalancingScheme": self.metadata.load_balancer.loadBalancingScheme,
             "name": f"{self.service_name_with_version}",
-            "protocol": self.metadata.metadata['load_balancer']['protocol'],
-            "sessionAffinity": self.metadata.metadata['load_balancer']['sessionAffinity'],
-            "timeoutSec": self.metadata.metadata['load_balancer']['timeoutSec'],
+            "protocol": self.metadata.load_balancer.protocol,
+            "sessionAffinity": self.metadata.load_balancer.sessionAffinity,
+            "timeoutSec": self.metadata.load_balancer.timeoutSec,
               "backends": [
                 {
-                  "balancingMode": self.metadata.metadata['load_balancer']['balancingMode'],
+                  "balancingMode": self.metadata.load_balancer.balancingMode,
                   "group": f"https://www.googleapis.com/compute/v1/projects/{self.metadata.gcp_project}/regions/{self.metadata.gcp_region}/instanceGroups/{self.instance_group_name}",
-                    # "maxConnectionsPerInstance": self.metadata.metadata['load_balancer']['maxConnectionsPerInstance'],
+                    # "maxConnectionsPerInstance": self.metadata.load_balancer.maxConnectionsPerInstance,
                 }
               ],
               "connectionDraining": {
-                "drainingTimeoutSec": self.metadata.metadata['load_balancer']['drainingTimeoutSec']
+                "drainingTimeoutSec": self.metadata.load_balancer.drainingTimeoutSec
               },
               "description": "",
               "healthChecks": [
@@ -314,13 +659,13 @@ class Release:
         for instance in self.service_instances:
             backend_body = body.copy()
             backend_name = f"{self.service_name}-{instance['name']}-{self.version}"
-            backend_healthcheck = f"https://www.googleapis.com/compute/v1/projects/{self.metadata.gcp_project}/regions/{self.metadata.gcp_region}/healthChecks/{instance['healthcheck']}"
+            backend_healthcheck = self.health_check_url(instance)
 
             backend_body.update({"name": backend_name})
             backend_body['healthChecks'] = [backend_healthcheck]
 
             backends.append(backend_body)
-        self.logger.logger.debug("Backend Service's body collection: %s", json.dumps(backends, indent=4))
+        self.logger.logger.debug("Backend Service's body collection: %s", lazy_json(backends))
         self.definitions.update({'backends': body})
         # yield backends
         return backends
@@ -333,7 +678,7 @@ class Release:
           "IPProtocol": "TCP",
           "backendService": "",
           "description": f"",
-          "loadBalancingScheme": self.metadata.metadata['load_balancer']['loadBalancingScheme'],
+          "loadBalancingScheme": self.metadata.load_balancer.loadBalancingScheme,
           "network": self.metadata.network,
           "networkTier": "PREMIUM",
           "ports": [
@@ -349,7 +694,10 @@ class Release:
             forwarding_rule_name = f"{self.service_name}-{instance['name']}-{self.version}"
             backend_url = f"https://www.googleapis.com/compute/v1/projects/{self.metadata.gcp_project}/regions/{self.metadata.gcp_region}/backendServices/{self.service_name}-{instance['name']}-{self.version}"
 
-            forwarding_ip = self.gcp.getAddresses(forwarding_rule_name)['address']
+            if self.use_address_pool:
+                forwarding_ip = self.claimed_addresses[forwarding_rule_name]
+            else:
+                forwarding_ip = self.gcp.getAddresses(forwarding_rule_name)['address']
 
             forwarding_rule_body.update({"name": forwarding_rule_name})
             forwarding_rule_body.update({"backendService": backend_url})
@@ -359,70 +707,263 @@ class Release:
             forwarding_rules.append(forwarding_rule_body)
             # self.logger.logger.debug("Forwarding rule body of instance: %s\n%s", instance, forwarding_rule_body)
 
-        self.logger.logger.debug("Forwarding Rule's body collection: %s", json.dumps(forwarding_rules, indent=4))
+        self.logger.logger.debug("Forwarding Rule's body collection: %s", lazy_json(forwarding_rules))
 
         self.definitions.update({'forwarding_rules': forwarding_rules})
         return forwarding_rules
 
     def delete(self):
+        with tracer.run('delete', self.logger, service=self.service_name, version=self.version,
+                        region=self.metadata.gcp_region) as run:
+            resources = {x: self.release_resources(x) for x in self.gcp.gcp_resources}
+            try:
+                self._delete()
+            except (Exception, SystemExit) as exc:
+                self.record_history(run, 'delete', 'FAILED', resources, str(exc))
+                raise
+            self.record_history(run, 'delete', 'DONE', resources)
+
+    def record_history(self, run, operation: str, status: str, resources: Dict[str, List[str]], error: str = ''):
+        """
+        Release operation with durations of its steps saved to history, history errors ( opening
+        of store included ) do not fail operation
+        """
+        steps = [{'name': x.name, 'started': x.start, 'duration': x.duration, 'outcome': x.args.get('outcome')}
+                 for x in tracer.trace_spans(run) if x.category == STEP and x.parent == run.id]
+        try:
+            self.history.record(
+                self.service_name, self.version, self.metadata.gcp_project, self.metadata.gcp_region, operation,
+                status, run.start, time.time(), previous_version=self.definitions['metadata']['previous_version'],
+                error=error, definitions=self.definitions if operation == 'deploy' else None, steps=steps,
+                resources={k: v for k, v in resources.items() if v})
+        except sqlite3.Error as exc:
+            self.logger.colored(f"Failed saving {operation} to history {self.history_file}: {exc}", 'Red', 'error')
+
+    def release_resources(self, resource: str) -> List[str]:
+        """
+        Names of listed GCP resources of release version
+        """
+        return [x['name'] for x in self.gcp.gcp_resources[resource] if self.version in x['name']]
+
+    def _delete(self):
         self.logger.logger.info("======= Deleting %s version: %s =======", self.service_name, self.version)
         # Deleting forwarding-rules
-        rules = [x['name'] for x in self.gcp.gcp_resources['forwardingRules'] if self.version in x['name']]
+        rules = self.release_resources('forwardingRules')
         if not rules:
             self.logger.logger.info("Delete forwarding rule of deployment version %s: [ SKIP ]", self.version)
         else:
-            self.gcp.delete_forwarding_rules(rules)
+            with self.step("Delete forwarding rule"):
+                self.gcp.delete_forwarding_rules(rules)
 
         # Delete ip addresses
-        addresses = [x['name'] for x in self.gcp.gcp_resources['addresses'] if self.version in x['name']]
+        addresses = self.release_resources('addresses')
         if not addresses:
             self.logger.logger.info("Delete addresses of deployment version %s: [ SKIP ]", self.version)
         else:
-            self.gcp.delete_address(addresses)
+            with self.step("Delete addresses"):
+                self.gcp.delete_address(addresses)
+        # Pool addresses are released by deleting forwarding rules
+        pool = [x['name'] for x in self.gcp.address_pool
+                if [user for user in x['users'] if user.split('/')[-1] in rules]]
+        if pool:
+            self.logger.colored("Addresses returned to address pool: \n- %s", 'Cyan', None, lazy_lines(pool))
 
         # Deleting backend-services
-        backends = [x['name'] for x in self.gcp.gcp_resources['regionBackendServices'] if self.version in x['name']]
+        backends = self.release_resources('regionBackendServices')
         if not backends:
             self.logger.logger.info("Delete backend services of deployment version %s: [ SKIP ]", self.version)
         else:
-            self.gcp.delete_backend_services(backends)
+            with self.step("Delete backend services"):
+                self.gcp.delete_backend_services(backends)
 
         # Deleting regional autoscaler
-        autoscalers = [x['name'] for x in self.gcp.gcp_resources['autoscalers'] if self.version in x['name']]
+        autoscalers = self.release_resources('autoscalers')
         if not autoscalers:
             self.logger.logger.info("Delete autoscaler of deployment version %s: [ SKIP ]", self.version)
         else:
-            self.gcp.delete_region_autoscaler(''.join(autoscalers))
+            with self.step("Delete autoscaler"):
+                self.gcp.delete_region_autoscaler(''.join(autoscalers))
 
         # Deleting instance group
-        instance_group = [x['name'] for x in self.gcp.gcp_resources['regionInstanceGroupManagers'] if self.version in x['name']]
+        instance_group = self.release_resources('regionInstanceGroupManagers')
         if not instance_group:
             self.logger.logger.info("Delete instance group of deployment version %s: [ SKIP ]", self.version)
         else:
-            self.gcp.delete_region_instance_group(''.join(instance_group))
+            with self.step("Delete instance group"):
+                self.gcp.delete_region_instance_group(''.join(instance_group))
+
+        # Deleting release health checks
+        health_checks = self.release_resources('regionHealthChecks')
+        if not health_checks:
+            self.logger.logger.info("Delete health checks of deployment version %s: [ SKIP ]", self.version)
+        else:
+            with self.step("Delete health checks"):
+                self.gcp.delete_region_health_checks(health_checks)
 
         # Deleting instance template
-        templates = [x['name'] for x in self.gcp.gcp_resources['instanceTemplates'] if self.version in x['name']]
+        templates = self.release_resources('instanceTemplates')
         if not templates:
             self.logger.logger.info("Delete instance template of deployment version %s: [ SKIP ]", self.version)
         else:
-            self.gcp.delete_instance_template(''.join(templates))
+            with self.step("Delete instance template"):
+                self.gcp.delete_instance_template(''.join(templates))
+
+        # Deleting resource policies
+        policies = self.release_resources('resourcePolicies')
+        if not policies:
+            self.logger.logger.info("Delete resource policies of deployment version %s: [ SKIP ]", self.version)
+        else:
+            with self.step("Delete resource policies"):
+                self.gcp.delete_resource_policies(policies)
 
         # Delete disk images
-        images = [x['name'] for x in self.gcp.gcp_resources['images'] if self.version in x['name']]
+        images = self.release_resources('images')
         if not images:
             self.logger.logger.info("Delete disk images of deployment version %s: [ SKIP ]", self.version)
         else:
-            self.gcp.delete_disk_images(images)
+            with self.step("Delete images"):
+                self.gcp.delete_disk_images(images)
+
+    def standby(self):
+        """
+        Keeping release as warm standby: autoscaler deleted, instance group resized
+        to standby size and its instances suspended or stopped
+        """
+        params = self.metadata.metadata['gce_instance_group'].get('standby') or {}
+        mode = params.get('mode', 'suspend')
+        size = params.get('size', 1)
+        self.logger.logger.info("======= Standby %s version: %s ( %s instances, %s ) =======",
+                                self.service_name, self.version, size, mode)
+        if [x for x in self.gcp.gcp_resources['autoscalers'] if x['name'] == self.autoscaler_name]:
+            self.gcp.delete_region_autoscaler(self.autoscaler_name)
+        instance_group = self.gcp.getRegionInstanceGroupManager(self.instance_group_name)
+        if instance_group is None:
+            self.logger.colored("Instance group {} not found".format(self.instance_group_name), 'Red', 'error')
+            exit(3)
+        if instance_group['targetSize'] > size:
+            self.gcp.resizeRegionInstanceGroupManagers(group_name=self.instance_group_name, group_size=size)
+            self.gcp.wait_for_instance_group_to_stable(self.instance_group_name)
+        instances = [x['instance'] for x in self.gcp.listManagedInstances(self.instance_group_name)
+                     if x.get('instanceStatus') == 'RUNNING']
+        if instances:
+            self.gcp.suspendRegionInstanceGroupInstances(self.instance_group_name, instances, mode)
+
+    def scale_up(self):
+        """
+        Resuming standby instances of release and recreating autoscaler
+        """
+        managed_instances = self.gcp.listManagedInstances(self.instance_group_name)
+        suspended = [x['instance'] for x in managed_instances if x.get('instanceStatus') in ('SUSPENDED', 'SUSPENDING')]
+        stopped = [x['instance'] for x in managed_instances if x.get('instanceStatus') in ('TERMINATED', 'STOPPING')]
+        # Standby instances resumed before autoscaler, otherwise autoscaler creates new instances from image
+        if suspended:
+            self.gcp.resumeRegionInstanceGroupInstances(self.instance_group_name, suspended, 'suspend')
+        if stopped:
+            self.gcp.resumeRegionInstanceGroupInstances(self.instance_group_name, stopped, 'stop')
+        if not [x for x in self.gcp.gcp_resources['autoscalers'] if x['name'] == self.autoscaler_name]:
+            self.gcp.insert_region_autoscaler(self.region_autoscaler())
+
+    def rollback(self):
+        self.logger.logger.info("======= Rollback %s to version: %s =======", self.service_name, self.version)
+        start_time = time.time()
+        self.scale_up()
+        self.logger.colored("Release {} version {} is running, rollback interval: {}s".format(
+            self.service_name, self.version, round(time.time() - start_time)), 'Green')
+
+    def insert_instance_group(self):
+        """
+        Creating instance group, stockout errors during stabilization switch
+        to the next fallback instead of waiting stabilization timeout
+        """
+        try:
+            self.gcp.insert_region_instance_group_managed(
+                self.region_instance_group_manager(), boot_timeline=self.boot_timeline,
+                raise_on_capacity=True)
+        except InstanceGroupCapacityError as exc:
+            self.capacity_fallback(exc)
+
+    def capacity_fallback(self, exc: InstanceGroupCapacityError):
+        """
+        Fallbacks of instance group without capacity:
+        - compact placement: instance group recreated with spread across zones
+        - distribution policy: target shape changed to stockoutFallback.targetShape
+        """
+        self.logger.colored("Instance group {} has no capacity: \n{}".format(
+            self.instance_group_name, exc), 'Red', 'error')
+        fallback_shape = (self.metadata.metadata['gce_instance_group'].get('stockoutFallback') or {}).get('targetShape')
+        current_shape = self.definitions['instance_group_managed']['distributionPolicy']['targetShape']
+        try:
+            if self.use_placement and self.placement.get('fallbackToSpread', True):
+                self.logger.colored("Compact placement is not available, fallback to spread instance group", 'Yellow')
+                self.gcp.delete_region_instance_group(self.instance_group_name)
+                self.gcp.delete_instance_template(self.instance_template_name)
+                self.use_placement = False
+                if self.boot_timeline:
+                    self.boot_timeline = BootTimeline(self.service_name, self.version, self.logger)
+                self.gcp.insert_instance_template(self.instance_template())
+                self.gcp.insert_region_instance_group_managed(
+                    self.region_instance_group_manager(), boot_timeline=self.boot_timeline,
+                    raise_on_capacity=True)
+            elif fallback_shape and fallback_shape != current_shape:
+                self.logger.colored("Fallback of instance group {} distribution target shape: {} -> {}".format(
+                    self.instance_group_name, current_shape, fallback_shape), 'Yellow')
+                redistribution = redistribution_type(fallback_shape)
+                self.gcp.patch_region_instance_group_manager(self.instance_group_name, {
+                    "distributionPolicy": {"targetShape": fallback_shape},
+                    "updatePolicy": {"instanceRedistributionType": redistribution}})
+                self.definitions['instance_group_managed']['distributionPolicy']['targetShape'] = fallback_shape
+                self.definitions['instance_group_managed']['updatePolicy']['instanceRedistributionType'] = redistribution
+                self.gcp.wait_for_instance_group_to_stable(
+                    self.instance_group_name, boot_timeline=self.boot_timeline, raise_on_capacity=True)
+            else:
+                self.logger.colored("No capacity fallback left for instance group {}".format(
+                    self.instance_group_name), 'Red', 'error')
+                exit(3)
+        except InstanceGroupCapacityError as next_exc:
+            self.capacity_fallback(next_exc)
+
+    def step(self, name: str):
+        """
+        Span of release step in process trace
+        """
+        return tracer.span(name, STEP, service=self.service_name, version=self.version)
 
     def deploy(self):
+        with tracer.run('deploy', self.logger, service=self.service_name, version=self.version,
+                        region=self.metadata.gcp_region) as run:
+            try:
+                self._deploy()
+            except (Exception, SystemExit) as exc:
+                self.record_history(run, 'deploy', 'FAILED', self.deployed_resources(), str(exc))
+                raise
+            self.record_history(run, 'deploy', 'DONE', self.deployed_resources())
+
+    @property
+    def history(self) -> DeployHistory:
+        if self._history is None:
+            self._history = DeployHistory.from_metadata(self.metadata, self.logger)
+        return self._history
+
+    def deployed_resources(self) -> Dict[str, List[str]]:
+        resources = result_resources(self.definitions)
+        if resources.get('regionInstanceGroupManagers'):
+            # Instance template body is not kept in definitions
+            resources['instanceTemplates'] = [self.instance_template_name]
+        return resources
+
+    def _deploy(self):
         self.logger.logger.info("======= Deploy service: %s version: %s =======", self.service_name, self.version)
         # Creating disk images
-        self.gcp.insert_disk_images(self.disk_images())
+        with self.step("Create image"):
+            self.gcp.insert_disk_images(self.disk_images())
         #
         # Creating instance template
         # instance_template_target = self.gcp.insert_instance_template(self.instance_template())
-        self.gcp.insert_instance_template(self.instance_template())
+        if self.use_placement:
+            with self.step("Create placement policy"):
+                self.gcp.insert_resource_policy(self.resource_policy())
+        with self.step("Create Instance Template"):
+            self.gcp.insert_instance_template(self.instance_template())
         # if instance_template_target:
         #     self.instance_template_body.update({'targetLink': instance_template_target})
         # self.logger.logger.debug("Final instance template body: \n%s", self.instance_group_body)
@@ -437,26 +978,51 @@ class Release:
         #     self.region_instance_group_manager(
         #         self.instance_group_body.get('targetLink'), self.instance_template_body.get('targetLink'))
         # )
-        self.gcp.insert_region_instance_group_managed(self.region_instance_group_manager())
+        # Creating or updating health checks of release
+        health_checks = self.region_health_check()
+        if health_checks:
+            with self.step("Create health checks"):
+                self.gcp.insert_region_health_checks(health_checks)
+
+        with self.step("Create Instance Group"):
+            self.insert_instance_group()
+        if self.boot_timeline:
+            with self.step("Collect boot timeline"):
+                self.gcp.collect_boot_timeline(self.instance_group_name, self.boot_timeline)
+        if self.boot_history is not None and self.boot_timeline:
+            samples = self.boot_history.add(self.service_name, self.version, self.boot_timeline)
+            self.boot_history.save()
+            self.logger.colored("Saved {} measured boot times to {}".format(
+                samples, self.boot_history.filename), 'Cyan')
 
         # Creating autoscaler of managed instance group
         # self.region_autoscaler()
-        self.gcp.insert_region_autoscaler(self.region_autoscaler())
+        with self.step("Create autoscaler"):
+            self.gcp.insert_region_autoscaler(self.region_autoscaler())
 
         # Creating backend services
         # self.region_backend_service()
-        self.gcp.insert_region_backend_service(self.region_backend_service())
+        with self.step("Create Backend services"):
+            self.gcp.insert_region_backend_service(self.region_backend_service())
 
         # Create addresses of internal load balancer per service instance
-        self.gcp.insert_address(self.ip_addresses())
+        # or claim free addresses of service address pool
+        with self.step("Create IPAddresses"):
+            if self.use_address_pool:
+                self.claim_addresses()
+            else:
+                self.gcp.insert_address(self.ip_addresses())
         # Creating forwarding-rules of backend services with
         # creating addresses
         # self.forwarding_rule()
-        self.gcp.insert_forwarding_rules(self.forwarding_rule())
+        with self.step("Creating forwarding rule"):
+            self.gcp.insert_forwarding_rules(self.forwarding_rule())
 
         self.logger.logger.info("Health checking GCE load balancers")
-        http_healthcheck(
-            self.definitions.get('forwarding_rules'), self.service_healthcheck_endpoint)
+        with self.step("Health check"):
+            http_healthcheck(
+                self.definitions.get('forwarding_rules'), self.service_healthcheck_endpoint,
+                {f"{self.service_name}-{x['name']}-{self.version}": x['name'] for x in self.service_instances})
 
         #  ============ Collecting deploy resources =========================
         end_deploy_time = datetime.now().strftime('%Y-%m-%d-%H-%M')
@@ -464,11 +1030,32 @@ class Release:
         self.logger.colored("Deploy service: {} version: {} finished at {}".format(
             self.service_name, self.version, end_deploy_time))
         self.definitions['metadata']['end_deploy'] = end_deploy_time
-        self.logger.colored("Previous release version: {}".format(self.gcp.gcp_resources_version['regionInstanceGroupManagers'][-1]), 'Cyan')
-        self.definitions['metadata']['previous_version'] = self.gcp.gcp_resources_version['regionInstanceGroupManagers'][-1]
-        self.drop_to_file(filename=deploy_result_file)
-        self.logger.colored("Saved deployment results to file: {}".format(
-            deploy_result_file), 'Green')
+        # Latest successful deploy of history which instance group exists, first release of service
+        # has no previous version, services without history fall back to newest created instance group
+        existing = [x for x in self.gcp.gcp_resources_version.get('regionInstanceGroupManagers') or []
+                    if x != self.version]
+        created = sorted(self.gcp.gcp_resources.get('regionInstanceGroupManagers') or [],
+                         key=lambda x: parse_timestamp(x['deployed']) or 0, reverse=True)
+        newest = [x['name'][len(self.service_name) + 1:] for x in created]
+        try:
+            previous_version = self.history.previous_version(
+                self.service_name, self.metadata.gcp_project, self.metadata.gcp_region, self.version, existing)
+        except sqlite3.Error as exc:
+            self.logger.colored(f"Failed reading previous version from history {self.history_file}: {exc}",
+                                'Red', 'error')
+            previous_version = None
+        previous_version = previous_version or next((x for x in newest if x in existing), None)
+        self.logger.colored("Previous release version: {}".format(previous_version), 'Cyan')
+        self.definitions['metadata']['previous_version'] = previous_version
+        if self.export_json:
+            self.drop_to_file(filename=deploy_result_file)
+            self.logger.colored("Saved deployment results to file: {}".format(
+                deploy_result_file), 'Green')
+        if self.boot_timeline:
+            boot_timeline_file = f"{self.service_name}_{self.version}_{end_deploy_time}_boot_timeline.json"
+            self.boot_timeline.summary()
+            self.boot_timeline.drop_to_file(boot_timeline_file)
+            self.logger.colored("Saved boot timeline to file: {}".format(boot_timeline_file), 'Green')
 
     def drop_to_file(self, filename: str):
         with open(filename, 'w') as file:
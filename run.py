@@ -1,11 +1,24 @@
 #!python3
-import json
+import atexit
+import os
+import sys
+import time
 import argparse
-from _logger import DeployLogger
+from _logger import DeployLogger, lazy_json, set_color
 from metadata import DeploymentMetadata
 from providers.gke import GKE
 from providers.gcp import GCP
 from release import Release
+from teardown import TeardownQueue, drain
+import operations
+from preflight import Preflight
+from tracing import tracer
+from metrics import MetricsExporter
+from events import EventStream
+from profiling import Profiler
+from matrix import Matrix, MATRIX_LOG_FORMAT, load_targets
+from daemon import Daemon, parse_listen
+from history import DeployHistory, find_result_files
 
 
 # Link on documentation in confluence
@@ -20,8 +33,8 @@ arg_parser = argparse.ArgumentParser(
     epilog="For questions and suggestions, contact the DevOps team.",
     formatter_class=argparse.RawTextHelpFormatter,
 )
-arg_parser.add_argument('--metadata', action='store', required=True,
-                        type=str, help='file with deploy metadata')
+arg_parser.add_argument('--metadata', action='store',
+                        type=str, help='file with deploy metadata ( required by all operations except matrix and daemon )')
 arg_parser.add_argument('--gcp-token', action='store', required=True,
                         type=str, help='GCP token json file')
 arg_parser.add_argument('--service', action='store', type=str,
@@ -31,24 +44,139 @@ arg_parser.add_argument('--version', action='store', type=str,
 arg_parser.add_argument('--operation', action='store', required=True,
                         type=str, help='command invoke',
                         choices=['overview', 'current_version', 'deploy',
-                                 'delete', 'delete_previous', 'scale_down', 'scale_up'])
+                                 'delete', 'delete_previous', 'scale_down', 'scale_up', 'standby', 'rollback',
+                                 'gc', 'cutover', 'wait_version', 'matrix', 'preflight', 'daemon', 'history'])
+arg_parser.add_argument('--boot-timeline', action='store_true',
+                        help='Record boot timeline of new instances on deploy \nand save per phase timing breakdown')
+arg_parser.add_argument('--skip-preflight', action='store_true',
+                        help='deploy: do not run preflight checks before creating resources')
+arg_parser.add_argument('--defer', action='store_true',
+                        help='delete_previous: record previous releases for deferred teardown')
+arg_parser.add_argument('--drain', action='store_true',
+                        help='gc: delete recorded releases which grace period is expired')
+arg_parser.add_argument('--import-json', action='store', type=str, nargs='*',
+                        help='history: import deploy result json files \n( default: <service>_<version>_<time>.json files of working directory )')
+arg_parser.add_argument('--rollback', action='store_true',
+                        help='cutover: move ingresses back to version before last cutover')
+arg_parser.add_argument('--timeout', action='store', type=int, default=600,
+                        help='wait_version: seconds to wait ingresses report version')
+arg_parser.add_argument('--trace', action='store', type=str,
+                        help='file to save spans of API calls, operation waits and steps \n( Trace Event Format, chrome://tracing or ui.perfetto.dev )')
+arg_parser.add_argument('--metrics', action='store', type=str,
+                        help='file to save Prometheus metrics of run \n( node-exporter textfile collector, example: /var/lib/node_exporter/deploy_my-app.prom )')
+arg_parser.add_argument('--events', action='store', type=str, choices=['ndjson'],
+                        help='write progress events ( steps, operation status, stabilization polls, health checks ) \n'
+                             'one JSON per line to stdout or --events-file, other output of script goes to stderr')
+arg_parser.add_argument('--events-file', action='store', type=str,
+                        help='file ( or named pipe ) of --events stream instead of stdout')
+arg_parser.add_argument('--profile', action='store', type=str, nargs='?', const='',
+                        help='run operation under CPU profiler and save <prefix>.prof, <prefix>.collapsed \n'
+                             'and <prefix>.cpu.collapsed files ( default prefix: profile_<operation>_<time> )')
+arg_parser.add_argument('--targets', action='store', type=str,
+                        help='matrix: yaml file with list of service, metadata, version, operation targets')
+arg_parser.add_argument('--max-parallel', action='store', type=int, default=4,
+                        help='matrix, daemon: targets ( jobs ) running concurrently')
+arg_parser.add_argument('--max-per-service', action='store', type=int, default=1,
+                        help='daemon: jobs of one service in project and region running concurrently')
+arg_parser.add_argument('--listen', action='store', type=str, default='127.0.0.1:8470',
+                        help='daemon: address and port of HTTP API')
+arg_parser.add_argument('--api-token', action='store', type=str, default=os.environ.get('DEPLOY_DAEMON_TOKEN'),
+                        help='daemon: token required from clients of HTTP API ( default: DEPLOY_DAEMON_TOKEN )')
+arg_parser.add_argument('--max-per-region', action='store', type=int, default=2,
+                        help='matrix: targets running concurrently in one region')
+arg_parser.add_argument('--rate-limit', action='store', type=float, default=0,
+                        help='matrix, daemon: GCP API calls per second of all targets, 0 - unlimited')
+arg_parser.add_argument('--inventory-ttl', action='store', type=int, default=300,
+                        help='matrix, daemon: seconds GCP list responses are shared between targets')
 arg_parser.add_argument('--log-lvl', default='INFO', type=str, choices=['INFO', 'WARN', 'DEBUG'])
+arg_parser.add_argument('--log-color', default='auto', type=str, choices=['auto', 'always', 'never'],
+                        help='colored messages, auto: when stderr is terminal and NO_COLOR is not set')
 args = arg_parser.parse_args()
 
 
 if __name__ == "__main__":
+    set_color(args.log_color)
+    if args.profile is not None:
+        prefix = args.profile or f"profile_{args.operation}_{time.strftime('%Y-%m-%d-%H-%M-%S')}"
+        profiler = Profiler(prefix, DeployLogger(loglvl=args.log_lvl, name='profile'))
+        profiler.start()
+        # Profile is saved on any exit of operation, failed runs included
+        atexit.register(profiler.stop)
+
+    if args.events:
+        if args.events_file:
+            events_stream = open(args.events_file, 'a', buffering=1)
+        else:
+            # stdout carries events only, prints of script ( overview, health checks ) go to stderr
+            events_stream, sys.stdout = sys.stdout, sys.stderr
+        EventStream(tracer, events_stream, {
+            'service': args.service, 'version': args.version, 'operation': args.operation}).start()
+
+    if args.trace:
+        # Trace is saved on any exit of operation, failed runs included
+        atexit.register(tracer.drop_to_file, args.trace)
+
+    if args.operation == "matrix":
+        logger = DeployLogger(loglvl=args.log_lvl, name='matrix', fmt=MATRIX_LOG_FORMAT)
+        if not args.targets:
+            logger.colored('Matrix requires --targets file', 'Red', 'error')
+            exit(3)
+        if args.metrics:
+            atexit.register(MetricsExporter(tracer, {'operation': 'matrix'}).drop_to_file, args.metrics)
+        results = Matrix(
+            targets=load_targets(args.targets, logger),
+            gcp_token=args.gcp_token,
+            logger=logger,
+            max_parallel=args.max_parallel,
+            max_per_region=args.max_per_region,
+            rate_limit=args.rate_limit,
+            inventory_ttl=args.inventory_ttl,
+            boot_timeline=args.boot_timeline).run()
+        exit(3 if [x for x in results if x['status'] != 'DONE'] else 0)
+
+    if args.operation == "daemon":
+        logger = DeployLogger(loglvl=args.log_lvl, name='daemon', fmt=MATRIX_LOG_FORMAT)
+        host, port = parse_listen(args.listen)
+        if not args.api_token:
+            logger.colored('Operation daemon requires --api-token or DEPLOY_DAEMON_TOKEN', 'Red', 'error')
+            exit(3)
+        Daemon(
+            gcp_token=args.gcp_token,
+            logger=logger,
+            api_token=args.api_token,
+            max_parallel=args.max_parallel,
+            max_per_service=args.max_per_service,
+            rate_limit=args.rate_limit,
+            inventory_ttl=args.inventory_ttl).serve(host, port)
+        exit(0)
+
     logger = DeployLogger(loglvl=args.log_lvl, name='run.py')
-    metadata = DeploymentMetadata(metadata_file=args.metadata, logger=logger)
+    if not args.metadata:
+        logger.colored(f'Operation {args.operation} requires --metadata file', 'Red', 'error')
+        exit(3)
+    metadata = DeploymentMetadata.load(args.metadata, logger)
+    if args.metrics:
+        # Metrics are saved on any exit of operation, failed runs included
+        atexit.register(MetricsExporter(tracer, {
+            'service': args.service, 'version': (args.version or '').replace('.', '-').lower(),
+            'region': metadata.gcp_region, 'operation': args.operation}).drop_to_file, args.metrics)
 
-    logger.colored(
-        f'Script running with the following arguments: \n{json.dumps(args.__dict__, indent=4)}',
-        'Light_Purple', 'info')
+    logger.colored('Script running with the following arguments: \n%s', 'Light_Purple', 'info', lazy_json(args.__dict__))
 
-    logger.logger.info(
-        """\x1b[34;1mStart Blue - Green deployment services: %s, version: %s to GCP. 
-        More information about process you can find in documentation:\n%s\x1b[0m""",
+    logger.colored(
+        """Start Blue - Green deployment services: %s, version: %s to GCP. 
+        More information about process you can find in documentation:\n%s""", 'Blue', 'info',
         args.service, args.version, DOCUMENTATION['general'])
 
+    if args.operation == "history":
+        history = DeployHistory.from_metadata(metadata, logger)
+        if args.import_json is not None:
+            imported = history.import_files(args.import_json or find_result_files(), metadata.gcp_project,
+                                            metadata.gcp_region)
+            logger.colored(f"Imported {imported} deploys to history {history.filename}", 'Green')
+        history.show(args.service, metadata.gcp_project, metadata.gcp_region)
+        exit(0)
+
     # Initialize GKE object
     gke = GKE(args.service, metadata, logger)
 
@@ -57,10 +185,25 @@ if __name__ == "__main__":
 
     if args.operation == "current_version":
         logger.colored(
-            f"The current deployed version of {args.service} in GCP project {metadata.gcp_project} is: {gke.current_version}",
+            f"The current deployed version of {args.service} in GCP project {metadata.gcp_project} is: "
+            f"{', '.join(sorted(gke.current_versions))}",
             'Cyan', 'info')
         exit(0)
 
+    if args.operation == "wait_version":
+        gke.wait_for_version(args.version, timeout=args.timeout)
+        exit(0)
+
+    if args.operation == "cutover":
+        if not args.rollback and not args.version:
+            logger.colored('Cutover requires --version or --rollback', 'Red', 'error')
+            exit(3)
+        if not args.rollback and args.version.replace('.', '-').lower() == gke.current_version:
+            logger.colored(f'Version {args.version} is already current', 'Cyan')
+            exit(0)
+        gke.cutover(version=args.version or '', rollback=args.rollback)
+        exit(0)
+
     # Initialize GCP object
     gcp = GCP(
         metadata=metadata,
@@ -74,38 +217,10 @@ if __name__ == "__main__":
         exit(0)
 
     if args.operation == "deploy":
-        logger.colored(
-            f"Receiving command on deploy service {args.service} version {args.version}", 'Cyan', 'info')
-
-        # Initialize Release object of release version
-        release = Release(service=args.service, version=args.version, metadata=metadata, logger=logger, gcp=gcp)
-        # Checking what release version not current
-        if release.version == gke.current_version:
-            logger.colored('Sorry, but this version: {} already deployed and is current ( in LoadBalancer )'.format(
-                         release.version), 'Red', 'error')
-            exit(3)
-        logger.colored('Discovering GCP project: {} in region: {}'.format(
-                    metadata.gcp_project, metadata.gcp_region), 'Cyan')
+        operations.deploy(args.service, args.version, metadata, logger, gcp, gke, boot_timeline=args.boot_timeline,
+                          preflight=not args.skip_preflight)
 
-        # Discovering GCP project
-        gcp.overview()
-        version_for_delete = set()
-        for versions in gcp.gcp_resources_version.values():
-            for version in versions:
-                if version != gke.current_version:
-                    version_for_delete.add(version)
-
-        if release.version in version_for_delete:
-            logger.logger.info(
-                'This deployment of %s version %s found in GCP project bun is not current',
-                release.service_name, release.version)
-            release.delete()
-
-        logger.colored('Start deploy service: {}, version {}'.format(
-            release.service_name, release.version), 'Cyan')
-        release.deploy()
-    #
-    if args.operation == "delete":
+    if args.operation == "preflight":
         gcp.overview()
         release = Release(
             service=args.service,
@@ -113,46 +228,23 @@ if __name__ == "__main__":
             metadata=metadata,
             logger=logger,
             gcp=gcp)
-        logger.logger.info(
-            'Delete deployment service: %s, version %s',
-            release.service_name, release.version)
-        release.delete()
+        release.prescale(gke.current_version)
+        Preflight(release, gcp, logger, current_version=gke.current_version).run()
+    #
+    if args.operation == "delete":
+        operations.delete(args.service, args.version, metadata, logger, gcp)
 
     #
     if args.operation == "delete_previous":
-        gcp.overview()
-        logger.colored(f"==== Find previous versions of {args.service} in GCP project {metadata.gcp_project} ====",
-                       'Cyan')
-        version_for_delete = set()
-        for versions in gcp.gcp_resources_version.values():
-            for version in versions:
-                if version != gke.current_version:
-                    version_for_delete.add(version)
-        logger.colored(f"Current working {args.service} version: {gke.current_version}", 'Cyan')
-        if version_for_delete:
-            logger.colored("Well be delete following {} releases versions: \n {}".format(
-                args.service, json.dumps(list(version_for_delete), indent=4)
-            ), 'Cyan')
+        operations.delete_previous(args.service, metadata, logger, gcp, gke, defer=args.defer)
 
-            releases_for_deleting = []
-            for version in version_for_delete:
-                releases_for_deleting.append(
-                    Release(
-                        service=args.service,
-                        version=version,
-                        metadata=metadata,
-                        logger=logger,
-                        gcp=gcp)
-                )
+    if args.operation == "scale_down":
+        operations.scale_down(args.service, args.version, metadata, logger, gcp)
 
-            for release in releases_for_deleting:
-                # logger.colored(f"Delete {args.service} version: {release.version}", 'Cyan')
-                release.delete()
-        else:
-            logger.colored(f'In GCP project {metadata.gcp_project} for service {args.service} '
-                           f'not found previous version for deleting', 'Cyan', 'info')
+    if args.operation == "scale_up":
+        operations.scale_up(args.service, args.version, metadata, logger, gcp)
 
-    if args.operation == "scale_down":
+    if args.operation == "standby":
         gcp.overview()
         release = Release(
             service=args.service,
@@ -160,14 +252,13 @@ if __name__ == "__main__":
             metadata=metadata,
             logger=logger,
             gcp=gcp)
-        logger.logger.info(
-            '==== Scale down deployment service: %s, version %s',
-            release.service_name, release.version)
-        gcp.delete_region_autoscaler(release.autoscaler_name)
-        gcp.resizeRegionInstanceGroupManagers(
-            group_name=release.instance_group_name, group_size=0)
+        if release.version in gke.current_versions:
+            logger.colored('Version: {} is current ( in LoadBalancer ) and can not be moved to standby'.format(
+                release.version), 'Red', 'error')
+            exit(3)
+        release.standby()
 
-    if args.operation == "scale_up":
+    if args.operation == "rollback":
         gcp.overview()
         release = Release(
             service=args.service,
@@ -175,8 +266,43 @@ if __name__ == "__main__":
             metadata=metadata,
             logger=logger,
             gcp=gcp)
-        logger.logger.info(
-            '==== Scale up deployment service: %s, version %s',
-            release.service_name, release.version)
-        gcp.insert_region_autoscaler(release.region_autoscaler())
+        release.rollback()
 
+    if args.operation == "gc":
+        teardown = metadata.metadata.get('teardown') or {}
+        queue = TeardownQueue(teardown.get('queueFile', 'teardown_queue.json'), logger)
+        entries = queue.entries(args.service, metadata.gcp_project, metadata.gcp_region)
+        due = queue.due(args.service, metadata.gcp_project, metadata.gcp_region)
+        logger.colored("Releases of {} recorded for teardown: {}, grace period expired: {}".format(
+            args.service, len(entries), len(due)), 'Cyan')
+        for entry in entries:
+            logger.logger.info("- %s recorded: %s", entry['version'], entry['recorded'])
+        if args.drain:
+            gcp.overview()
+            gcp.remove_expired_warmup_schedules()
+        if args.drain and due:
+            gke.require_current_versions()
+            releases_for_deleting = []
+            for entry in due:
+                if entry['version'] in gke.current_versions:
+                    logger.colored(f"Version {entry['version']} is current again, removed from teardown", 'Yellow')
+                    queue.remove(args.service, entry['version'], metadata.gcp_project, metadata.gcp_region)
+                    continue
+                if entry['version'] in gcp.standby_versions():
+                    logger.colored(f"Version {entry['version']} is standby, removed from teardown", 'Yellow')
+                    queue.remove(args.service, entry['version'], metadata.gcp_project, metadata.gcp_region)
+                    continue
+                releases_for_deleting.append(
+                    Release(
+                        service=args.service,
+                        version=entry['version'],
+                        metadata=metadata,
+                        logger=logger,
+                        gcp=gcp)
+                )
+            failed = drain(releases_for_deleting, teardown.get('concurrency', 4), logger)
+            for release in releases_for_deleting:
+                if release.version not in failed:
+                    queue.remove(args.service, release.version, metadata.gcp_project, metadata.gcp_region)
+            if failed:
+                exit(3)
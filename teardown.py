@@ -0,0 +1,99 @@
+import fcntl
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List
+
+
+class TeardownQueue:
+    """
+    Superseded releases recorded for deferred teardown with grace period,
+    queue file is shared between CI jobs and guarded by file lock
+    """
+    def __init__(self, filename: str, logger):
+        self.filename = filename
+        self.logger = logger
+
+    @contextmanager
+    def _locked(self):
+        with open(f"{self.filename}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self) -> List[Dict]:
+        if not os.path.exists(self.filename):
+            return []
+        with open(self.filename, 'r') as file:
+            return json.loads(file.read() or '[]')
+
+    def _save(self, entries: List[Dict]):
+        with open(self.filename, 'w') as file:
+            file.write(json.dumps(entries, indent=4))
+
+    def add(self, service: str, version: str, project: str, region: str, grace_period: int):
+        """
+        Queued version keeps its deadline, so frequent deploys do not postpone teardown
+        """
+        now = time.time()
+        with self._locked():
+            entries = self._load()
+            for entry in entries:
+                if (entry['service'] == service and entry['version'] == version and
+                        entry['project'] == project and entry['region'] == region):
+                    self.logger.colored("{} version {} already recorded for teardown after {}".format(
+                        service, version, datetime.fromtimestamp(entry['not_before'], tz=timezone.utc).isoformat()),
+                        'Cyan')
+                    return
+            entries.append({
+                'service': service,
+                'version': version,
+                'project': project,
+                'region': region,
+                'recorded': datetime.fromtimestamp(now, tz=timezone.utc).isoformat(),
+                'not_before': now + grace_period,
+            })
+            self._save(entries)
+        self.logger.colored("Recorded {} version {} for teardown after {}".format(
+            service, version, datetime.fromtimestamp(now + grace_period, tz=timezone.utc).isoformat()), 'Cyan')
+
+    def entries(self, service: str, project: str, region: str) -> List[Dict]:
+        with self._locked():
+            return [x for x in self._load()
+                    if x['service'] == service and x['project'] == project and x['region'] == region]
+
+    def due(self, service: str, project: str, region: str) -> List[Dict]:
+        now = time.time()
+        return [x for x in self.entries(service, project, region) if x['not_before'] <= now]
+
+    def remove(self, service: str, version: str, project: str, region: str):
+        with self._locked():
+            self._save([x for x in self._load() if not (
+                x['service'] == service and x['version'] == version and
+                x['project'] == project and x['region'] == region)])
+
+
+def drain(releases: list, concurrency: int, logger) -> Dict[str, str]:
+    """
+    Deleting releases concurrently, returns failed release versions with errors
+    """
+    failed = {}
+    logger.colored("Teardown of {} releases with concurrency {}".format(len(releases), concurrency), 'Cyan')
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(release.delete): release for release in releases}
+        for future in as_completed(futures):
+            release = futures[future]
+            try:
+                future.result()
+                logger.colored("Teardown of {} version {}: DONE".format(
+                    release.service_name, release.version), 'Green')
+            except (Exception, SystemExit) as exc:
+                failed[release.version] = str(exc)
+                logger.colored("Teardown of {} version {} failed: {}".format(
+                    release.service_name, release.version, exc), 'Red', 'error')
+    return failed
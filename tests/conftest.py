@@ -0,0 +1,24 @@
+import logging
+import os
+import sys
+import pytest
+
+# Modules of deploy tool are top-level modules of repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class RecordingLogger:
+    """
+    DeployLogger interface collecting colored messages
+    """
+    def __init__(self):
+        self.logger = logging.getLogger('tests')
+        self.messages = []
+
+    def colored(self, message, color=None, event_type=None, *args):
+        self.messages.append((message % args if args else message, color))
+
+
+@pytest.fixture
+def logger():
+    return RecordingLogger()
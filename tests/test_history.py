@@ -0,0 +1,121 @@
+import json
+import sqlite3
+import time
+import pytest
+from history import DeployHistory
+
+SERVICE = 'my-app'
+PROJECT = 'gcp-project-id'
+REGION = 'europe-west1'
+
+
+@pytest.fixture
+def history(tmp_path, logger):
+    return DeployHistory(str(tmp_path / 'history.db'), logger)
+
+
+def record(history, version, started, status='DONE', operation='deploy', service=SERVICE, region=REGION, **kwargs):
+    return history.record(service, version, PROJECT, region, operation, status, started, started + 10, **kwargs)
+
+
+def count(history, table):
+    with sqlite3.connect(history.filename) as db:
+        return db.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+
+def test_previous_version_is_latest_successful_deploy(history):
+    record(history, '1-0-0-00', 100)
+    record(history, '1-1-0-00', 200)
+    record(history, '1-2-0-00', 300, status='FAILED')
+    record(history, '1-1-0-00', 400, operation='delete')
+
+    assert history.previous_version(SERVICE, PROJECT, REGION, '1-3-0-00') == '1-1-0-00'
+    # Deployed version itself is never previous
+    assert history.previous_version(SERVICE, PROJECT, REGION, '1-1-0-00') == '1-0-0-00'
+
+
+def test_previous_version_of_existing_resources(history):
+    record(history, '1-0-0-00', 100)
+    record(history, '1-1-0-00', 200)
+
+    assert history.previous_version(SERVICE, PROJECT, REGION, '1-2-0-00', existing=['1-0-0-00']) == '1-0-0-00'
+    assert history.previous_version(SERVICE, PROJECT, REGION, '1-2-0-00', existing=[]) is None
+
+
+def test_previous_version_of_other_service_or_region(history):
+    record(history, '1-0-0-00', 100, service='other-app')
+    record(history, '1-1-0-00', 200, region='asia-southeast1')
+
+    assert history.previous_version(SERVICE, PROJECT, REGION, '1-2-0-00') is None
+
+
+def test_record_same_operation_once(history):
+    assert record(history, '1-0-0-00', 100)
+    assert record(history, '1-0-0-00', 100) is None
+    assert count(history, 'releases') == 1
+
+
+def test_prune_keeps_latest_operations_of_service(tmp_path, logger):
+    history = DeployHistory(str(tmp_path / 'history.db'), logger, keep=3)
+    for started in range(5):
+        record(history, f"1-{started}-0-00", started, steps=[{'name': 'Create', 'started': started, 'duration': 1}],
+               resources={'regionInstanceGroupManagers': [f"{SERVICE}-1-{started}-0-00"]})
+    record(history, '2-0-0-00', 0, service='other-app')
+
+    releases = history.releases(SERVICE, PROJECT, REGION)
+    assert [x['version'] for x in releases] == ['1-4-0-00', '1-3-0-00', '1-2-0-00']
+    # Other services are pruned by their own operations only
+    assert len(history.releases('other-app', PROJECT, REGION)) == 1
+    # Steps and resources of pruned releases are deleted with them
+    assert count(history, 'steps') == 3
+    assert count(history, 'resources') == 3
+
+
+def test_prune_by_age(tmp_path, logger):
+    history = DeployHistory(str(tmp_path / 'history.db'), logger, keep=0, max_age_days=1)
+    record(history, '1-0-0-00', time.time() - 2 * 86400)
+    record(history, '1-1-0-00', time.time())
+
+    assert [x['version'] for x in history.releases(SERVICE, PROJECT, REGION)] == ['1-1-0-00']
+
+
+def result_file(directory, version, start, end='', **bodies):
+    filename = directory / f"{SERVICE}_{version}_{start}.json"
+    definitions = {'metadata': {
+        'service_name': SERVICE, 'version': version, 'start_deploy': start, 'end_deploy': end,
+        'previous_version': None}}
+    definitions.update(bodies)
+    filename.write_text(json.dumps(definitions))
+    return str(filename)
+
+
+def test_import_files(history, tmp_path):
+    files = [
+        result_file(tmp_path, '1-0-0-00', '2026-01-01-10-00', '2026-01-01-10-15',
+                    instance_group_managed={'name': f"{SERVICE}-1-0-0-00"},
+                    backends=[{'name': f"{SERVICE}-app00-1-0-0-00"}, {'name': f"{SERVICE}-app01-1-0-0-00"}]),
+        result_file(tmp_path, '1-1-0-00', '2026-01-02-10-00'),
+    ]
+    boot_timeline = tmp_path / f"{SERVICE}_1-0-0-00_2026-01-01-10-15_boot_timeline.json"
+    boot_timeline.write_text('{}')
+    broken = tmp_path / f"{SERVICE}_broken_file.json"
+    broken.write_text('not json')
+    other = tmp_path / 'other_result_file.json'
+    other.write_text(json.dumps({'metadata': {'start_deploy': '2026-01-01-10-00'}}))
+
+    assert history.import_files(files + [str(boot_timeline), str(broken), str(other)], PROJECT, REGION) == 2
+    releases = {x['version']: x for x in history.releases(SERVICE, PROJECT, REGION)}
+    assert releases['1-0-0-00']['status'] == 'DONE'
+    assert releases['1-0-0-00']['duration'] == 900
+    # Deploy without end time did not finish
+    assert releases['1-1-0-00']['status'] == 'FAILED'
+    assert history.previous_version(SERVICE, PROJECT, REGION, '1-2-0-00') == '1-0-0-00'
+    with sqlite3.connect(history.filename) as db:
+        resources = sorted(db.execute("SELECT kind, name FROM resources").fetchall())
+    assert resources == [
+        ('regionBackendServices', f"{SERVICE}-app00-1-0-0-00"),
+        ('regionBackendServices', f"{SERVICE}-app01-1-0-0-00"),
+        ('regionInstanceGroupManagers', f"{SERVICE}-1-0-0-00"),
+    ]
+    # Imported files are recorded once
+    assert history.import_files(files, PROJECT, REGION) == 0
@@ -0,0 +1,122 @@
+import copy
+import json
+import os
+import pytest
+import yaml
+from metadata import DeploymentMetadata, validate
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'metadata.example.yaml')
+
+
+@pytest.fixture
+def data():
+    with open(EXAMPLE) as file:
+        return yaml.safe_load(file)
+
+
+def test_example_metadata_is_valid(data):
+    assert validate(data) == []
+
+
+def test_not_a_mapping():
+    assert validate(['gcp_project']) == ["metadata: expected mapping, got list"]
+
+
+def test_missing_keys(data):
+    del data['healthcheck_endpoint']
+    del data['gce_instance_group']['autoHealing']['initialDelaySec']
+    del data['service_instances'][1]['port']
+    data['gcp_project']['network'] = None
+    # Optional keys may be missing
+    del data['gce_instance_group']['standby']
+
+    assert validate(data) == [
+        "gcp_project.network: required key is missing",
+        "healthcheck_endpoint: required key is missing",
+        "service_instances[1].port: required key is missing",
+        "gce_instance_group.autoHealing.initialDelaySec: required key is missing",
+    ]
+
+
+def test_wrong_types(data):
+    data['gce_instance_group']['size'] = '3'
+    data['gce_instance']['tags'] = 'tag-1'
+    data['gce_instance_group']['distributionPolicy']['zones'] = [{'zone': 1}]
+    data['gke_cluster'] = 'gke-cluster-name'
+
+    assert validate(data) == [
+        "gce_instance.tags: expected list, got str 'tag-1'",
+        "gce_instance_group.size: expected int, got str '3'",
+        "gce_instance_group.distributionPolicy.zones[0].zone: expected str, got int 1",
+        "gke_cluster: expected dict, got str 'gke-cluster-name'",
+    ]
+
+
+def test_number_accepts_int_and_float(data):
+    data['gce_instance_group']['scaling']['cpuUtilizationTarget'] = 1
+    assert validate(data) == []
+    data['gce_instance_group']['scaling']['cpuUtilizationTarget'] = 0.75
+    assert validate(data) == []
+
+
+def test_bool_is_not_int(data):
+    # YAML yes / on are booleans
+    data['gce_instance_group']['targetSize'] = True
+    data['gce_instance_group']['scaling']['cpuUtilizationTarget'] = False
+    data['history']['keep'] = True
+
+    assert validate(data) == [
+        "gce_instance_group.targetSize: expected int, got bool True",
+        "gce_instance_group.scaling.cpuUtilizationTarget: expected int or float, got bool False",
+        "history.keep: expected int, got bool True",
+    ]
+
+
+def test_int_is_not_bool(data):
+    data['history']['exportJson'] = 1
+    data['gce_instance_group']['scaling']['preScale'] = 'yes'
+
+    assert validate(data) == [
+        "gce_instance_group.scaling.preScale: expected bool, got str 'yes'",
+        "history.exportJson: expected bool, got int 1",
+    ]
+
+
+def test_managed_health_check_parameters(data):
+    data['health_check'] = {'managed': True, 'type': 'HTTP', 'checkIntervalSec': 5}
+
+    assert validate(data) == [
+        "health_check.timeoutSec: required key of managed health checks is missing",
+        "health_check.healthyThreshold: required key of managed health checks is missing",
+        "health_check.unhealthyThreshold: required key of managed health checks is missing",
+    ]
+
+
+def test_instance_flexibility_requires_non_even_shape(data):
+    data['gce_instance_group']['distributionPolicy']['targetShape'] = 'EVEN'
+
+    assert validate(data) == ["gce_instance_group.instanceFlexibility: requires distributionPolicy.targetShape "
+                              "BALANCED, ANY or ANY_SINGLE_ZONE, got EVEN"]
+    data['gce_instance_group']['placement']['enabled'] = True
+    assert validate(data) == []
+
+
+def test_loaded_metadata_is_read_only(logger):
+    metadata = DeploymentMetadata.load(EXAMPLE, logger)
+
+    assert DeploymentMetadata.load(EXAMPLE, logger) is metadata
+    with pytest.raises(AttributeError):
+        metadata.target_size = 10
+    with pytest.raises(TypeError):
+        metadata.metadata['gce_instance_group']['size'] = 10
+    with pytest.raises(TypeError):
+        metadata.service_instances[0]['port'].update({'http': 80})
+    with pytest.raises(TypeError):
+        metadata.health_check.pop('managed')
+    with pytest.raises(AttributeError):
+        metadata.instance_tags.append('tag')
+    # Request bodies with metadata values are serialized, copies can be changed
+    assert json.loads(json.dumps(metadata.metadata))['gce_instance_group']['size'] == metadata.instance_group_size
+    instances = copy.deepcopy(metadata.service_instances)
+    instances[0]['port']['http'] = 80
+    assert metadata.service_instances[0]['port']['http'] == 8080
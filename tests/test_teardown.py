@@ -0,0 +1,34 @@
+import json
+from unittest import mock
+from teardown import TeardownQueue
+
+SERVICE = 'my-app'
+PROJECT = 'gcp-project-id'
+REGION = 'europe-west1'
+
+
+def test_requeue_keeps_deadline(tmp_path, logger):
+    queue = TeardownQueue(str(tmp_path / 'teardown_queue.json'), logger)
+    with mock.patch('teardown.time.time', return_value=1000):
+        queue.add(SERVICE, '1-0-0-00', PROJECT, REGION, 3600)
+    # Next deploy within grace period queues old version again with new one
+    with mock.patch('teardown.time.time', return_value=2000):
+        queue.add(SERVICE, '1-0-0-00', PROJECT, REGION, 3600)
+        queue.add(SERVICE, '1-1-0-00', PROJECT, REGION, 3600)
+
+    entries = {x['version']: x for x in queue.entries(SERVICE, PROJECT, REGION)}
+    assert entries['1-0-0-00']['not_before'] == 4600
+    assert entries['1-1-0-00']['not_before'] == 5600
+    with open(queue.filename) as file:
+        assert len(json.load(file)) == 2
+    with mock.patch('teardown.time.time', return_value=4600):
+        assert [x['version'] for x in queue.due(SERVICE, PROJECT, REGION)] == ['1-0-0-00']
+
+
+def test_same_version_of_other_region_is_queued(tmp_path, logger):
+    queue = TeardownQueue(str(tmp_path / 'teardown_queue.json'), logger)
+    queue.add(SERVICE, '1-0-0-00', PROJECT, REGION, 0)
+    queue.add(SERVICE, '1-0-0-00', PROJECT, 'asia-southeast1', 0)
+
+    assert len(queue.entries(SERVICE, PROJECT, REGION)) == 1
+    assert len(queue.entries(SERVICE, PROJECT, 'asia-southeast1')) == 1
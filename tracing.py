@@ -0,0 +1,229 @@
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+# Span categories
+STEP = 'step'
+API = 'api'
+K8S = 'k8s'
+OPERATION = 'operation'
+STABILIZATION = 'stabilization'
+HEALTHCHECK = 'healthcheck'
+RUN = 'run'
+
+
+class Span:
+    __slots__ = ('id', 'parent', 'trace', 'name', 'category', 'start', 'duration', 'thread', 'args')
+
+    def __init__(self, span_id: int, parent: Optional['Span'], name: str, category: str, args: Dict):
+        self.id = span_id
+        self.parent = parent.id if parent else None
+        self.trace = parent.trace if parent else span_id
+        self.name = name
+        self.category = category
+        self.start = time.time()
+        self.duration = 0.0
+        self.thread = threading.get_ident()
+        self.args = args
+
+    @property
+    def end(self) -> float:
+        return self.start + self.duration
+
+    def to_event(self) -> Dict:
+        """
+        Complete event of Trace Event Format ( chrome://tracing, Perfetto )
+        """
+        return {
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': int(self.start * 1000000),
+            'dur': int(self.duration * 1000000),
+            'pid': os.getpid(),
+            'tid': self.thread,
+            'args': dict(self.args, span=self.id, parent=self.parent),
+        }
+
+
+class Tracer:
+    """
+    Spans of API calls, operation waits and release steps of one process,
+    every span has method, resource, duration, retries and outcome
+    """
+    def __init__(self):
+        self.spans: List[Span] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.subscribers: List[Callable[[str, Span], None]] = []
+
+    def current(self) -> Optional[Span]:
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        current = Span(next(self._ids), self.current(), name, category, args)
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(current)
+        started = time.perf_counter()
+        if self.subscribers:
+            self._notify('start', current)
+        current.args.setdefault('outcome', 'ok')
+        try:
+            yield current
+        except BaseException as exc:
+            status = getattr(getattr(exc, 'resp', None), 'status', None) or getattr(exc, 'status', None)
+            current.args['outcome'] = f"error {status}" if status else f"error {type(exc).__name__}"
+            raise
+        finally:
+            current.duration = time.perf_counter() - started
+            stack.pop()
+            with self._lock:
+                self.spans.append(current)
+            if self.subscribers:
+                self._notify('end', current)
+
+    def subscribe(self, callback: Callable[[str, Span], None]):
+        """
+        Callback of span start and end and of events of running spans ( live progress )
+        """
+        self.subscribers = self.subscribers + [callback]
+
+    def unsubscribe(self, callback: Callable[[str, Span], None]):
+        self.subscribers = [x for x in self.subscribers if x is not callback]
+
+    def _notify(self, kind: str, span: Span):
+        for callback in self.subscribers:
+            callback(kind, span)
+
+    def event(self, kind: str, name: str, category: str, **args):
+        """
+        Instant event of running span ( operation status change, stabilization poll ),
+        sent to subscribers only and not kept in trace
+        """
+        if self.subscribers:
+            self._notify(kind, Span(next(self._ids), self.current(), name, category, args))
+
+    def wrap(self, function: Callable) -> Callable:
+        """
+        Function running in worker thread as child of current span
+        """
+        parent = self.current()
+
+        def attached(*args, **kwargs):
+            stack = self._local.__dict__.setdefault('stack', [])
+            stack.append(parent)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stack.pop()
+        return attached if parent else function
+
+    def finished_spans(self) -> List[Span]:
+        with self._lock:
+            return list(self.spans)
+
+    def trace_spans(self, root: Span) -> List[Span]:
+        with self._lock:
+            return [x for x in self.spans if x.trace == root.trace and x.start >= root.start]
+
+    def prune(self, before: float):
+        """
+        Drop spans finished before time ( long-running process keeps spans of running operations only )
+        """
+        with self._lock:
+            self.spans = [x for x in self.spans if x.end >= before]
+
+    @staticmethod
+    def critical_path(root: Span, spans: List[Span]) -> List[Span]:
+        """
+        Chain of child spans which determines duration of root: starting from the
+        latest finished child, every previous link finished before the next one started
+        """
+        children = sorted([x for x in spans if x.parent == root.id], key=lambda x: x.end, reverse=True)
+        path = []
+        cursor = root.end
+        for child in children:
+            if child.end <= cursor + 0.001:
+                path.append(child)
+                cursor = child.start
+        return list(reversed(path))
+
+    def summary(self, root: Span, logger):
+        spans = self.trace_spans(root)
+        total = root.duration or 1
+        logger.colored("==== Timing of {} ( {:.1f}s ) ====".format(root.name, root.duration), 'Cyan')
+        logger.colored("Critical path:", 'Cyan')
+        logger.colored("{:<40} {:>9} {:>6} {:>9} {:>9} {:>9}".format(
+            'step', 'seconds', '%', 'api', 'operation', 'stable'), 'Light_Purple')
+        for step in self.critical_path(root, spans):
+            inside = [x for x in spans if x.start >= step.start and x.end <= step.end + 0.001 and x is not step]
+            api = sum(x.duration for x in inside if x.category in (API, K8S))
+            operation = sum(x.duration for x in inside if x.category == OPERATION)
+            stable = sum(x.duration for x in inside if x.category == STABILIZATION)
+            logger.colored("{:<40} {:>9.1f} {:>6.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+                step.name[:40], step.duration, step.duration * 100 / total, api, operation, stable), 'Light_Purple')
+
+        methods = {}
+        for x in spans:
+            if x.category in (API, K8S, HEALTHCHECK):
+                method = methods.setdefault((x.category, x.name), {'calls': 0, 'seconds': 0.0, 'max': 0.0,
+                                                                   'retries': 0, 'errors': 0})
+                method['calls'] += 1
+                method['seconds'] += x.duration
+                method['max'] = max(method['max'], x.duration)
+                method['retries'] += x.args.get('retries', 0)
+                method['errors'] += 0 if x.args.get('outcome') == 'ok' else 1
+        logger.colored("Calls:", 'Cyan')
+        logger.colored("{:<56} {:>6} {:>9} {:>8} {:>8} {:>7}".format(
+            'method', 'calls', 'seconds', 'max', 'retries', 'errors'), 'Light_Purple')
+        for (category, name), x in sorted(methods.items(), key=lambda x: x[1]['seconds'], reverse=True):
+            logger.colored("{:<56} {:>6} {:>9.1f} {:>8.2f} {:>8} {:>7}".format(
+                f"{category}: {name}"[:56], x['calls'], x['seconds'], x['max'], x['retries'], x['errors']),
+                'Light_Purple')
+
+    @contextmanager
+    def run(self, name: str, logger, **args):
+        """
+        Span of release operation ( deploy, delete, overview ), timing summary
+        is printed when outermost operation finishes
+        """
+        with self.span(name, RUN, **args) as current:
+            try:
+                yield current
+            finally:
+                if current.parent is None:
+                    current.duration = time.time() - current.start
+                    self.summary(current, logger)
+
+    def drop_to_file(self, filename: str):
+        with self._lock:
+            events = [x.to_event() for x in self.spans]
+        with open(filename, 'w') as file:
+            file.write(json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}))
+
+
+# Tracer of process shared by GCP, GKE, Release and health checks
+tracer = Tracer()
+
+
+def traced(category: str, *resource_args: str):
+    """
+    Method decorator recording span of every call, keyword arguments
+    from resource_args are saved to span
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            resource = {x: kwargs[x] for x in resource_args if x in kwargs}
+            with tracer.span(function.__name__, category, method=function.__name__, **resource):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator